@@ -2,7 +2,15 @@
 from __future__ import unicode_literals
 
 from django.apps import AppConfig
+from django.db.models.signals import post_delete
+from django.db.models.signals import post_save
 
 
 class BrowserConfig(AppConfig):
     name = 'browser'
+
+    def ready(self):
+        # Settings are cached in process, and read again after any change
+        setting = self.get_model('Setting')
+        post_save.connect(setting.invalidate, sender=setting, dispatch_uid='browser_setting_saved')
+        post_delete.connect(setting.invalidate, sender=setting, dispatch_uid='browser_setting_deleted')
@@ -0,0 +1,15 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from browser.lib.api.registry import backend_names
+
+
+def backends(request):
+    """Make the configured storage backends available to all templates, for the navigation links.
+
+    :param django.http.HttpRequest request: request
+
+    :return: template context
+    :rtype: {str: [str]}
+    """
+    return {'backends': backend_names()}
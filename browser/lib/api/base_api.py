@@ -1,17 +1,61 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-from browser.lib.image.simple_image import SimpleImage
-from browser.lib.image.raw_image import RawImage
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+
+from browser.lib.api.timeline import Timeline
+from browser.lib.image.image_formats import image_class
+from browser.lib.index.trigram_index import TrigramIndex
+
+INDEX_REFRESH = 60    # Seconds between two refreshes of the file name index
+MAX_LISTINGS = 16     # Folder listings kept per backend, for the folders browsed lately by all sessions
+# Cached data of an API, reset for each backend configured from the same driver
+SHARED_STATE = (
+    'listings', 'file_index', 'file_index_key', 'file_index_root',
+    'file_index_refreshed', 'timelines', 'phash_index', 'phash_index_key', 'hashing_job',
+)
 
 
 class BaseAPI:
 
+    config = {}                   # Backend options, from the BROWSER_BACKENDS setting
+    root = ''                     # Root directory of remote libraries
+
     # Caching data and sharing between views. Not really scalable to multiple processes, but good enough for local use.
-    path = None                   # Current directory
-    folders = None                # List of folders in directory
-    images = None                 # List of images in directory
-    autocomplete_source = None    # Tree structure for search bar
+    listings = None               # Path -> folders, images and autocomplete source, least recently used first
+    _listings_lock = threading.Lock()
+    file_index = None             # Library-wide file name index
+    file_index_key = None         # Identifier of the indexed library
+    file_index_root = None        # Root directory of the indexed library
+    file_index_refreshed = 0      # Last refresh time of the file name index
+    _index_lock = threading.Lock()
+    _refresh_lock = threading.Lock()
+    _summary_lock = threading.Lock()
+    timelines = None              # Timeline per root directory
+    phash_index = None            # Perceptual hashes of the library
+    phash_index_key = None        # Identifier of the library whose hashes are loaded
+    hashing_job = None            # Last perceptual hashing job
+
+    @classmethod
+    def load(cls):
+        """Initialise the API (e.g. read its configuration), called by the backend registry on first use.
+
+        :return: None
+        :rtype: NoneType
+        """
+
+    @classmethod
+    def watch(cls, root):
+        """Watch the library for changes, if the storage supports it.
+
+        :param str root: root directory of the library
+
+        :return: None
+        :rtype: NoneType
+        """
 
     @classmethod
     def folder_content(cls, path):
@@ -19,29 +63,296 @@ class BaseAPI:
 
         :param str path: path to folder
 
+        Listings are cached per folder and shared by all browsing sessions, so that users browsing different folders
+        don't evict each other's, and users in the same folder share its images (and their processed data).
+
         :return: list of directories and images in the folder, and flattened directory tree structure for search
-        :rtype: [{str: object}], [browser.lib.image.base_image.BaseImage], [str]
+        :rtype: [{str: object}], browser.lib.image.image_listing.ImageListing, [str]
+        """
+        with cls._listings_lock:
+            if cls.listings is None:
+                cls.listings = OrderedDict()
+            listing = cls.listings.pop(path, None)
+            if listing is not None:
+                cls.listings[path] = listing
+                return listing
+
+        # Listing without the lock, not to hold the other sessions up
+        content = cls.list_content(path)
+        listing = (
+            cls.list_folders(path, content), cls.list_images(path, content), cls.list_autocomplete_source(path, content)
+        )
+        with cls._listings_lock:
+            # Keeping the listing of a concurrent request if it was first, whose images may already be processed
+            listing = cls.listings.pop(path, listing)
+            cls.listings[path] = listing
+            while len(cls.listings) > MAX_LISTINGS:
+                cls.listings.popitem(last=False)
+        return listing
+
+    @classmethod
+    def cached_listings(cls):
+        """List the folder listings currently cached.
+
+        :return: path, and folders, images and autocomplete source of each cached folder
+        :rtype: [(str, tuple)]
         """
-        if cls.path != path:
-            content = cls.list_content(path)
-            cls.path = path
-            cls.list_folders(path, content)
-            cls.list_images(path, content)
-            cls.list_autocomplete_source(path, content)
+        with cls._listings_lock:
+            return list((cls.listings or {}).items())
+
+    @classmethod
+    def replace_listing(cls, path, listing):
+        """Replace the cached listing of a folder after a change, if it is still cached.
+
+        :param str path: path to folder
+        :param tuple listing: folders, images and autocomplete source of the folder
+
+        :return: None
+        :rtype: NoneType
+        """
+        with cls._listings_lock:
+            if cls.listings is not None and path in cls.listings:
+                cls.listings[path] = listing
+
+    @classmethod
+    def forget_listings(cls):
+        """Drop all cached folder listings, to list folders again when browsed.
+
+        :return: None
+        :rtype: NoneType
+        """
+        with cls._listings_lock:
+            cls.listings = None
+
+    @classmethod
+    def search_files(cls, root, query, limit=50):
+        """Find the images whose file name contains a text, anywhere under a root directory.
+
+        :param str root: root directory of the library
+        :param str query: text to look for in file names
+        :param int limit: maximum number of results
+
+        :return: directory and name of matching images, none until the index is loaded
+        :rtype: [(str, str)]
+        """
+        index = cls.library_index(root)
+        return [] if index is None else index.search(query, limit=limit)
+
+    @classmethod
+    def library_key(cls, root):
+        """Identifier of a library, to persist its indexes.
+
+        :param str root: root directory of the library
+
+        :return: library identifier
+        :rtype: str
+        """
+        return cls.Meta.name + '_' + hashlib.sha1(root.encode('utf-8')).hexdigest()[:12]
+
+    @classmethod
+    def library_index(cls, root, wait=False):
+        """Get the file name index of the images under a root directory.
+
+        The index is loaded (or built on first use) and then refreshed incrementally in the background, every
+        INDEX_REFRESH seconds at most, so that requests never walk the library: until it is loaded, there is no index.
+
+        :param str root: root directory of the library
+        :param bool wait: True to load and refresh the index right away if needed (e.g. in management commands)
+
+        :return: file name index, None if not loaded yet
+        :rtype: browser.lib.index.trigram_index.TrigramIndex
+        """
+        key = cls.library_key(root)
+        with cls._index_lock:
+            if cls.file_index_key != key:
+                cls.file_index = None
+                cls.file_index_key = key
+                cls.file_index_root = root
+                cls.file_index_refreshed = 0
+            refresh = time.time() - cls.file_index_refreshed > INDEX_REFRESH
+            if refresh:
+                cls.file_index_refreshed = time.time()
+
+        if wait and (refresh or cls.file_index is None):
+            cls._refresh_and_save(root, key)
+        elif refresh:
+            thread = threading.Thread(target=cls._refresh_and_save, args=(root, key))
+            thread.daemon = True
+            thread.start()
 
-        return cls.folders, cls.images, cls.autocomplete_source
+        with cls._index_lock:
+            return cls.file_index if cls.file_index_key == key else None
+
+    @classmethod
+    def _refresh_and_save(cls, root, key):
+        """Load the file name index if needed, refresh it and the folder summaries, and persist them.
+
+        :param str root: root directory of the library
+        :param str key: index identifier
+
+        :return: None
+        :rtype: NoneType
+        """
+        # Imported on first use, not to load PIL at startup
+        from browser.lib.index.folder_summary import summarize_folders
+
+        # One refresh at a time: a caller waiting for the index doesn't list the library alongside a background one
+        with cls._refresh_lock:
+            with cls._index_lock:
+                index = cls.file_index if cls.file_index_key == key else None
+            if index is None:
+                index = TrigramIndex.load(key)
+                with cls._index_lock:
+                    if cls.file_index_key != key:
+                        return
+                    if cls.file_index is None:
+                        cls.file_index = index
+                    index = cls.file_index
+            # A persisted index is searchable right away, an empty one fills up as directories are read
+            cls.refresh_file_index(index, root)
+        # A summary pass can outlast the refresh interval: not starting another one meanwhile
+        if cls._summary_lock.acquire(False):
+            try:
+                summarize_folders(cls, index, root)
+            finally:
+                cls._summary_lock.release()
+        index.save(key)
+
+    @classmethod
+    def summary_folders(cls, index, root):
+        """List the folders of a library to summarise, with their version (see summarize_folders).
+
+        :param browser.lib.index.trigram_index.TrigramIndex index: file name index, just refreshed
+        :param str root: root directory of the library
+
+        :return: (folder, version) tuples
+        :rtype: [(str, object)]
+        """
+        return cls.timeline_folders(root)
+
+    @classmethod
+    def folder_summaries(cls, root, folders):
+        """Find the summaries of folders (image count, total size, date range and cover of everything under them).
+
+        Summaries are computed in the background when refreshing the library index: nothing is read here, and folders
+        not summarised yet (or all of them, while the index is loading) get None.
+
+        :param str root: root directory of the library
+        :param [str] folders: folder paths
+
+        :return: summary of each folder
+        :rtype: [{str: object}]
+        """
+        index = cls.library_index(root)
+        totals = {} if index is None else index.totals
+        return [totals.get(folder) for folder in folders]
+
+    @classmethod
+    def perceptual_index(cls, root):
+        """Get the perceptual hash index of the images under a root directory.
+
+        :param str root: root directory of the library
+
+        :return: perceptual hash index, empty until hash_library was run
+        :rtype: browser.lib.index.phash_index.PerceptualHashIndex
+        """
+        # Imported on first use, not to load numpy at startup
+        from browser.lib.index.phash_index import PerceptualHashIndex
+
+        key = cls.library_key(root)
+        with cls._index_lock:
+            if cls.phash_index_key != key:
+                cls.phash_index = PerceptualHashIndex.load(key)
+                cls.phash_index_key = key
+            return cls.phash_index
+
+    @classmethod
+    def hash_library(cls, root, background=True, progress=None):
+        """Compute the perceptual hashes of the images under a root directory, unless already running.
+
+        :param str root: root directory of the library
+        :param bool background: True to run in a background thread, False to block until done
+        :param method progress: optional callback, called with the job status after each image
+
+        :return: hashing job
+        :rtype: browser.lib.index.phash_index.HashingJob
+        """
+        from browser.lib.index.phash_index import HashingJob
+
+        index = cls.perceptual_index(root)
+        with cls._index_lock:
+            if cls.hashing_job is not None and cls.hashing_job.state in ('pending', 'running'):
+                return cls.hashing_job
+            cls.hashing_job = HashingJob(cls, index, cls.library_key(root), root)
+        job = cls.hashing_job
+        if background:
+            job.start()
+        else:
+            job.run(progress=progress)
+        return job
+
+    @classmethod
+    def similar_images(cls, root, image, max_distance=None):
+        """Find the images of a library which look like a given one, according to their perceptual hashes.
+
+        :param str root: root directory of the library
+        :param browser.lib.image.base_image.BaseImage image: image
+        :param int max_distance: maximum Hamming distance between hashes, None for the default one
+
+        :return: (directory, name) and distance of the similar images, closest first
+        :rtype: [((str, str), int)]
+        """
+        from browser.lib.index.phash_index import DUPLICATE_DISTANCE
+        from browser.lib.index.phash_index import dhash
+        from PIL import Image
+
+        image.save_thumbnail()
+        value = dhash(Image.open(image.thumbnail_name()))
+        if max_distance is None:
+            max_distance = DUPLICATE_DISTANCE
+        results = cls.perceptual_index(root).similar(value, max_distance)
+        return [(source, distance) for source, distance in results if source != (image.path, image.name)]
+
+    @classmethod
+    def timeline(cls, root):
+        """Get the chronological view of all images under a root directory.
+
+        :param str root: root directory
+
+        :return: timeline
+        :rtype: browser.lib.api.timeline.Timeline
+        """
+        with cls._index_lock:
+            if cls.timelines is None:
+                cls.timelines = {}
+            if root not in cls.timelines:
+                cls.timelines[root] = Timeline(lambda: cls.timeline_folders(root), cls.dated_images)
+            return cls.timelines[root]
+
+    @classmethod
+    def invalidate_timelines(cls):
+        """Make the timelines list their folders again, after a change in the library.
+
+        :return: None
+        :rtype: NoneType
+        """
+        with cls._index_lock:
+            timelines = list((cls.timelines or {}).values())
+        for timeline in timelines:
+            timeline.invalidate()
 
     @classmethod
-    def create_image(cls, image_id, path, name, process=False):
+    def create_image(cls, image_id, path, name, process=False, stat=None):
         """Create an image object depending on the file format.
 
         :param int image_id: id of the image in folder
         :param str path: root directory
         :param str name: image file name
         :param bool process: flag to process (i.e. decode) the image
+        :param tuple stat: modification time and size of the image file, if known from the listing
 
         :return: image object
         :rtype: browser.lib.image.base_image.BaseImage
         """
-        image_class = RawImage if RawImage.is_raw(name) else SimpleImage
-        return image_class(image_id, path, name, cls.file_stream(), api_metadata=cls.Meta, process=process)
+        image_type = image_class(name)
+        return image_type(image_id, path, name, cls.file_stream(), api_metadata=cls.Meta, process=process, stat=stat)
@@ -5,12 +5,14 @@ import os
 import requests
 import yaml
 
-from browser.lib.api.base_api import BaseAPI
+from browser.lib.api.listing_api import ListingAPI
+from browser.lib.image.image_listing import ImageListing
 
 CREDENTIAL_FILE = os.path.dirname(__file__) + '/credentials.yml'
+API_URL = 'https://api.hubic.com'
 
 
-class HubicAPI(BaseAPI):
+class HubicAPI(ListingAPI):
     """Provide a HubiC authentication interface.
 
     References:
@@ -21,7 +23,8 @@ class HubicAPI(BaseAPI):
         - an app declared and allowed on your Hubic account
         - a refresh token to query the Hubic API
 
-    Read the above references to set it up.
+    Read the above references to set it up. The credentials are read from credentials.yml, unless given as backend
+    options (client_id, secret and refresh_token), along with api_url to use another server than Hubic's.
     """
 
     class Meta:
@@ -46,10 +49,10 @@ class HubicAPI(BaseAPI):
         :param str path: current path
         :param [object] content: current folder contents
 
-        :return: None
-        :rtype: NoneType
+        :return: folders, with their label, path and last modification date
+        :rtype: [{str: object}]
         """
-        cls.folders = [
+        return [
             {
                 'label': el['name'].replace(path + '/', ''),
                 'value': el['name'],
@@ -65,13 +68,18 @@ class HubicAPI(BaseAPI):
         :param str path: current path
         :param [object] content: current folder contents
 
-        :return: None
-        :rtype: NoneType
+        :return: images
+        :rtype: browser.lib.image.image_listing.ImageListing
         """
-        cls.images = [
-            cls.create_image(i, path, el['name'].replace(path + '/', ''), process=False)
-            for i, el in enumerate([el for el in content if cls.is_path_image(el, path)])
-        ]
+        entries = [el for el in content if cls.is_path_image(el, path)]
+        return ImageListing(
+            path,
+            [el['name'].replace(path + '/', '') for el in entries],
+            cls.create_image,
+            cls.Meta,
+            mtimes=[el['last_modified'] for el in entries],
+            sizes=[el['bytes'] for el in entries],
+        )
 
     @classmethod
     def list_autocomplete_source(cls, path, content):
@@ -83,7 +91,19 @@ class HubicAPI(BaseAPI):
         :return: list of directories
         :rtype: [str]
         """
-        cls.autocomplete_source = [el['name'] for el in content if cls.is_dir(el) and cls.is_under_path(el, path)]
+        return [el['name'] for el in content if cls.is_dir(el) and cls.is_under_path(el, path)]
+
+    @classmethod
+    def is_listed_image(cls, entry, root):
+        """Check if a listing entry is an image to display, under a root directory.
+
+        :param {str: object} entry: json entry in Hubic
+        :param str root: root directory
+
+        :return: True if displayed image under root
+        :rtype: bool
+        """
+        return cls.is_image(entry) and cls.is_under_path(entry, root) and not entry['name'].startswith('.')
 
     @classmethod
     def is_dir(cls, entry):
@@ -171,7 +191,7 @@ class HubicAPI(BaseAPI):
         :rtype: dict
         """
         if cls.auth_token is None:
-            cls.fetch_credentials(session)
+            cls.fetch_credentials()
 
         return {
             'X-Auth-Token': cls.auth_token,
@@ -190,7 +210,10 @@ class HubicAPI(BaseAPI):
             "grant_type": "refresh_token",
         }
         r = requests.post(
-            "https://api.hubic.com/oauth/token", data=data, auth=requests.auth.HTTPBasicAuth(cls.client_id, cls.secret))
+            cls.config.get('api_url', API_URL) + "/oauth/token",
+            data=data,
+            auth=requests.auth.HTTPBasicAuth(cls.client_id, cls.secret),
+        )
         cls.access_token = r.json()['access_token']
 
     @classmethod
@@ -213,7 +236,8 @@ class HubicAPI(BaseAPI):
         """
         cls.refresh_access_token()
         headers = {"Authorization": "Bearer {}".format(cls.access_token)}
-        credentials = requests.get("https://api.hubic.com/1.0/account/credentials", headers=headers).json()
+        url = cls.config.get('api_url', API_URL) + "/1.0/account/credentials"
+        credentials = requests.get(url, headers=headers).json()
         cls.endpoint = credentials['endpoint']
         cls.auth_token = credentials['token']
 
@@ -224,9 +248,11 @@ class HubicAPI(BaseAPI):
         :return: None
         :rtype: NoneType
         """
-        # Crendentials
-        with open(CREDENTIAL_FILE, 'r') as local_stream:
-            credentials = yaml.load(local_stream)['hubic']
+        # Crendentials, from the backend options (e.g. for a stand-in server) or the credentials file
+        credentials = cls.config
+        if not all(key in credentials for key in ('client_id', 'secret', 'refresh_token')):
+            with open(CREDENTIAL_FILE, 'r') as local_stream:
+                credentials = yaml.safe_load(local_stream)['hubic']
         cls.client_id = credentials['client_id']
         cls.secret = credentials['secret']
         cls.refresh_token = credentials['refresh_token']
@@ -255,6 +281,3 @@ class HubicAPI(BaseAPI):
             return cStringIO.StringIO(resp.content)
 
         return read_file
-
-
-HubicAPI.load()
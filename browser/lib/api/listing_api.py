@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import calendar
+import os
+from datetime import datetime
+
+from browser.lib.api.base_api import BaseAPI
+
+
+class ListingAPI(BaseAPI):
+    """
+    Common ground of the remote backends listing a whole container at once (e.g. Hubic, Swift or S3 object stores).
+
+    The file name index, the timeline and the folder summaries are all derived from the container listing, whose
+    entries are dicts with name, bytes and last_modified keys. Drivers only implement the transport: listing the
+    container (list_content), telling which entries are images (is_listed_image), and reading the files.
+    """
+
+    @classmethod
+    def is_listed_image(cls, entry, root):
+        """Check if a listing entry is an image to display, under a root directory.
+
+        :param {str: object} entry: container listing entry
+        :param str root: root directory
+
+        :return: True if displayed image under root
+        :rtype: bool
+        """
+        raise NotImplementedError
+
+    @classmethod
+    def listed_images(cls, root):
+        """List the images under a root directory, from the container listing.
+
+        :param str root: root directory
+
+        :return: listing entries of the images
+        :rtype: [{str: object}]
+        """
+        return [el for el in cls.list_content(root) if cls.is_listed_image(el, root)]
+
+    @classmethod
+    def refresh_file_index(cls, index, root):
+        """Incrementally update the file name index with the images under root, from the container listing.
+
+        :param browser.lib.index.trigram_index.TrigramIndex index: file name index
+        :param str root: root directory
+
+        :return: None
+        :rtype: NoneType
+        """
+        listed = set(os.path.split(el['name']) for el in cls.listed_images(root))
+        indexed = index.all_files()
+        for directory, name in indexed - listed:
+            index.remove(directory, name)
+        for directory, name in listed - indexed:
+            index.add(directory, name)
+
+    @classmethod
+    def timeline_folders(cls, root):
+        """List the folders of a tree from the container listing, for the timeline.
+
+        :param str root: root directory
+
+        :return: (folder, listing version) tuples
+        :rtype: [(str, tuple)]
+        """
+        folders = {}
+        for el in cls.listed_images(root):
+            folder, name = os.path.split(el['name'])
+            folders.setdefault(folder, []).append((cls.parse_date(el['last_modified']), name, el['bytes']))
+        return [(folder, tuple(sorted(images))) for folder, images in folders.items()]
+
+    @classmethod
+    def dated_images(cls, path, version):
+        """List the images of a folder with their date, from the container listing it was versioned with.
+
+        :param str path: folder
+        :param tuple version: (timestamp, name, size) of the images of the folder, from timeline_folders
+
+        :return: (timestamp, name) tuples
+        :rtype: [(float, str)]
+        """
+        return [(ts, name) for ts, name, _ in version]
+
+    @classmethod
+    def image_stats(cls, path, version):
+        """List the images of a folder with their date and size, from the container listing it was versioned with.
+
+        :param str path: folder
+        :param tuple version: (timestamp, name, size) of the images of the folder, from timeline_folders
+
+        :return: (timestamp, size, name) tuples
+        :rtype: [(float, int, str)]
+        """
+        return [(ts, size, name) for ts, name, size in version]
+
+    @staticmethod
+    def parse_date(date):
+        """Convert a listing date to a timestamp.
+
+        :param str date: ISO formatted UTC date, e.g. 2017-05-20T16:06:12.345678 (swift) or 2017-05-20T16:06:12.000Z
+
+        :return: timestamp
+        :rtype: int
+        """
+        return calendar.timegm(datetime.strptime(date[:19], '%Y-%m-%dT%H:%M:%S').timetuple())
@@ -1,14 +1,16 @@
 # -*- coding: utf-8 -*-
 
+import errno
 import os
+import threading
 from datetime import datetime
 
 from browser.lib.api.base_api import BaseAPI
+from browser.lib.api.watcher import start_watcher
 
-from browser.lib.image.simple_image import SimpleImage
-from browser.lib.image.simple_image import SIMPLE_FORMATS
-from browser.lib.image.raw_image import RawImage
-from browser.lib.image.raw_image import RAW_FORMATS
+from browser.lib.image.base_image import BaseImage
+from browser.lib.image.image_formats import is_supported
+from browser.lib.image.image_listing import ImageListing
 
 TREE_MAX_DEPTH = 4
 
@@ -19,6 +21,111 @@ class LocalAPI(BaseAPI):
         name = 'local'
         remote = False
 
+    watcher = None                # File system watcher of the library
+    _watch_lock = threading.Lock()
+
+    @classmethod
+    def watch(cls, root):
+        """Watch the library for changes, to keep listings, indexes and caches up to date without rescans.
+
+        :param str root: root directory of the library
+
+        :return: None
+        :rtype: NoneType
+        """
+        with cls._watch_lock:
+            if cls.watcher is not None and cls.watcher.root == root:
+                return
+            if cls.watcher is not None:
+                cls.watcher.stop()
+            cls.watcher = start_watcher(root, cls.apply_change, cls.should_display_folder)
+
+    @classmethod
+    def apply_change(cls, kind, directory, name, is_dir):
+        """Incrementally update the cached data affected by a change in the library.
+
+        :param str kind: 'created', 'modified', 'deleted', or 'rescan' if changes were lost
+        :param str directory: directory of the changed entry
+        :param str name: name of the changed entry
+        :param bool is_dir: True if the entry is a directory
+
+        :return: None
+        :rtype: NoneType
+        """
+        cls.invalidate_timelines()
+        if kind == 'rescan':
+            cls.forget_listings()
+            if cls.file_index is not None:
+                cls.refresh_file_index(cls.file_index, cls.file_index_root)
+            return
+        # Hidden files include our own thumbnails
+        if name.startswith('.'):
+            return
+
+        full_path = os.path.join(directory, name)
+        if is_dir:
+            cls.update_directory_tree(kind, full_path)
+        elif cls.should_display_image(name):
+            if kind != 'created':
+                BaseImage.forget(cls.Meta, directory, name)
+            index = cls.file_index
+            if index is not None and cls.is_indexed(full_path):
+                # Files modified in place don't change the folder modification time, the summary version
+                index.outdate_summary(directory)
+                if kind == 'deleted':
+                    index.remove(directory, name)
+                else:
+                    index.add(directory, name)
+        else:
+            return
+
+        # Listing the folder again if it is cached, which is only one directory read
+        for path, (_, _, source) in cls.cached_listings():
+            if os.path.normpath(directory) == os.path.normpath(path):
+                content = cls.list_content(path)
+                cls.replace_listing(path, (cls.list_folders(path, content), cls.list_images(path, content), source))
+
+    @classmethod
+    def is_indexed(cls, full_path):
+        """Check if a path belongs to the library of the file name index.
+
+        :param str full_path: path of a file or directory
+
+        :return: True if under the root of the index
+        :rtype: bool
+        """
+        root = cls.file_index_root
+        return root is not None and (full_path == root or full_path.startswith(root.rstrip(os.sep) + os.sep))
+
+    @classmethod
+    def update_directory_tree(cls, kind, full_path):
+        """Update the directory index (autocomplete source and file name index) after a directory change.
+
+        :param str kind: 'created', 'modified' or 'deleted'
+        :param str full_path: path of the directory
+
+        :return: None
+        :rtype: NoneType
+        """
+        if kind == 'modified':
+            return
+        index = cls.file_index
+        if index is not None and cls.is_indexed(full_path):
+            if kind == 'deleted':
+                index.remove_directory(full_path)
+            else:
+                cls.refresh_file_index(index, full_path)
+
+        prefix = full_path + '/'
+        for path, (folders, images, source) in cls.cached_listings():
+            if not full_path.startswith(path.rstrip('/') + '/'):
+                continue
+            source = [f for f in source if f != full_path and not f.startswith(prefix)]
+            depth = full_path[len(path.rstrip('/')):].count('/')
+            if kind == 'created' and depth <= TREE_MAX_DEPTH and cls.should_display_folder(*os.path.split(full_path)):
+                source = source + [full_path] + cls.flatten_directory_tree(full_path, max_depth=TREE_MAX_DEPTH - depth)
+            cls.replace_listing(path, (folders, images, source))
+
     @classmethod
     def list_content(cls, path):
         """List directory contents needed to enumerate files and folders.
@@ -37,10 +144,10 @@ class LocalAPI(BaseAPI):
         :param str path: current path
         :param [object] content: current folder contents
 
-        :return: None
-        :rtype: NoneType
+        :return: folders, with their label, path and last modification date
+        :rtype: [{str: object}]
         """
-        cls.folders = [
+        return [
             {
                 'label': f,
                 'value': os.path.join(path, f),
@@ -56,13 +163,10 @@ class LocalAPI(BaseAPI):
         :param str path: current path
         :param [object] content: current folder contents
 
-        :return: None
-        :rtype: NoneType
+        :return: images
+        :rtype: browser.lib.image.image_listing.ImageListing
         """
-        cls.images = [
-            cls.create_image(i, path, name, process=False)
-            for i, name in enumerate([f for f in content if cls.should_display_image(f)])
-        ]
+        return ImageListing(path, [f for f in content if cls.should_display_image(f)], cls.create_image, cls.Meta)
 
     @classmethod
     def list_autocomplete_source(cls, path, content):
@@ -74,7 +178,116 @@ class LocalAPI(BaseAPI):
         :return: list of directories
         :rtype: [str]
         """
-        cls.autocomplete_source = cls.flatten_directory_tree(path)
+        return cls.flatten_directory_tree(path)
+
+    @classmethod
+    def refresh_file_index(cls, index, root):
+        """Incrementally update the file name index with the images under root.
+
+        Directories whose modification time did not change since the last refresh are not listed again: their known
+        sub directories are visited directly, so that an unchanged tree only costs one stat per directory.
+
+        :param browser.lib.index.trigram_index.TrigramIndex index: file name index
+        :param str root: root directory
+
+        :return: None
+        :rtype: NoneType
+        """
+        stack = [root]
+        while stack:
+            path = stack.pop()
+            try:
+                mtime = os.path.getmtime(path)
+            except OSError:
+                index.remove_directory(path)
+                continue
+            known = index.folder(path)
+            if known is not None and known[0] == mtime:
+                stack.extend(known[1])
+                continue
+
+            content = os.listdir(path)
+            sub_dirs = [
+                os.path.join(path, f) for f in content
+                if os.path.isdir(os.path.join(path, f)) and not os.path.islink(os.path.join(path, f)) and
+                cls.should_display_folder(path, f)
+            ]
+            names = set(f for f in content if cls.should_display_image(f))
+            indexed = index.files_in(path)
+            for name in indexed - names:
+                index.remove(path, name)
+            for name in names - indexed:
+                index.add(path, name)
+            for sub_dir in set(known[1] if known else []) - set(sub_dirs):
+                index.remove_directory(sub_dir)
+            index.set_folder(path, mtime, sub_dirs)
+            stack.extend(sub_dirs)
+
+    @classmethod
+    def summary_folders(cls, index, root):
+        """List the folders of the library with their modification time, from the last refresh of the index.
+
+        The refresh only lists the directories which changed: reusing its result avoids walking the library again.
+
+        :param browser.lib.index.trigram_index.TrigramIndex index: file name index, just refreshed
+        :param str root: root directory of the library
+
+        :return: (folder, modification time) tuples
+        :rtype: [(str, float)]
+        """
+        prefix = root.rstrip(os.sep) + os.sep
+        return [(path, mtime) for path, mtime in index.folder_times() if path == root or path.startswith(prefix)]
+
+    @classmethod
+    def timeline_folders(cls, root):
+        """Walk the folders of a tree, for the timeline.
+
+        :param str root: root directory
+
+        :return: (folder, modification time) tuples
+        :rtype: iterator
+        """
+        for path, dirs, _ in os.walk(root):
+            dirs[:] = [d for d in dirs if cls.should_display_folder(path, d)]
+            yield path, os.path.getmtime(path)
+
+    @classmethod
+    def dated_images(cls, path, version=None):
+        """List the images of a folder with their date, for the timeline.
+
+        File modification time stands for capture date: reading it is a single stat, when EXIF dates would require
+        opening every file of the tree.
+
+        :param str path: folder
+        :param float version: folder modification time, unused
+
+        :return: (timestamp, name) tuples
+        :rtype: [(float, str)]
+        """
+        return [(mtime, f) for mtime, _, f in cls.image_stats(path)]
+
+    @classmethod
+    def image_stats(cls, path, version=None):
+        """List the images of a folder with their date and size, for the folder summaries.
+
+        :param str path: folder
+        :param float version: folder modification time, unused
+
+        :return: (timestamp, size, name) tuples
+        :rtype: [(float, int, str)]
+        """
+        stats = []
+        for f in os.listdir(path):
+            if cls.should_display_image(f):
+                try:
+                    stat = os.stat(os.path.join(path, f))
+                except OSError as e:
+                    # Deleted since listed
+                    if e.errno == errno.ENOENT:
+                        continue
+                    raise
+                stats.append((stat.st_mtime, stat.st_size, f))
+        return stats
 
     @classmethod
     def flatten_directory_tree(cls, path, max_depth=TREE_MAX_DEPTH):
@@ -109,7 +322,7 @@ class LocalAPI(BaseAPI):
         """
         if name.startswith('.'):
             return False
-        return os.path.splitext(name)[1].lower() in SIMPLE_FORMATS + RAW_FORMATS
+        return is_supported(name)
 
     @classmethod
     def should_display_folder(cls, path, name):
@@ -0,0 +1,328 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import cStringIO
+import os
+import threading
+import time
+import urllib
+import xml.etree.ElementTree as ElementTree
+from email.utils import mktime_tz
+from email.utils import parsedate_tz
+
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+from browser.lib.api.listing_api import ListingAPI
+from browser.lib.image.image_formats import is_supported
+from browser.lib.image.image_listing import ImageListing
+
+LISTING_TTL = 30.               # Seconds a container listing is reused before listing the container again
+SWIFT_PAGE = 10000              # Objects per listing request, Swift maximum
+S3_PAGE = 1000                  # Objects per listing request, S3 maximum
+RANGE_SIZE = 8 * 1024 ** 2      # Bytes per ranged GET, objects bigger than that are read in parallel parts
+N_RANGE_WORKERS = 4             # Parallel ranged GETs per object
+TIMEOUT = 30.                   # Seconds before giving up on a request
+
+
+class ObjectStoreAPI(ListingAPI):
+    """
+    Generic driver for Swift or S3 compatible object stores, declared in the BROWSER_BACKENDS setting, e.g.
+
+        'photos': {
+            'class': 'browser.lib.api.object_store_api.ObjectStoreAPI',
+            'protocol': 'swift',                                  # or 's3', for unauthenticated S3 requests
+            'endpoint': 'http://127.0.0.1:8900/v1/AUTH_test',     # account URL (swift) or service URL (s3)
+            'container': 'photos',                                # container (swift) or bucket (s3)
+            'token': None,                                        # optional, sent as X-Auth-Token
+            'range_size': 8388608,                                # optional, bytes per ranged GET
+            'range_workers': 4,                                   # optional, parallel ranged GETs per object
+        }
+
+    Folders are derived from the '/' separated object names. Object sizes and dates come from the container listing,
+    or from HEAD requests, and large objects (e.g. raw files) are fetched with parallel ranged GETs.
+    """
+
+    class Meta:
+        name = 'object_store'
+        remote = True
+
+    @classmethod
+    def load(cls):
+        """Check the configuration, and reset the connections and cached listing.
+
+        :return: None
+        :rtype: NoneType
+        """
+        for option in ('endpoint', 'container'):
+            if not cls.config.get(option):
+                raise ValueError('Missing {} option'.format(option))
+        if cls.config.get('protocol', 'swift') not in ('swift', 's3'):
+            raise ValueError('Unsupported protocol: {}'.format(cls.config['protocol']))
+        cls.range_size = int(cls.config.get('range_size', RANGE_SIZE))
+        cls.range_workers = int(cls.config.get('range_workers', N_RANGE_WORKERS))
+        # Connections are kept alive and shared by the threads reading objects
+        cls.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=4 * cls.range_workers)
+        cls.session.mount('http://', adapter)
+        cls.session.mount('https://', adapter)
+        cls.listing = None
+        cls.listing_time = 0
+        cls.object_sizes = {}
+        cls._listing_lock = threading.Lock()
+
+    @classmethod
+    def container_url(cls):
+        return cls.config['endpoint'].rstrip('/') + '/' + cls.config['container']
+
+    @classmethod
+    def object_url(cls, name):
+        return cls.container_url() + '/' + urllib.quote(name.lstrip('/').encode('utf-8'))
+
+    @classmethod
+    def headers(cls):
+        """Get the authentication headers.
+
+        :return: request headers
+        :rtype: {str: str}
+        """
+        token = cls.config.get('token')
+        return {'X-Auth-Token': token} if token else {}
+
+    @classmethod
+    def list_content(cls, path):
+        """List all objects of the container, reusing the last listing for LISTING_TTL seconds.
+
+        :param str path: path to directory (the whole container is listed anyway)
+
+        :return: objects, as dicts with name, bytes and last_modified keys
+        :rtype: [{str: object}]
+        """
+        with cls._listing_lock:
+            if cls.listing is None or time.time() - cls.listing_time > LISTING_TTL:
+                if cls.config.get('protocol', 'swift') == 's3':
+                    cls.listing = cls.list_s3_objects()
+                else:
+                    cls.listing = cls.list_swift_objects()
+                cls.listing_time = time.time()
+                cls.object_sizes = {el['name']: el['bytes'] for el in cls.listing}
+            return cls.listing
+
+    @classmethod
+    def list_swift_objects(cls):
+        """List the objects of a Swift container, page by page.
+
+        :return: objects
+        :rtype: [{str: object}]
+        """
+        objects = []
+        marker = None
+        while True:
+            params = {'format': 'json', 'limit': SWIFT_PAGE}
+            if marker is not None:
+                params['marker'] = marker
+            response = cls.session.get(cls.container_url(), params=params, headers=cls.headers(), timeout=TIMEOUT)
+            response.raise_for_status()
+            page = response.json() if response.status_code != 204 else []
+            objects.extend(
+                {'name': el['name'], 'bytes': el['bytes'], 'last_modified': el['last_modified']}
+                for el in page if el.get('content_type') != 'application/directory'
+            )
+            if len(page) < SWIFT_PAGE:
+                return objects
+            # Resuming after the last listed entry, even if it was skipped (directory markers)
+            marker = page[-1]['name']
+
+    @classmethod
+    def list_s3_objects(cls):
+        """List the objects of an S3 bucket (ListObjectsV2), page by page.
+
+        :return: objects
+        :rtype: [{str: object}]
+        """
+        objects = []
+        token = None
+        while True:
+            params = {'list-type': 2, 'max-keys': S3_PAGE}
+            if token is not None:
+                params['continuation-token'] = token
+            response = cls.session.get(cls.container_url(), params=params, headers=cls.headers(), timeout=TIMEOUT)
+            response.raise_for_status()
+            root = ElementTree.fromstring(response.content)
+            # Ignoring XML namespaces, which differ between S3 implementations
+            for element in root.iter():
+                element.tag = element.tag.rsplit('}', 1)[-1]
+            objects.extend(
+                {
+                    'name': el.findtext('Key'),
+                    'bytes': int(el.findtext('Size')),
+                    'last_modified': el.findtext('LastModified'),
+                }
+                for el in root.findall('Contents') if not el.findtext('Key').endswith('/')
+            )
+            token = root.findtext('NextContinuationToken')
+            if root.findtext('IsTruncated') != 'true' or not token:
+                return objects
+
+    @classmethod
+    def list_folders(cls, path, content):
+        """List folders under path, derived from object names.
+
+        :param str path: current path
+        :param [object] content: container listing
+
+        :return: folders, with their label and path
+        :rtype: [{str: object}]
+        """
+        prefix = path + '/' if path else ''
+        names = set(
+            el['name'][len(prefix):].split('/', 1)[0] for el in content
+            if el['name'].startswith(prefix) and '/' in el['name'][len(prefix):]
+        )
+        return [
+            {'label': name, 'value': prefix + name} for name in sorted(names) if not name.startswith('.')
+        ]
+
+    @classmethod
+    def list_images(cls, path, content):
+        """List images under path.
+
+        :param str path: current path
+        :param [object] content: container listing
+
+        :return: images
+        :rtype: browser.lib.image.image_listing.ImageListing
+        """
+        entries = [el for el in content if os.path.dirname(el['name']) == path and cls.is_image(el['name'])]
+        return ImageListing(
+            path,
+            [os.path.basename(el['name']) for el in entries],
+            cls.create_image,
+            cls.Meta,
+            mtimes=[el['last_modified'] for el in entries],
+            sizes=[el['bytes'] for el in entries],
+        )
+
+    @classmethod
+    def list_autocomplete_source(cls, path, content):
+        """Find all directories under path, to use in the autocomplete feature.
+
+        :param str path: directory to scan
+        :param [object] content: container listing
+
+        :return: list of directories
+        :rtype: [str]
+        """
+        directories = set()
+        for el in content:
+            directory = os.path.dirname(el['name'])
+            while directory and directory not in directories and directory.startswith(path):
+                directories.add(directory)
+                directory = os.path.dirname(directory)
+        return sorted(directories)
+
+    @classmethod
+    def is_listed_image(cls, entry, root):
+        """Check if a listing entry is an image to display, under a root directory.
+
+        :param {str: object} entry: container listing entry
+        :param str root: root directory
+
+        :return: True if displayed image under root
+        :rtype: bool
+        """
+        return entry['name'].startswith(root) and cls.is_image(entry['name'])
+
+    @staticmethod
+    def is_image(name):
+        """Check if an object is an image which can be displayed.
+
+        :param str name: object name
+
+        :return: True if image
+        :rtype: bool
+        """
+        return is_supported(name) and not os.path.basename(name).startswith('.')
+
+    @classmethod
+    def head(cls, name):
+        """Get the metadata of an object, without downloading it.
+
+        :param str name: object name
+
+        :return: size in bytes, modification timestamp, etag, content type, and whether ranged GETs are supported
+        :rtype: {str: object}
+        """
+        response = cls.session.head(cls.object_url(name), headers=cls.headers(), timeout=TIMEOUT)
+        response.raise_for_status()
+        last_modified = response.headers.get('Last-Modified')
+        return {
+            'bytes': int(response.headers['Content-Length']),
+            'last_modified': mktime_tz(parsedate_tz(last_modified)) if last_modified else None,
+            'etag': response.headers.get('ETag', '').strip('"'),
+            'content_type': response.headers.get('Content-Type'),
+            'ranges': response.headers.get('Accept-Ranges') == 'bytes',
+        }
+
+    @classmethod
+    def read(cls, name):
+        """Download an object, with parallel ranged GETs if it is large.
+
+        :param str name: object name
+
+        :return: object content
+        :rtype: bytes
+        """
+        name = name.lstrip('/')
+        size = cls.object_sizes.get(name)
+        ranges = True
+        if size is None:
+            metadata = cls.head(name)
+            size, ranges = metadata['bytes'], metadata['ranges']
+
+        if size <= cls.range_size or not ranges:
+            response = cls.session.get(cls.object_url(name), headers=cls.headers(), timeout=TIMEOUT)
+            response.raise_for_status()
+            return response.content
+        starts = range(0, size, cls.range_size)
+        ends = [min(start + cls.range_size, size) - 1 for start in starts]
+        with ThreadPoolExecutor(min(cls.range_workers, len(starts))) as executor:
+            return b''.join(executor.map(cls.read_range, [name] * len(starts), starts, ends))
+
+    @classmethod
+    def read_range(cls, name, first, last):
+        """Download a part of an object.
+
+        :param str name: object name
+        :param int first: first byte
+        :param int last: last byte (included)
+
+        :return: part of the object content
+        :rtype: bytes
+        """
+        headers = dict(cls.headers(), Range='bytes={}-{}'.format(first, last))
+        response = cls.session.get(cls.object_url(name), headers=headers, timeout=TIMEOUT)
+        response.raise_for_status()
+        if response.status_code != 206:
+            # Range ignored by the server: the whole object was sent
+            return response.content[first:last + 1]
+        return response.content
+
+    @classmethod
+    def file_stream(cls):
+        """Define the file input stream to read the image from the object store.
+
+        :return: method to read the file
+        :rtype: method
+        """
+        def read_file(filename):
+            """Read the image file from the object store.
+
+            :param str filename: name of the image
+
+            :return: file buffer
+            :rtype: cStringIO.StringIO
+            """
+            return cStringIO.StringIO(cls.read(filename))
+
+        return read_file
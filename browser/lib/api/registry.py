@@ -0,0 +1,113 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+from importlib import import_module
+
+from django.conf import settings
+
+from browser.lib.api.base_api import BaseAPI
+from browser.lib.api.base_api import SHARED_STATE
+
+# Storage backends by name, when not configured in the BROWSER_BACKENDS setting. Each backend is described by the
+# dotted path of its API class, and driver specific options (e.g. endpoint and container of an object store)
+DEFAULT_BACKENDS = {
+    'local': {'class': 'browser.lib.api.local_api.LocalAPI'},
+    'hubic': {'class': 'browser.lib.api.hubic_api.HubicAPI'},
+}
+
+_loaded = {}
+_overrides = {}     # Backends configured at run time, taking precedence over the settings
+_lock = threading.Lock()
+
+
+class BackendUnavailable(Exception):
+    """
+    Raised when a storage backend is unknown, or can't be initialised.
+    """
+
+
+def backend_settings():
+    """Configuration of the storage backends.
+
+    :return: options of each backend, by name
+    :rtype: {str: {str: object}}
+    """
+    backends = dict(getattr(settings, 'BROWSER_BACKENDS', DEFAULT_BACKENDS))
+    backends.update(_overrides)
+    return backends
+
+
+def backend_names():
+    """List the configured storage backends, without loading them.
+
+    :return: backend names, local one first
+    :rtype: [str]
+    """
+    return sorted(backend_settings(), key=lambda name: (name != 'local', name))
+
+
+def get_backend(name):
+    """Get a storage backend, importing and initialising it on first use.
+
+    Backends are imported and initialised on first use: a backend which is not configured (e.g. no Hubic credentials)
+    costs nothing at startup, and does not prevent using the other ones. Failures are not cached, so that fixing the
+    configuration of a backend does not require a restart.
+
+    :param str name: backend name
+
+    :return: backend API
+    :rtype: class
+    """
+    with _lock:
+        if name in _loaded:
+            return _loaded[name]
+        options = dict(backend_settings().get(name) or {})
+        if 'class' not in options:
+            raise BackendUnavailable('Unknown storage backend: {}'.format(name))
+        try:
+            api = configure(name, options)
+            api.load()
+        except Exception as e:
+            raise BackendUnavailable('Storage backend {} is unavailable: {}'.format(name, e))
+        _loaded[name] = api
+        return api
+
+
+def configure(name, options):
+    """Build the API of a backend from its configuration.
+
+    The same driver can serve several backends (e.g. two object store containers): each backend gets its own
+    subclass of the driver, named after the backend and holding its options, so that cached listings are not shared.
+
+    :param str name: backend name
+    :param {str: object} options: backend configuration, with the dotted path of the driver as 'class'
+
+    :return: backend API
+    :rtype: class
+    """
+    module_name, class_name = options.pop('class').rsplit('.', 1)
+    driver = getattr(import_module(module_name), class_name)
+    if driver.Meta.name == name and not options:
+        return driver
+    attributes = {attribute: getattr(BaseAPI, attribute) for attribute in SHARED_STATE}
+    # Drivers (and their Meta) may be old-style classes, whose metaclass is not type
+    attributes.update({'Meta': type(driver.Meta)(str('Meta'), (driver.Meta,), {'name': name}), 'config': options})
+    return type(driver)(str(class_name + '_' + name), (driver,), attributes)
+
+
+def override(name, options):
+    """Replace the configuration of a backend for the running process, e.g. to point it to a stand-in server.
+
+    URLs are only routed to the backends known at startup: overriding an existing backend is fine, adding a new one
+    requires it in the settings.
+
+    :param str name: backend name
+    :param {str: object} options: backend configuration, with the dotted path of the driver as 'class'
+
+    :return: None
+    :rtype: NoneType
+    """
+    with _lock:
+        _overrides[name] = dict(options)
+        _loaded.pop(name, None)
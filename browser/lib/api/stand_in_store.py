@@ -0,0 +1,315 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import mimetypes
+import os
+import re
+import threading
+import time
+import urllib
+import urlparse
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from datetime import datetime
+from email.utils import formatdate
+from SocketServer import ThreadingMixIn
+from xml.sax.saxutils import escape
+
+RANGE = re.compile(r'^bytes=(\d*)-(\d*)$')
+BLOCK_SIZE = 64 * 1024      # Bytes written at a time when sending an object
+
+
+class StandInStore(ThreadingMixIn, HTTPServer):
+    """
+    Minimal Swift and S3 compatible object store, serving a local directory as a single container, to develop and
+    test object store backends without an account.
+
+    The container is served under <prefix>/<container>: its listing follows the Swift API (format=json, with marker
+    and limit paging) or S3 ListObjectsV2 (list-type=2, with continuation tokens), and objects support HEAD and
+    ranged GETs. An optional token is checked against the X-Auth-Token header, and a latency can be added to every
+    request to mimic a remote store.
+
+    The Hubic API is mimicked too: the OAuth token and account credentials endpoints (under the server root, to be
+    set as the api_url option of the Hubic backend) hand out the container endpoint, the account lists its single
+    container, and directories can be listed as 'application/directory' objects, which Hubic relies on.
+    """
+    daemon_threads = True
+
+    def __init__(self, root, port=8900, prefix='/v1/AUTH_test', container='photos', token=None, latency=0.,
+                 directory_markers=False):
+        """Create the server, without starting it.
+
+        :param str root: directory served as the container
+        :param int port: port to listen to, on localhost (0 to pick a free one)
+        :param str prefix: path of the account (swift) or service (s3)
+        :param str container: container (swift) or bucket (s3) name
+        :param str token: token required in the X-Auth-Token header, None to accept all requests
+        :param float latency: delay added to each request, in seconds
+        :param bool directory_markers: True to list directories as objects in Swift listings, like Hubic does
+
+        :return: None
+        :rtype: NoneType
+        """
+        HTTPServer.__init__(self, ('127.0.0.1', port), StandInHandler)
+        self.root = os.path.abspath(root)
+        self.container_path = prefix.rstrip('/') + '/' + container
+        self.token = token
+        self.latency = latency
+        self.directory_markers = directory_markers
+        self.n_requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def endpoint(self):
+        return 'http://127.0.0.1:{}{}'.format(self.server_port, self.container_path.rsplit('/', 1)[0])
+
+    @property
+    def container(self):
+        return self.container_path.rsplit('/', 1)[1]
+
+    @property
+    def api_url(self):
+        return 'http://127.0.0.1:{}'.format(self.server_port)
+
+    def start(self):
+        """Serve requests in a background thread.
+
+        :return: serving thread
+        :rtype: threading.Thread
+        """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def objects(self):
+        """List the files of the served directory, as objects sorted by name.
+
+        :return: objects, as dicts with name, bytes and last_modified (timestamp) keys
+        :rtype: [{str: object}]
+        """
+        objects = []
+        for directory, folders, files in os.walk(self.root):
+            for name in files + (folders if self.directory_markers else []):
+                path = os.path.join(directory, name)
+                stat = os.stat(path)
+                is_dir = os.path.isdir(path)
+                objects.append({
+                    'name': os.path.relpath(path, self.root).replace(os.sep, '/'),
+                    'bytes': 0 if is_dir else stat.st_size,
+                    'last_modified': stat.st_mtime,
+                    'content_type': (
+                        'application/directory' if is_dir else
+                        mimetypes.guess_type(name)[0] or 'application/octet-stream'
+                    ),
+                    'is_dir': is_dir,
+                })
+        return sorted(objects, key=lambda el: el['name'])
+
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """
+    Request handler of the StandInStore.
+    """
+    protocol_version = 'HTTP/1.1'
+
+    def log_message(self, format, *args):
+        pass
+
+    def do_HEAD(self):
+        self.handle_request(send_body=False)
+
+    def do_GET(self):
+        self.handle_request(send_body=True)
+
+    def do_POST(self):
+        self.handle_request(send_body=True)
+
+    def handle_request(self, send_body):
+        """Route a request to the container listing or to an object.
+
+        :param bool send_body: False for HEAD requests
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self.server._lock:
+            self.server.n_requests += 1
+        if self.server.latency:
+            time.sleep(self.server.latency)
+        url = urlparse.urlparse(self.path)
+        path = urllib.unquote(url.path).decode('utf-8')
+        if path in ('/oauth/token', '/1.0/account/credentials'):
+            return self.send_hubic_auth(path)
+        if self.server.token is not None and self.headers.get('X-Auth-Token') != self.server.token:
+            return self.send_error(401)
+
+        if path.rstrip('/') == self.server.container_path.rsplit('/', 1)[0]:
+            return self.send_account(send_body)
+        if path.rstrip('/') == self.server.container_path:
+            return self.send_listing(dict(urlparse.parse_qsl(url.query)), send_body)
+        if not path.startswith(self.server.container_path + '/'):
+            return self.send_error(404)
+        name = path[len(self.server.container_path) + 1:]
+        filename = os.path.abspath(os.path.join(self.server.root, name))
+        if not filename.startswith(self.server.root + os.sep) or not os.path.isfile(filename):
+            return self.send_error(404)
+        self.send_object(filename, send_body)
+
+    def send_hubic_auth(self, path):
+        """Answer the Hubic authentication requests, with the stand-in token and endpoint.
+
+        :param str path: requested path
+
+        :return: None
+        :rtype: NoneType
+        """
+        if int(self.headers.get('Content-Length') or 0):
+            self.rfile.read(int(self.headers['Content-Length']))
+        token = self.server.token or 'stand-in'
+        if path == '/oauth/token':
+            body = {'access_token': token, 'token_type': 'Bearer', 'expires_in': 3600}
+        else:
+            body = {'endpoint': self.server.endpoint, 'token': token}
+        self.send_json(json.dumps(body), send_body=True)
+
+    def send_account(self, send_body):
+        """Send the account listing, made of the single container.
+
+        :param bool send_body: False for HEAD requests
+
+        :return: None
+        :rtype: NoneType
+        """
+        objects = [el for el in self.server.objects() if not el['is_dir']]
+        containers = [
+            {'name': self.server.container, 'count': len(objects), 'bytes': sum(el['bytes'] for el in objects)},
+        ]
+        self.send_json(json.dumps(containers), send_body)
+
+    def send_json(self, body, send_body):
+        """Send a JSON document.
+
+        :param str body: JSON document
+        :param bool send_body: False for HEAD requests
+
+        :return: None
+        :rtype: NoneType
+        """
+        body = body.encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json; charset=utf-8')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        if send_body:
+            self.wfile.write(body)
+
+    def send_listing(self, query, send_body):
+        """Send a page of the container listing, in the Swift or S3 format depending on the query.
+
+        :param {str: str} query: query parameters
+        :param bool send_body: False for HEAD requests
+
+        :return: None
+        :rtype: NoneType
+        """
+        objects = self.server.objects()
+        if query.get('list-type') == '2':
+            objects = [el for el in objects if not el['is_dir']]
+            limit = int(query.get('max-keys', 1000))
+            marker = query.get('continuation-token') or query.get('start-after') or ''
+            page = [el for el in objects if el['name'] > marker][:limit]
+            truncated = bool(page) and page[-1]['name'] != objects[-1]['name']
+            body = self.s3_listing(page, truncated).encode('utf-8')
+            self.send_response(200)
+            self.send_header('Content-Type', 'application/xml')
+            self.send_header('Content-Length', str(len(body)))
+            self.end_headers()
+            if send_body:
+                self.wfile.write(body)
+            return
+        limit = int(query.get('limit', 10000))
+        marker = query.get('marker', '')
+        page = [el for el in objects if el['name'] > marker][:limit]
+        self.send_json(json.dumps([
+            {
+                'name': el['name'],
+                'bytes': el['bytes'],
+                'last_modified': datetime.utcfromtimestamp(el['last_modified']).isoformat(),
+                'content_type': el['content_type'],
+            }
+            for el in page
+        ]), send_body)
+
+    def s3_listing(self, page, truncated):
+        """Format a page of the container listing as a ListObjectsV2 response.
+
+        :param [{str: object}] page: objects of the page
+        :param bool truncated: True if more objects follow
+
+        :return: XML document
+        :rtype: str
+        """
+        contents = ''.join(
+            '<Contents><Key>{}</Key><Size>{}</Size><LastModified>{}</LastModified></Contents>'.format(
+                escape(el['name']),
+                el['bytes'],
+                datetime.utcfromtimestamp(el['last_modified']).strftime('%Y-%m-%dT%H:%M:%S.000Z'),
+            )
+            for el in page
+        )
+        token = ''
+        if truncated:
+            token = '<NextContinuationToken>{}</NextContinuationToken>'.format(escape(page[-1]['name']))
+        return (
+            '<?xml version="1.0" encoding="UTF-8"?>'
+            '<ListBucketResult xmlns="http://s3.amazonaws.com/doc/2006-03-01/">'
+            '<Name>{}</Name><KeyCount>{}</KeyCount><IsTruncated>{}</IsTruncated>{}{}'
+            '</ListBucketResult>'
+        ).format(escape(self.server.container), len(page), 'true' if truncated else 'false', token, contents)
+
+    def send_object(self, filename, send_body):
+        """Send an object, or the requested range of bytes.
+
+        :param str filename: path of the file
+        :param bool send_body: False for HEAD requests
+
+        :return: None
+        :rtype: NoneType
+        """
+        stat = os.stat(filename)
+        first, last = 0, stat.st_size - 1
+        match = RANGE.match(self.headers.get('Range', ''))
+        if match and (match.group(1) or match.group(2)):
+            if not match.group(1):
+                first = max(stat.st_size - int(match.group(2)), 0)
+            else:
+                first = int(match.group(1))
+                last = min(int(match.group(2)), last) if match.group(2) else last
+            if first > last:
+                self.send_response(416)
+                self.send_header('Content-Range', 'bytes */{}'.format(stat.st_size))
+                self.send_header('Content-Length', '0')
+                return self.end_headers()
+            self.send_response(206)
+            self.send_header('Content-Range', 'bytes {}-{}/{}'.format(first, last, stat.st_size))
+        else:
+            self.send_response(200)
+        self.send_header('Content-Type', mimetypes.guess_type(filename)[0] or 'application/octet-stream')
+        self.send_header('Content-Length', str(last - first + 1))
+        self.send_header('Last-Modified', formatdate(stat.st_mtime, usegmt=True))
+        self.send_header('ETag', '"{:x}-{:x}"'.format(int(stat.st_mtime), stat.st_size))
+        self.send_header('Accept-Ranges', 'bytes')
+        self.end_headers()
+        if not send_body:
+            return
+        with open(filename, 'rb') as f:
+            f.seek(first)
+            remaining = last - first + 1
+            while remaining > 0:
+                block = f.read(min(BLOCK_SIZE, remaining))
+                if not block:
+                    break
+                self.wfile.write(block)
+                remaining -= len(block)
@@ -0,0 +1,142 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import heapq
+import json
+import threading
+import time
+from bisect import bisect_right
+from collections import OrderedDict
+from itertools import islice
+
+PAGE_SIZE = 60          # Images sent to the client at once
+MAX_FOLDERS = 5000      # Sorted folder listings kept in memory
+FOLDERS_TTL = 30        # Seconds the folder list of the tree is reused, unless invalidated by a change
+
+
+class Timeline(object):
+    """
+    Chronological view over all images of a folder tree, newest first.
+
+    Each folder listing is sorted on its own (and cached until the folder changes), and pages are produced by a lazy
+    k-way merge of the folder listings, resuming after a cursor: only the requested page is ever merged, and nothing
+    is sorted globally. The folder list of the tree (a full walk, or a full container listing) is reused by the
+    following pages, until it expires or is invalidated.
+    """
+
+    def __init__(self, list_folders, list_dated_images):
+        """Build a timeline.
+
+        :param method list_folders: generator of the folders of the tree, as (folder, version) tuples, the version
+            changing whenever the folder content does
+        :param method list_dated_images: lists the (timestamp, name) of the images of a folder, called with the
+            folder and its version
+
+        :return: None
+        :rtype: NoneType
+        """
+        self.list_folders = list_folders
+        self.list_dated_images = list_dated_images
+        self._listings = OrderedDict()   # Folder -> (version, sorted keys)
+        self._lock = threading.Lock()
+        self._folders = None             # Last (folder, version) list of the tree
+        self._folders_time = 0
+        self._folders_lock = threading.Lock()
+
+    def folders(self):
+        """List the folders of the tree, reusing the last list while it is fresh.
+
+        :return: (folder, version) tuples
+        :rtype: [tuple]
+        """
+        # Only one request lists the tree, the concurrent ones wait for its result
+        with self._folders_lock:
+            if self._folders is None or time.time() - self._folders_time > FOLDERS_TTL:
+                self._folders = list(self.list_folders())
+                self._folders_time = time.time()
+            return self._folders
+
+    def invalidate(self):
+        """Forget the folder list of the tree after a change, to list it again for the next page.
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self._folders_lock:
+            self._folders = None
+
+    def folder_keys(self, folder, version):
+        """Sorted merge keys of the images of a folder, newest first.
+
+        :param str folder: folder path
+        :param object version: folder version
+
+        :return: (-timestamp, folder, name) keys
+        :rtype: [tuple]
+        """
+        with self._lock:
+            cached = self._listings.pop(folder, None)
+        if cached is None or cached[0] != version:
+            cached = (version, sorted((-ts, folder, name) for ts, name in self.list_dated_images(folder, version)))
+        with self._lock:
+            self._listings[folder] = cached
+            while len(self._listings) > MAX_FOLDERS:
+                self._listings.popitem(last=False)
+        return cached[1]
+
+    def stream(self, after=None):
+        """Lazily stream the images of the tree, newest first.
+
+        :param tuple after: merge key of the last image already sent, None to start from the newest one
+
+        :return: (timestamp, folder, name) tuples
+        :rtype: iterator
+        """
+        streams = []
+        for folder, version in self.folders():
+            keys = self.folder_keys(folder, version)
+            start = 0 if after is None else bisect_right(keys, after)
+            if start < len(keys):
+                streams.append(islice(keys, start, None))
+        for neg_ts, folder, name in heapq.merge(*streams):
+            yield -neg_ts, folder, name
+
+    def page(self, cursor=None, limit=PAGE_SIZE):
+        """Get a page of the timeline.
+
+        :param str cursor: cursor returned with the previous page, None for the first page
+        :param int limit: number of images in the page
+
+        :return: (timestamp, folder, name) of the images, and the cursor of the next page (None if last page)
+        :rtype: [(float, str, str)], str
+        """
+        entries = list(islice(self.stream(self.parse_cursor(cursor)), limit + 1))
+        if len(entries) <= limit:
+            return entries, None
+        entries = entries[:limit]
+        return entries, self.make_cursor(entries[-1])
+
+    @staticmethod
+    def make_cursor(entry):
+        """Encode the position of an image in the timeline.
+
+        :param tuple entry: (timestamp, folder, name) of the image
+
+        :return: cursor
+        :rtype: str
+        """
+        return json.dumps(list(entry))
+
+    @staticmethod
+    def parse_cursor(cursor):
+        """Decode a cursor into a merge key.
+
+        :param str cursor: cursor
+
+        :return: (-timestamp, folder, name) key, None if no cursor
+        :rtype: tuple
+        """
+        if not cursor:
+            return None
+        ts, folder, name = json.loads(cursor)
+        return -float(ts), folder, name
@@ -0,0 +1,352 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import threading
+from collections import deque
+
+POLL_INTERVAL = 10.     # Seconds between two checks of the directories, when inotify is not available
+READ_SIZE = 64 * 1024   # Bytes of inotify events read at once
+MAX_WATCHES = 8192      # Directories watched at most, the ones closest to the root first
+WATCHES_FILE = '/proc/sys/fs/inotify/max_user_watches'
+FS_ENCODING = sys.getfilesystemencoding() or 'utf-8'
+
+logger = logging.getLogger(__name__)
+
+# inotify flags, see `man inotify`
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ISDIR = 0x40000000
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_MOVE_SELF
+EVENT_HEADER = struct.Struct(b'iIII')
+
+
+def start_watcher(root, callback, should_watch):
+    """Start watching a directory tree, with inotify if available, polling otherwise.
+
+    The callback is called from the watcher thread as callback(kind, directory, name, is_dir), kind being one of
+    'created', 'modified', 'deleted', or 'rescan' when changes were lost and the whole tree should be scanned again.
+    The tree is walked in the watcher thread, so that this returns right away, and at most max_watches() directories
+    are watched: changes deeper in larger trees are only picked up by the periodic refresh of the library index.
+
+    :param str root: root of the tree to watch
+    :param method callback: change handler
+    :param method should_watch: filter on sub directories, called as should_watch(path, name)
+
+    :return: running watcher
+    :rtype: InotifyWatcher or PollingWatcher
+    """
+    watcher = None
+    if sys.platform.startswith('linux'):
+        try:
+            watcher = InotifyWatcher(root, callback, should_watch)
+        except (OSError, AttributeError) as e:
+            logger.warning('inotify is not available (%s), polling %s for changes instead', e, root)
+    if watcher is None:
+        watcher = PollingWatcher(root, callback, should_watch)
+    watcher.start()
+    return watcher
+
+
+def max_watches():
+    """Number of directories a watcher may watch, leaving half of the inotify watches of the user to other programs.
+
+    :return: maximum number of watched directories
+    :rtype: int
+    """
+    try:
+        with open(WATCHES_FILE) as limit:
+            return min(MAX_WATCHES, int(limit.read()) // 2)
+    except (IOError, ValueError):
+        return MAX_WATCHES
+
+
+class Watcher(object):
+    """
+    Common interface of watchers: a daemon thread reporting changes under a root directory.
+    """
+
+    def __init__(self, root, callback, should_watch):
+        """Prepare a watcher.
+
+        :param str root: root of the tree to watch
+        :param method callback: change handler
+        :param method should_watch: filter on sub directories
+
+        :return: None
+        :rtype: NoneType
+        """
+        self.root = root
+        self.callback = callback
+        self.should_watch = should_watch
+        self.max_watches = max_watches()
+        self.truncated = False      # True once the watch budget is exhausted
+        self._stopped = threading.Event()
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+
+    def start(self):
+        self._thread.start()
+
+    def stop(self):
+        self._stopped.set()
+
+    def run(self):
+        raise NotImplementedError
+
+    def walk(self, root):
+        """Walk the watched directories of a tree, breadth first so that a truncated walk keeps the top folders.
+
+        :param str root: root of the tree
+
+        :return: directory paths, with their sub directories and files
+        :rtype: iterator
+        """
+        queue = deque([root])
+        while queue:
+            path = queue.popleft()
+            try:
+                dirs, files = self.list(path)
+            except OSError:
+                continue  # Removed meanwhile, or not readable
+            yield path, dirs, files
+            queue.extend(os.path.join(path, d) for d in dirs)
+
+    def list(self, path):
+        """List the watched sub directories and the files of a directory.
+
+        :param str path: directory
+
+        :return: sub directory names and file names, sorted
+        :rtype: [str], [str]
+        """
+        dirs, files = [], []
+        for name in sorted(os.listdir(path)):
+            if isinstance(name, bytes):
+                continue  # Not valid in the file system encoding, listed as bytes
+            if not os.path.isdir(os.path.join(path, name)):
+                files.append(name)
+            elif self.should_watch(path, name):
+                dirs.append(name)
+        return dirs, files
+
+    def truncate(self):
+        """Report that the watch budget is exhausted, once.
+
+        :return: None
+        :rtype: NoneType
+        """
+        if not self.truncated:
+            self.truncated = True
+            logger.warning(
+                'Only watching %d directories of %s, changes in the others are picked up by the index refresh',
+                self.max_watches, self.root,
+            )
+
+    def notify(self, kind, directory, name, is_dir):
+        """Forward a change to the callback, without letting errors kill the watcher thread.
+
+        :return: None
+        :rtype: NoneType
+        """
+        try:
+            self.callback(kind, directory, name, is_dir)
+        except Exception:
+            logger.exception('Watcher failed to handle %s %s/%s', kind, directory, name)
+
+
+class InotifyWatcher(Watcher):
+    """
+    Linux inotify based watcher, through libc: one watch per directory of the tree, up to the watch budget.
+    """
+
+    def __init__(self, root, callback, should_watch):
+        super(InotifyWatcher, self).__init__(root, callback, should_watch)
+        self.libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+        self.fd = self.libc.inotify_init()
+        if self.fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init failed')
+        self.watches = {}   # Watch descriptor -> directory
+
+    def add_tree(self, root):
+        """Watch the directories of a tree, as long as the watch budget allows.
+
+        :param str root: root of the tree
+
+        :return: None
+        :rtype: NoneType
+        """
+        for path, _, _ in self.walk(root):
+            if len(self.watches) >= self.max_watches:
+                return self.truncate()
+            wd = self.libc.inotify_add_watch(self.fd, path.encode('utf-8'), WATCH_MASK)
+            if wd >= 0:
+                self.watches[wd] = path
+            elif ctypes.get_errno() == errno.ENOSPC:
+                # Other programs use the watches of the user too
+                self.max_watches = len(self.watches)
+                return self.truncate()
+
+    def remove_tree(self, root):
+        """Stop watching the directories of a tree.
+
+        :param str root: root of the tree
+
+        :return: None
+        :rtype: NoneType
+        """
+        prefix = root.rstrip('/') + '/'
+        for wd, path in list(self.watches.items()):
+            if path == root or path.startswith(prefix):
+                del self.watches[wd]
+                self.libc.inotify_rm_watch(self.fd, wd)
+
+    def run(self):
+        try:
+            self.add_tree(self.root)
+            while not self._stopped.is_set():
+                ready, _, _ = select.select([self.fd], [], [], 1.)
+                if ready:
+                    self.dispatch(os.read(self.fd, READ_SIZE))
+        except Exception:
+            logger.exception('Watcher of %s stopped, changes are only picked up by the index refresh', self.root)
+        finally:
+            os.close(self.fd)
+
+    def dispatch(self, data):
+        """Parse a buffer of inotify events and notify the changes.
+
+        :param bytes data: raw inotify events
+
+        :return: None
+        :rtype: NoneType
+        """
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            raw_name = data[offset + EVENT_HEADER.size:offset + EVENT_HEADER.size + length].rstrip(b'\0')
+            offset += EVENT_HEADER.size + length
+            # A bad event is skipped, not to stop the updates for the rest of the process life
+            try:
+                self.handle(wd, mask, raw_name.decode(FS_ENCODING))
+            except UnicodeDecodeError:
+                logger.warning('Watcher skipped a file name which is not valid %s: %r', FS_ENCODING, raw_name)
+            except Exception:
+                logger.exception('Watcher failed to handle an event on %r', raw_name)
+
+    def handle(self, wd, mask, name):
+        """Update the watches after an inotify event, and notify the change.
+
+        :param int wd: watch descriptor of the directory
+        :param int mask: event flags
+        :param str name: name of the entry, empty for events on the directory itself
+
+        :return: None
+        :rtype: NoneType
+        """
+        if mask & IN_Q_OVERFLOW:
+            self.notify('rescan', self.root, None, True)
+            return
+        directory = self.watches.get(wd)
+        if directory is None:
+            return
+        if mask & IN_IGNORED:
+            # Directory removed, or unmounted
+            del self.watches[wd]
+            return
+        if mask & IN_MOVE_SELF:
+            # Moves within the tree already updated the paths of the watches (see IN_MOVED_TO), the ones left
+            # behind belong to a directory moved out of the tree
+            if not os.path.isdir(directory):
+                self.remove_tree(directory)
+            return
+
+        is_dir = bool(mask & IN_ISDIR)
+        if mask & (IN_CREATE | IN_MOVED_TO):
+            if is_dir and self.should_watch(directory, name):
+                # Watching a moved directory again gives the same watch descriptors, updating their paths
+                self.add_tree(os.path.join(directory, name))
+            self.notify('created', directory, name, is_dir)
+        elif mask & (IN_DELETE | IN_MOVED_FROM):
+            self.notify('deleted', directory, name, is_dir)
+        elif mask & IN_CLOSE_WRITE:
+            self.notify('modified', directory, name, is_dir)
+
+
+class PollingWatcher(Watcher):
+    """
+    Portable watcher, checking the modification time of the directories every POLL_INTERVAL seconds (one stat per
+    directory, up to the watch budget), and listing again the ones which changed. Files rewritten in place don't
+    change their directory, they are only picked up by the periodic refresh of the library index.
+    """
+
+    def run(self):
+        known = {}  # Directory -> (modification time, sub directories, files)
+        self.add_tree(self.root, known)
+        while not self._stopped.wait(POLL_INTERVAL):
+            for path in sorted(known):
+                if path not in known:
+                    continue  # Removed along with its parent
+                try:
+                    mtime = os.path.getmtime(path)
+                    if mtime == known[path][0]:
+                        continue
+                    dirs, files = self.list(path)
+                except OSError:
+                    continue  # Removed, reported by its parent
+                _, old_dirs, old_files = known[path]
+                known[path] = (mtime, set(dirs), set(files))
+                for name in old_dirs - set(dirs):
+                    self.remove_tree(os.path.join(path, name), known)
+                    self.notify('deleted', path, name, True)
+                for name in old_files - set(files):
+                    self.notify('deleted', path, name, False)
+                for name in set(dirs) - old_dirs:
+                    self.add_tree(os.path.join(path, name), known)
+                    self.notify('created', path, name, True)
+                for name in set(files) - old_files:
+                    self.notify('created', path, name, False)
+
+    def add_tree(self, root, known):
+        """Start polling the directories of a tree, as long as the watch budget allows.
+
+        :param str root: root of the tree
+        :param dict known: polled directories, updated in place
+
+        :return: None
+        :rtype: NoneType
+        """
+        for path, dirs, files in self.walk(root):
+            if len(known) >= self.max_watches:
+                return self.truncate()
+            try:
+                known[path] = (os.path.getmtime(path), set(dirs), set(files))
+            except OSError:
+                continue
+
+    @staticmethod
+    def remove_tree(root, known):
+        """Stop polling the directories of a tree.
+
+        :param str root: root of the tree
+        :param dict known: polled directories, updated in place
+
+        :return: None
+        :rtype: NoneType
+        """
+        prefix = root.rstrip('/') + '/'
+        for path in [p for p in known if p == root or p.startswith(prefix)]:
+            del known[path]
@@ -2,28 +2,97 @@
 from __future__ import unicode_literals
 
 import base64
-import cStringIO
 import os
+import threading
+import time
 
-from concurrent.futures import ThreadPoolExecutor
+from browser.lib.image.prefetch import PrefetchPolicy
+from browser.lib.image.rendition_cache import Encoder
+from browser.lib.image.rendition_cache import RenditionCache
+from browser.lib.image.rendition_cache import rendition_size
+from browser.lib.image.scheduler import DecodeScheduler
 
 N_EXECUTORS = 2
 MAX_CACHE = 25
-DEFAULT_FORMAT = 'jpeg'
 DEFAULT_THUMBNAIL = os.path.dirname(os.path.realpath(__file__)) + '/thumb.jpg'
 THUMB_SIZE = (256, 256)
 
 
+def thumbnail_name(api_metadata, path, name):
+    """Build thumbnail file name from image name.
+
+    If local file, the thumbnail will be stored along the file itself.
+    If remote, the thumbnail is stored in the .cache directory.
+
+    :param class api_metadata: API metadata wrapper
+    :param str path: full path of the image directory
+    :param str name: image file name
+
+    :return: file name
+    :rtype: str
+    """
+    base_name = os.path.splitext(name)[0]
+    if api_metadata.remote:
+        thumb_path = os.path.dirname(__file__) + '/.cache/' + api_metadata.name + '_' + path.replace('/', '_') + '_'
+        base_name = base_name.replace('/', '_')
+    else:
+        thumb_path = path + '/'
+        base_name = '.' + base_name
+
+    return thumb_path + base_name + '_thumb.jpg'
+
+
+def read_thumbnail(thumb_file):
+    """Read a thumbnail file, falling back to the default thumbnail if it does not exist (yet).
+
+    :param str thumb_file: thumbnail file name
+
+    :return: thumbnail
+    :rtype: base64 string
+    """
+    if not os.path.isfile(thumb_file):
+        thumb_file = DEFAULT_THUMBNAIL
+    with open(thumb_file, "rb") as image_file:
+        thumb_bytes = image_file.read()
+    return base64.b64encode(thumb_bytes)
+
+
+def eviction_candidate(images, cursor):
+    """Pick the cached image of a session it is the least likely to need again.
+
+    Images of another folder than the one the session is in go first; then, as long as some are at least two images
+    behind the cursor (relatively to the navigation direction), the furthest behind; or else the furthest ahead.
+
+    :param [BaseImage] images: cached images of the session, oldest first
+    :param tuple cursor: folder, current image id and navigation direction of the session, None if unknown
+
+    :return: image to evict
+    :rtype: BaseImage
+    """
+    if cursor is None:
+        return images[0]
+    folder, image_id, direction = cursor
+    elsewhere = [img for img in images if (img.api_metadata.name, img.path) != folder]
+    if elsewhere:
+        return elsewhere[0]
+    gaps = [(img.id - image_id) * direction for img in images]
+    agg = min if min(gaps) <= -2 else max
+    return images[agg(range(len(images)), key=lambda i: gaps[i])]
+
+
 class BaseImage:
     """
     Generic class representing images and their useful metadata.
     This class is also used as an asynchronous image processing pool to decode / encode / cache images outside the
-    main thread.
+    main thread. The pool and the cache are shared by all browsing sessions, and fair between them: each session has
+    its own prefetch queue and cursor, and the cache gives images back from the session holding the most of them.
     """
-    _executor = ThreadPoolExecutor(N_EXECUTORS)  # Image processing thread, shared by all instances
-    _cache = []                                  # Cache of processed images, shared by all instances
+    _scheduler = DecodeScheduler(N_EXECUTORS)    # Image processing threads, shared by all sessions
+    _cache = []                                  # Cache of processed images, shared by all instances
+    _cache_lock = threading.Lock()
+    encoder = Encoder()                          # Encoding parameters of the renditions, shared by all instances
 
-    def __init__(self, image_id, path, name, file_stream, api_metadata, process=False):
+    def __init__(self, image_id, path, name, file_stream, api_metadata, process=False, stat=None):
         """Generic instantiation of images.
 
         :param int image_id: id given to the image, defining relative position in directory (sorted by name)
@@ -32,6 +101,7 @@ class BaseImage:
         :param method file_stream: method defining how to stream the file content
         :param class api_metadata: API metadata wrapper
         :param bool process: True to decode and encore image file at instantiation, False to wait
+        :param tuple stat: modification time and size of the file if known (remote files), None to read it from disk
 
         :return: None
         :rtype: NoneType
@@ -45,9 +115,12 @@ class BaseImage:
         self.ext = os.path.splitext(name)[1].lower()    # Extension of image file
         self.decoded = None                             # PIL Image
         self.encoded = None                             # base64 encoded version of the image
+        self.mime = None                                # MIME type of the encoded version
+        self.stat = stat                                # Modification time / size of the image file
         self.size = (None, None)                        # Width / Height of the image
         self.orientation = None                         # Orientation: 0 = landspace / 1 = portrait
         self.thumbnail = self.read_thumbnail()          # base64 encoded thumbbail
+        self.owner = None                               # Session which last needed the processed image
         if process:
             self.decode_encode()
 
@@ -68,17 +141,7 @@ class BaseImage:
         :return: file name
         :rtype: str
         """
-        if self.api_metadata.remote:
-            path = (
-                os.path.dirname(__file__) + '/.cache/' +
-                self.api_metadata.name + '_' + self.path.replace('/', '_') + '_'
-            )
-            name = self.name[:-len(self.ext)].replace('/', '_')
-        else:
-            path = self.path + '/'
-            name = '.' + self.name[:-len(self.ext)]
-
-        return path + name + '_thumb.jpg'
+        return thumbnail_name(self.api_metadata, self.path, self.name)
 
     def has_thumbnail(self):
         """Check if image thumbnail already exists on disk.
@@ -88,16 +151,25 @@ class BaseImage:
         """
         return os.path.isfile(self.thumbnail_name())
 
+    def has_fresh_thumbnail(self):
+        """Check if image thumbnail exists on disk, and is more recent than the image file (local files only).
+
+        :return: True if up to date
+        :rtype: bool
+        """
+        if not self.has_thumbnail():
+            return False
+        if self.api_metadata.remote:
+            return True
+        return os.path.getmtime(self.thumbnail_name()) >= self.file_signature()[0]
+
     def read_thumbnail(self):
         """Create a PIL image from a thumbnail file.
 
         :return: thumbnail
         :rtype: base64 string
         """
-        thumb_file = self.thumbnail_name() if self.has_thumbnail() else DEFAULT_THUMBNAIL
-        with open(thumb_file, "rb") as image_file:
-            thumb_bytes = image_file.read()
-        return base64.b64encode(thumb_bytes)
+        return read_thumbnail(self.thumbnail_name())
 
     def save_thumbnail(self):
         """Save thumbnail image to disk.
@@ -105,40 +177,169 @@ class BaseImage:
         :return: None
         :rtype: NoneType
         """
-        if os.path.isfile(self.thumbnail_name()):
+        if self.has_fresh_thumbnail():
             return
-        thumb = self.decode() if self.decoded is None else self.decoded.copy()
+        decoded = self.decoded
+        thumb = self.decode(preview=True) if decoded is None else decoded.copy()
         thumb.thumbnail(THUMB_SIZE)
         thumb.save(self.thumbnail_name())
         self.thumbnail = self.read_thumbnail()
 
-    def decode_encode(self):
+    def decode_encode(self, session_key=None):
         """Decode image file on disk (depend on file format), and encode it to base64 to be displayed in browser.
 
+        :param str session_key: browsing session needing the image, which the cache accounts it to
+
         :return: None
         :rtype: NoneType
         """
         # For now, being in the cache <=> being decoded and encoded
-        if self in self._cache:
-            return
-        self.flush_cache()
-        self.decoded = self.decode()
-        self.encoded = self.b64encode()
-        # Decoding / encoding is costly, so while we're at it we can save a thumbnail file (much faster)
-        self.save_thumbnail()
-        self._cache.append(self)
+        with self._cache_lock:
+            if self in self._cache:
+                self.owner = session_key if session_key is not None else self.owner
+                return
+            twin = self._twin()
+            if twin is not None:
+                # Another object of the same file (e.g. from a listing made again) is processed: taking its place
+                self.encoded, self.mime = twin.encoded, twin.mime
+                self.size, self.orientation = twin.size, twin.orientation
+                self.owner = session_key if session_key is not None else twin.owner
+                self._cache[self._cache.index(twin)] = self
+                return
+            self.flush_cache()
+        # Renditions viewed before are persisted on disk, which skips decoding entirely
+        encoder = self.encoder
+        key = self.rendition_key(encoder.params())
+        rendition = RenditionCache.get(key)
+        if rendition is None:
+            start = time.time()
+            # Another session may flush this image meanwhile, hence working on a local reference
+            decoded = self.decode()
+            self.decoded = decoded
+            rendition = encoder.encode(decoded)
+            RenditionCache.put(key, rendition)
+            # Feeding the prefetch policy with the actual cost of this format
+            PrefetchPolicy.record_decode(self.ext, time.time() - start, 3 * decoded.size[0] * decoded.size[1])
+            # Decoding / encoding is costly, so while we're at it we can save a thumbnail file (much faster)
+            self.save_thumbnail()
+        else:
+            # Renditions keep the decoded dimensions, which the header gives without decoding
+            self.size = rendition_size(rendition)
+            self.orientation = 0 if self.size[0] > self.size[1] else 1
+        # Encoding in base64, fairly fast
+        with self._cache_lock:
+            self.encoded = base64.b64encode(rendition)
+            self.mime = encoder.mime
+            self.owner = session_key
+            if self not in self._cache:
+                twin = self._twin()
+                if twin is not None:
+                    self._cache.remove(twin)
+                self._cache.append(self)
+
+    def cache_key(self):
+        return self.api_metadata.name, self.path, self.name
+
+    def _twin(self):
+        """Find another processed object of the same file (to be called with the cache lock).
+
+        :return: processed image, None if there is none
+        :rtype: BaseImage
+        """
+        key = self.cache_key()
+        for img in self._cache:
+            if img is not self and img.cache_key() == key:
+                return img
+        return None
 
-    def decode_encode_async(self):
-        """Asynchronously decode and encore image, sending it as the job to the class executor(s).
+    @classmethod
+    def cached(cls, api_metadata, path, name):
+        """Find the processed object of an image file, to reuse it rather than processing the file again.
+
+        :param class api_metadata: API metadata wrapper
+        :param str path: full path of the image directory
+        :param str name: image file name
+
+        :return: processed image, None if not in the cache
+        :rtype: BaseImage
+        """
+        key = api_metadata.name, path, name
+        with cls._cache_lock:
+            for img in cls._cache:
+                if img.cache_key() == key:
+                    return img
+        return None
+
+    def file_signature(self):
+        """Describe the version of the image file, to detect changes.
+
+        :return: modification time and size of the file
+        :rtype: tuple
+        """
+        if self.stat is None:
+            stat = os.stat(self.path + '/' + self.name)
+            return stat.st_mtime, stat.st_size
+        return self.stat
+
+    def rendition_key(self, params):
+        """Build the rendition cache key of this image.
+
+        :param str params: rendition parameters
+
+        :return: cache key
+        :rtype: str
+        """
+        source = self.api_metadata.name + ':' + self.path + '/' + self.name
+        return RenditionCache.key(source, self.file_signature(), params)
+
+    def is_processed(self):
+        """Check if image is already decoded and encoded, i.e. ready to be displayed.
+
+        :return: True if processed
+        :rtype: bool
+        """
+        return self in self._cache
+
+    def decode_encode_async(self, session_key=None):
+        """Asynchronously decode and encore image, sending it as a job of a session to the class scheduler.
+
+        :param str session_key: browsing session needing the image
 
         :return: None
         :rtype: NoneType
         """
-        self._executor.submit(self.decode_encode)
+        self._scheduler.submit(session_key, self)
+
+    @classmethod
+    def prefetch(cls, session_key, images):
+        """Replace the pending processing jobs of a session, without touching the ones of other sessions.
 
-    def decode(self):
+        :param str session_key: browsing session identifier
+        :param [BaseImage] images: images to process, by priority order (empty to just cancel the pending jobs)
+
+        :return: None
+        :rtype: NoneType
+        """
+        cls._scheduler.prefetch(session_key, images)
+
+    @classmethod
+    def focus(cls, session_key, image, direction=1):
+        """Record the image a session is looking at, around which its share of the cache is kept.
+
+        :param str session_key: browsing session identifier
+        :param BaseImage image: image shown
+        :param int direction: navigation direction, +1 or -1
+
+        :return: None
+        :rtype: NoneType
+        """
+        cls._scheduler.focus(session_key, image, direction)
+
+    def decode(self, preview=False):
         """Decode image from file - defined in children classes as the process depend on the image initial format.
 
+        :param bool preview: True to allow a faster, reduced resolution decoding (at least half size)
+
         :return: decoded image
         :rtype: PIL Image
         """
@@ -150,30 +351,47 @@ class BaseImage:
         :return: base64 encoded image
         :rtype: base64 string
         """
-        # For now, first encoding into a simple, intermediate format to then encode to b64 - very slow
-        tmp_buffer = cStringIO.StringIO()
-        self.decoded.save(tmp_buffer, format=DEFAULT_FORMAT)
-        # Encoding in base64, fairly fast
-        return base64.b64encode(tmp_buffer.getvalue())
+        return base64.b64encode(self.encoder.encode(self.decoded))
 
-    def flush_cache(self):
+    @classmethod
+    def flush_cache(cls):
         """Flush cache of encoded images to avoid having too many encoded (i.e. heavy) image objects in RAM.
 
+        The session holding the most images gives one back, chosen relatively to its own cursor, so that a session
+        browsing fast can't evict what others are looking at. To be called with the cache lock.
+
         :return: None
         :rtype: NoneType
         """
-        if len(self._cache) > MAX_CACHE:
-            gaps = [img.id - self.id for img in self._cache]
-            agg = min if min(gaps) <= -2 else max
-            oldest_id = agg(enumerate(gaps), key=lambda x: x[1])[0]
-            oldest = self._cache.pop(oldest_id)
+        while len(cls._cache) > MAX_CACHE:
+            shares = {}
+            for img in cls._cache:
+                shares.setdefault(img.owner, []).append(img)
+            owner, images = max(shares.items(), key=lambda item: len(item[1]))
+            oldest = eviction_candidate(images, cls._scheduler.cursor(owner))
+            cls._cache.remove(oldest)
             oldest.encoded = None
             oldest.decoded = None
 
-    def clear_queue(self):
-        """Clear ThreadPool queue.
+    @classmethod
+    def forget(cls, api_metadata, path, name):
+        """Drop everything derived from an image file which changed or was removed: processed image and thumbnail.
+
+        Renditions need no invalidation, they're keyed by file version and will be evicted from the disk cache.
+
+        :param class api_metadata: API metadata wrapper
+        :param str path: full path of the image directory
+        :param str name: image file name
 
         :return: None
         :rtype: NoneType
         """
-        self._executor._work_queue.queue.clear()
+        with cls._cache_lock:
+            for image in [img for img in cls._cache if img.path == path and img.name == name]:
+                cls._cache.remove(image)
+                image.encoded = None
+                image.decoded = None
+        try:
+            os.remove(thumbnail_name(api_metadata, path, name))
+        except OSError:
+            pass
@@ -0,0 +1,134 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+import time
+
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+from browser.lib.image.prefetch import PrefetchPolicy
+from browser.lib.image.rendition_cache import Encoder
+from browser.lib.image.rendition_cache import RenditionCache
+
+CAST_SIZE = (1920, 1080)    # Chromecast output resolution
+CAST_QUALITY = 85
+CAST_AHEAD = 5              # Slides rendered ahead of the current one
+N_CAST_EXECUTORS = 2
+
+
+class CastStage:
+    """
+    Pre-staging of cast-ready renditions: JPEGs fitting the Chromecast resolution, rendered ahead of the current slide
+    on a dedicated pool (not affected by the viewer clearing its queue), and persisted in the rendition cache.
+    Raw images are demosaiced at half size, which is still more than the cast resolution.
+    """
+    _executor = ThreadPoolExecutor(N_CAST_EXECUTORS)
+    _lock = threading.Lock()
+    _pending = {}     # Renditions being rendered, by cache key
+    encoder = Encoder('jpeg', quality=CAST_QUALITY, progressive=False)
+
+    @classmethod
+    def key(cls, image):
+        """Rendition cache key of the cast version of an image.
+
+        :param browser.lib.image.base_image.BaseImage image: image
+
+        :return: cache key
+        :rtype: str
+        """
+        return image.rendition_key('cast-{}x{}-{}'.format(CAST_SIZE[0], CAST_SIZE[1], cls.encoder.params()))
+
+    @classmethod
+    def stage(cls, images, image_id, ahead=CAST_AHEAD):
+        """Render the cast versions of the slides following the current one, in the background.
+
+        :param browser.lib.image.image_listing.ImageListing images: images of the folder
+        :param int image_id: id of the current slide
+        :param int ahead: number of slides to prepare
+
+        :return: None
+        :rtype: NoneType
+        """
+        for offset in range(1, min(ahead, len(images) - 1) + 1):
+            cls.submit(images[(image_id + offset) % len(images)])
+
+    @classmethod
+    def submit(cls, image):
+        """Schedule the rendering of an image, unless it's already rendered or being rendered.
+
+        :param browser.lib.image.base_image.BaseImage image: image
+
+        :return: pending rendering, None if already rendered
+        :rtype: concurrent.futures.Future
+        """
+        key = cls.key(image)
+        with cls._lock:
+            if key in cls._pending:
+                return cls._pending[key]
+            if RenditionCache.exists(key):
+                return None
+            future = cls._executor.submit(cls.render, image, key)
+            cls._pending[key] = future
+        return future
+
+    @classmethod
+    def is_rendered(cls, image):
+        """Check if the cast version of an image is ready.
+
+        :param browser.lib.image.base_image.BaseImage image: image
+
+        :return: True if rendered
+        :rtype: bool
+        """
+        return RenditionCache.exists(cls.key(image))
+
+    @classmethod
+    def is_pending(cls, image):
+        """Check if the cast version of an image is being rendered.
+
+        :param browser.lib.image.base_image.BaseImage image: image
+
+        :return: True if pending
+        :rtype: bool
+        """
+        with cls._lock:
+            return cls.key(image) in cls._pending
+
+    @classmethod
+    def rendition(cls, image):
+        """Get the cast version of an image, waiting for it if it is being rendered.
+
+        :param browser.lib.image.base_image.BaseImage image: image
+
+        :return: JPEG image
+        :rtype: bytes
+        """
+        rendition = RenditionCache.get(cls.key(image))
+        if rendition is not None:
+            return rendition
+        future = cls.submit(image)
+        return future.result() if future is not None else RenditionCache.get(cls.key(image))
+
+    @classmethod
+    def render(cls, image, key):
+        """Render and cache the cast version of an image.
+
+        :param browser.lib.image.base_image.BaseImage image: image
+        :param str key: rendition cache key
+
+        :return: JPEG image
+        :rtype: bytes
+        """
+        try:
+            start = time.time()
+            decoded = image.decode(preview=True)
+            n_bytes = 3 * decoded.size[0] * decoded.size[1]
+            decoded.thumbnail(CAST_SIZE, Image.ANTIALIAS)
+            rendition = cls.encoder.encode(decoded)
+            RenditionCache.put(key, rendition)
+            PrefetchPolicy.record_decode(image.ext, time.time() - start, n_bytes, preview=True)
+            return rendition
+        finally:
+            with cls._lock:
+                cls._pending.pop(key, None)
@@ -0,0 +1,149 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import math
+import threading
+from collections import OrderedDict
+
+from PIL import Image
+
+from browser.lib.image.rendition_cache import Encoder
+from browser.lib.image.rendition_cache import RenditionCache
+
+TILE_SIZE = 254         # Tile size in pixels, without overlap
+TILE_OVERLAP = 1        # Pixels shared with neighbour tiles, to avoid seams when zooming
+TILE_FORMAT = 'jpeg'
+MAX_PYRAMIDS = 2        # Decoded images kept in memory to generate tiles
+
+DZI_TEMPLATE = (
+    '<?xml version="1.0" encoding="UTF-8"?>'
+    '<Image xmlns="http://schemas.microsoft.com/deepzoom/2008" Format="{format}" Overlap="{overlap}" '
+    'TileSize="{tile_size}"><Size Width="{width}" Height="{height}"/></Image>'
+)
+
+
+class DeepZoom(object):
+    """
+    Deep zoom (DZI) tile pyramid of an image, to inspect full resolution details without transferring whole frames.
+
+    Tiles are generated lazily from the decoded image, only when requested by the viewer, and persisted in the
+    rendition cache: zooming into a corner only decodes the image once, and only encodes the visible tiles.
+    """
+    _lock = threading.Lock()
+    _pyramids = OrderedDict()    # Most recently used pyramids, by image source
+
+    def __init__(self, image):
+        """Build the pyramid of an image, without decoding it yet.
+
+        :param browser.lib.image.base_image.BaseImage image: image to zoom into
+
+        :return: None
+        :rtype: NoneType
+        """
+        self.image = image
+        self.encoder = Encoder(TILE_FORMAT, quality=image.encoder.quality, progressive=False)
+        self.decoded = None
+        self.levels = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def of(cls, image):
+        """Get the pyramid of an image, reusing the one in memory if any.
+
+        :param browser.lib.image.base_image.BaseImage image: image to zoom into
+
+        :return: pyramid
+        :rtype: DeepZoom
+        """
+        key = image.rendition_key('dzi')
+        with cls._lock:
+            pyramid = cls._pyramids.pop(key, None) or cls(image)
+            cls._pyramids[key] = pyramid
+            while len(cls._pyramids) > MAX_PYRAMIDS:
+                cls._pyramids.popitem(last=False)
+        return pyramid
+
+    def descriptor(self):
+        """Build the DZI descriptor of the image.
+
+        :return: DZI xml
+        :rtype: str
+        """
+        key = self.image.rendition_key('dzi')
+        dzi = RenditionCache.get(key)
+        if dzi is None:
+            width, height = self.full_image().size
+            dzi = DZI_TEMPLATE.format(
+                format=TILE_FORMAT, overlap=TILE_OVERLAP, tile_size=TILE_SIZE, width=width, height=height,
+            ).encode('utf-8')
+            RenditionCache.put(key, dzi)
+        return dzi
+
+    def tile(self, level, col, row):
+        """Get an encoded tile of the pyramid.
+
+        :param int level: pyramid level, 0 being a single pixel image
+        :param int col: tile column
+        :param int row: tile row
+
+        :return: encoded tile, None if out of the pyramid
+        :rtype: bytes
+        """
+        key = self.image.rendition_key('tile-{}-{}-{}-{}'.format(level, col, row, self.encoder.params()))
+        tile = RenditionCache.get(key)
+        if tile is not None:
+            return tile
+
+        level_image = self.level_image(level)
+        if level_image is None:
+            return None
+        width, height = level_image.size
+        left, top = col * TILE_SIZE - (TILE_OVERLAP if col else 0), row * TILE_SIZE - (TILE_OVERLAP if row else 0)
+        if left >= width or top >= height:
+            return None
+        right = min(width, (col + 1) * TILE_SIZE + TILE_OVERLAP)
+        bottom = min(height, (row + 1) * TILE_SIZE + TILE_OVERLAP)
+        tile = self.encoder.encode(level_image.crop((left, top, right, bottom)))
+        RenditionCache.put(key, tile)
+        return tile
+
+    def full_image(self):
+        """Decode the image, once per pyramid (reusing the viewer's decoded image if still available).
+
+        :return: decoded image
+        :rtype: PIL Image
+        """
+        with self._lock:
+            if self.decoded is None:
+                decoded = self.image.decoded
+                self.decoded = decoded if decoded is not None else self.image.decode()
+                if self.decoded.mode not in ('RGB', 'L'):
+                    self.decoded = self.decoded.convert('RGB')
+            return self.decoded
+
+    def max_level(self):
+        """Index of the full resolution level.
+
+        :return: level
+        :rtype: int
+        """
+        return int(math.ceil(math.log(max(self.full_image().size), 2)))
+
+    def level_image(self, level):
+        """Scaled version of the image for a pyramid level.
+
+        :param int level: pyramid level
+
+        :return: scaled image, None if level is out of the pyramid
+        :rtype: PIL Image
+        """
+        max_level = self.max_level()
+        if not 0 <= level <= max_level:
+            return None
+        with self._lock:
+            if level not in self.levels:
+                scale = 2 ** (max_level - level)
+                width, height = self.decoded.size
+                size = (int(math.ceil(width / float(scale))), int(math.ceil(height / float(scale))))
+                self.levels[level] = self.decoded if scale == 1 else self.decoded.resize(size, Image.ANTIALIAS)
+            return self.levels[level]
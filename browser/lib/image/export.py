@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from collections import OrderedDict
+from Queue import Queue
+
+from PIL import Image
+
+from browser.lib.image.rendition_cache import Encoder
+
+EXPORT_FORMATS = {'jpeg': '.jpg', 'png': '.png'}
+MANIFEST = '.export_manifest'   # Export settings and names of the exported images, to resume interrupted jobs
+QUEUE_SIZE = 4                  # Images waiting between two stages, bounding memory use
+N_DECODERS = 2
+N_ENCODERS = 2
+MAX_ERRORS = 20                 # Errors kept for reporting
+MAX_JOBS = 20                   # Finished jobs kept for status requests
+STOP = None                     # End of stream marker between stages
+
+
+class ExportJob(object):
+    """
+    Batch conversion of images (typically raw) to JPEG / PNG files, at a chosen size.
+
+    Images flow through a parallel decode -> resize -> encode -> write pipeline, stages being connected by bounded
+    queues so that only a few decoded images are in memory at once: images are only created by the decoders. Exported
+    names are recorded in a manifest in the output directory along with the export settings, so that an interrupted
+    job resumes where it stopped, and a job with other settings exports everything again.
+    """
+    _jobs = OrderedDict()   # Running and finished jobs, by id, oldest first
+    _jobs_lock = threading.Lock()
+
+    def __init__(self, path, names, create_image, output_dir, format='jpeg', max_size=None, quality=90,
+                 n_decoders=N_DECODERS, n_encoders=N_ENCODERS):
+        """Prepare an export job.
+
+        :param str path: folder of the images to export
+        :param [str] names: names of the images to export
+        :param method create_image: image factory of the API, called as create_image(image_id, path, name)
+        :param str output_dir: directory to write the exported files to
+        :param str format: output format, one of EXPORT_FORMATS keys
+        :param int max_size: maximum width / height of the exported images, None to keep full size
+        :param int quality: compression quality (jpeg)
+        :param int n_decoders: decoding threads
+        :param int n_encoders: encoding threads
+
+        :return: None
+        :rtype: NoneType
+        """
+        if format not in EXPORT_FORMATS:
+            raise ValueError('Unsupported export format: {}'.format(format))
+        self.id = uuid.uuid4().hex
+        self.path = path
+        self.names = names
+        self.create_image = create_image
+        self.output_dir = output_dir
+        self.extension = EXPORT_FORMATS[format]
+        self.settings = '{}:{}:{}'.format(format, max_size or 'full', quality)
+        self.encoder = Encoder(format, quality=quality, progressive=False)
+        self.max_size = max_size
+        self.n_decoders = n_decoders
+        self.n_encoders = n_encoders
+
+        self.state = 'pending'
+        self.total = len(names)
+        self.done = 0
+        self.skipped = 0
+        self.failed = 0
+        self.errors = []
+        self.bytes_written = 0
+        self.stage_seconds = {'decode': 0., 'resize': 0., 'encode': 0., 'write': 0.}
+        self.start_time = None
+        self.end_time = None
+        self._lock = threading.Lock()
+        self._cancelled = threading.Event()
+        self._progress = None
+        self._exported = set()
+
+    @classmethod
+    def get(cls, job_id):
+        """Find a job started in this process.
+
+        :param str job_id: job id
+
+        :return: job, None if unknown
+        :rtype: ExportJob
+        """
+        return cls._jobs.get(job_id)
+
+    def start(self):
+        """Run the job in a background thread.
+
+        :return: job id
+        :rtype: str
+        """
+        with self._jobs_lock:
+            self._jobs[self.id] = self
+            finished = [job_id for job_id, job in self._jobs.items() if job.state in ('finished', 'cancelled')]
+            for job_id in finished[:max(0, len(self._jobs) - MAX_JOBS)]:
+                del self._jobs[job_id]
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+        return self.id
+
+    def cancel(self):
+        self._cancelled.set()
+
+    def run(self, progress=None):
+        """Run the job, blocking until all images are exported.
+
+        :param method progress: optional callback, called with the job status after each image
+
+        :return: job status
+        :rtype: {str: object}
+        """
+        self.state = 'running'
+        self.start_time = time.time()
+        self._progress = progress
+        if not os.path.isdir(self.output_dir):
+            os.makedirs(self.output_dir)
+        self._exported = self.read_manifest()
+
+        decode_queue, resize_queue, encode_queue, write_queue = [Queue(QUEUE_SIZE) for _ in range(4)]
+        stages = [
+            self.start_stage('decode', self.decode, decode_queue, resize_queue, self.n_decoders),
+            self.start_stage('resize', self.resize, resize_queue, encode_queue, 1),
+            self.start_stage('encode', self.encode, encode_queue, write_queue, self.n_encoders),
+            self.start_stage('write', self.write, write_queue, None, 1),
+        ]
+        targets = self.target_names()
+        for name in self.names:
+            if self._cancelled.is_set():
+                break
+            target = os.path.join(self.output_dir, targets[name])
+            if name in self._exported and os.path.isfile(target):
+                self.count('skipped')
+                continue
+            decode_queue.put({'name': name, 'target': target})
+        decode_queue.put(STOP)
+        for threads in stages:
+            for thread in threads:
+                thread.join()
+
+        self.end_time = time.time()
+        self.state = 'cancelled' if self._cancelled.is_set() else 'finished'
+        return self.status()
+
+    def target_names(self):
+        """Name the exported files, keeping the source extension in the names of images sharing a base name (e.g.
+        IMG.cr2 and IMG.jpg are exported to IMG_cr2.jpg and IMG_jpg.jpg), not to overwrite each other.
+
+        :return: exported file name of each image
+        :rtype: {str: str}
+        """
+        bases = Counter(os.path.splitext(name)[0].lower() for name in self.names)
+        targets = {}
+        for name in self.names:
+            base, extension = os.path.splitext(name)
+            if bases[base.lower()] > 1:
+                base = '{}_{}'.format(base, extension.lstrip('.').lower())
+            targets[name] = base + self.extension
+        return targets
+
+    def start_stage(self, name, func, inbox, outbox, n_workers):
+        """Start the worker threads of a pipeline stage.
+
+        :param str name: stage name, for stats
+        :param method func: processing of one item, returning the item for the next stage
+        :param Queue.Queue inbox: input queue
+        :param Queue.Queue outbox: output queue, None for the last stage
+        :param int n_workers: number of threads
+
+        :return: worker threads
+        :rtype: [threading.Thread]
+        """
+        remaining = [n_workers]
+
+        def worker():
+            while True:
+                item = inbox.get()
+                if item is STOP:
+                    # Letting sibling workers see the end of stream too
+                    inbox.put(STOP)
+                    break
+                if self._cancelled.is_set():
+                    continue
+                start = time.time()
+                try:
+                    item = func(item)
+                except Exception as e:
+                    self.fail(item, e)
+                    continue
+                with self._lock:
+                    self.stage_seconds[name] += time.time() - start
+                if outbox is not None:
+                    outbox.put(item)
+            with self._lock:
+                remaining[0] -= 1
+                last = remaining[0] == 0
+            if last and outbox is not None:
+                outbox.put(STOP)
+
+        threads = [threading.Thread(target=worker) for _ in range(n_workers)]
+        for thread in threads:
+            thread.daemon = True
+            thread.start()
+        return threads
+
+    def decode(self, item):
+        item['decoded'] = self.create_image(None, self.path, item['name']).decode()
+        return item
+
+    def resize(self, item):
+        if self.max_size is not None:
+            item['decoded'].thumbnail((self.max_size, self.max_size), Image.ANTIALIAS)
+        return item
+
+    def encode(self, item):
+        item['data'] = self.encoder.encode(item.pop('decoded'))
+        return item
+
+    def write(self, item):
+        """Write an exported image, atomically, and record it in the manifest.
+
+        :param {str: object} item: pipeline item
+
+        :return: pipeline item
+        :rtype: {str: object}
+        """
+        fd, tmp_name = tempfile.mkstemp(dir=self.output_dir)
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(item['data'])
+        os.rename(tmp_name, item['target'])
+        with open(os.path.join(self.output_dir, MANIFEST), 'a') as manifest:
+            manifest.write('{}\t{}\n'.format(self.settings, item['name']).encode('utf-8'))
+        with self._lock:
+            self.bytes_written += len(item['data'])
+        self.count('done')
+        return item
+
+    def count(self, counter):
+        """Increment a progress counter, and report progress.
+
+        :param str counter: 'done', 'skipped' or 'failed'
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        if self._progress is not None:
+            self._progress(self.status())
+
+    def fail(self, item, error):
+        with self._lock:
+            if len(self.errors) < MAX_ERRORS:
+                self.errors.append('{}: {}'.format(item['name'], error))
+        self.count('failed')
+
+    def read_manifest(self):
+        """Read the names of the images exported by previous runs with the same settings.
+
+        :return: image names
+        :rtype: set
+        """
+        try:
+            with open(os.path.join(self.output_dir, MANIFEST), 'r') as manifest:
+                lines = [line.decode('utf-8').rstrip('\n').split('\t', 1) for line in manifest]
+        except IOError:
+            return set()
+        # Lines without settings were written before they were recorded
+        return set(line[1] for line in lines if len(line) == 2 and line[0] == self.settings)
+
+    def status(self):
+        """Describe the progress and throughput of the job.
+
+        :return: job status
+        :rtype: {str: object}
+        """
+        elapsed = ((self.end_time or time.time()) - self.start_time) if self.start_time else 0.
+        return {
+            'id': self.id,
+            'state': self.state,
+            'total': self.total,
+            'done': self.done,
+            'skipped': self.skipped,
+            'failed': self.failed,
+            'errors': list(self.errors),
+            'elapsed': elapsed,
+            'images_per_second': self.done / elapsed if elapsed else None,
+            'megabytes_written': self.bytes_written / 1024. ** 2,
+            'stage_seconds': dict(self.stage_seconds),
+        }
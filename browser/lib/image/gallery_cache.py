@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import cStringIO
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+MAX_SIZE = 128 * 1024 ** 2    # Memory allowed for the cached galleries (plain and compressed), in bytes
+GZIP_LEVEL = 6                # Compression level of the cached galleries, from 1 (fast) to 9 (small)
+
+
+class GalleryCache:
+    """
+    In memory cache of rendered galleries (HTML pages and JSON listings), keyed by the signature of what they show.
+
+    A gallery only depends on the folder listing and on the thumbnails of its images: as long as none of them changed,
+    showing the folder again is a cache lookup, and the key doubles as the ETag sent to the browser. Each entry is
+    stored both plain and gzip compressed, so that it is only compressed once. The least recently used entries are
+    evicted when the cache exceeds MAX_SIZE.
+    """
+    _entries = OrderedDict()    # Cached galleries by key, least recently used first
+    _size = 0                   # Total size of the cached galleries, in bytes
+    _lock = threading.Lock()
+    hits = 0
+    misses = 0
+
+    @staticmethod
+    def key(*parts):
+        """Build the cache key of a gallery.
+
+        :param object parts: everything the gallery depends on (kind of rendering, folder signature, ...)
+
+        :return: cache key
+        :rtype: str
+        """
+        return hashlib.sha1(repr(parts)).hexdigest()
+
+    @classmethod
+    def get(cls, key):
+        """Find a rendered gallery.
+
+        :param str key: cache key
+
+        :return: entry with etag, body, gzip (compressed body) and content_type keys, None if not cached
+        :rtype: {str: object}
+        """
+        with cls._lock:
+            entry = cls._entries.pop(key, None)
+            if entry is None:
+                cls.misses += 1
+                return None
+            cls._entries[key] = entry
+            cls.hits += 1
+            return entry
+
+    @classmethod
+    def put(cls, key, body, content_type):
+        """Store a rendered gallery, evicting the least recently used ones if needed.
+
+        :param str key: cache key
+        :param bytes body: rendered gallery
+        :param str content_type: MIME type of the gallery
+
+        :return: cache entry
+        :rtype: {str: object}
+        """
+        buf = cStringIO.StringIO()
+        # Fixed timestamp, so that the same gallery always compresses to the same bytes
+        with gzip.GzipFile(fileobj=buf, mode='wb', compresslevel=GZIP_LEVEL, mtime=0) as f:
+            f.write(body)
+        entry = {'etag': key, 'body': body, 'gzip': buf.getvalue(), 'content_type': content_type}
+
+        with cls._lock:
+            previous = cls._entries.pop(key, None)
+            if previous is not None:
+                cls._size -= cls.entry_size(previous)
+            cls._entries[key] = entry
+            cls._size += cls.entry_size(entry)
+            while cls._size > MAX_SIZE and len(cls._entries) > 1:
+                _, evicted = cls._entries.popitem(last=False)
+                cls._size -= cls.entry_size(evicted)
+        return entry
+
+    @staticmethod
+    def entry_size(entry):
+        return len(entry['body']) + len(entry['gzip'])
+
+    @classmethod
+    def stats(cls):
+        """Describe the cache usage.
+
+        :return: number of entries, size in bytes, hits and misses
+        :rtype: {str: int}
+        """
+        with cls._lock:
+            return {'entries': len(cls._entries), 'size': cls._size, 'hits': cls.hits, 'misses': cls.misses}
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import threading
+from importlib import import_module
+
+SIMPLE_FORMATS = ['.png', '.jpg']
+RAW_FORMATS = ['.cr2']
+
+# Image class decoding each file format, imported on first use so that decoding libraries (e.g. rawkit for raw
+# files) are only loaded by users who actually open such files
+CODECS = {
+    '.png': 'browser.lib.image.simple_image.SimpleImage',
+    '.jpg': 'browser.lib.image.simple_image.SimpleImage',
+    '.cr2': 'browser.lib.image.raw_image.RawImage',
+}
+
+_classes = {}
+_lock = threading.Lock()
+
+
+def extension(name):
+    """Lower case extension of a file name.
+
+    :param str name: file name
+
+    :return: extension, with leading '.'
+    :rtype: str
+    """
+    return os.path.splitext(name)[1].lower()
+
+
+def is_supported(name):
+    """Check if an image file can be decoded.
+
+    :param str name: file name
+
+    :return: True if supported
+    :rtype: bool
+    """
+    return extension(name) in CODECS
+
+
+def is_raw(name):
+    """Check if an image has a raw format.
+
+    :param str name: file name
+
+    :return: True if raw
+    :rtype: bool
+    """
+    return extension(name) in RAW_FORMATS
+
+
+def image_class(name):
+    """Get the image class decoding a file, importing it if needed.
+
+    :param str name: file name
+
+    :return: image class
+    :rtype: class
+    """
+    path = CODECS.get(extension(name), CODECS['.jpg'])
+    with _lock:
+        if path not in _classes:
+            module_name, class_name = path.rsplit('.', 1)
+            _classes[path] = getattr(import_module(module_name), class_name)
+        return _classes[path]
@@ -0,0 +1,194 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import hashlib
+import os
+import threading
+from array import array
+from collections import OrderedDict
+
+from browser.lib.image.base_image import BaseImage
+from browser.lib.image.base_image import MAX_CACHE
+from browser.lib.image.base_image import read_thumbnail
+from browser.lib.image.base_image import thumbnail_name
+
+MAX_MATERIALISED = 4 * MAX_CACHE    # Image objects kept alive per listing, on top of the processed ones
+
+
+class ImageRecord(object):
+    """
+    Lightweight description of an image in a listing, enough to render a gallery tile.
+    """
+    __slots__ = ('id', 'path', 'name', 'api_metadata')
+
+    def __init__(self, image_id, path, name, api_metadata):
+        """Describe an image without loading anything from disk.
+
+        :param int image_id: id of the image in folder
+        :param str path: full path of the image directory
+        :param str name: image file name
+        :param class api_metadata: API metadata wrapper
+
+        :return: None
+        :rtype: NoneType
+        """
+        self.id = image_id
+        self.path = path
+        self.name = name
+        self.api_metadata = api_metadata
+
+    @property
+    def short_name(self):
+        return self.name[:15] + ('..' if len(self.name) > 15 else '')
+
+    @property
+    def ext(self):
+        return os.path.splitext(self.name)[1].lower()
+
+    @property
+    def thumbnail(self):
+        return read_thumbnail(thumbnail_name(self.api_metadata, self.path, self.name))
+
+
+class ImageListing(object):
+    """
+    Compact listing of the images of a folder.
+
+    Only the names (and file sizes / modification times when known from a remote listing) are kept, in flat columns.
+    Heavy image objects are materialised lazily, when an image is actually viewed or prefetched, and only a bounded
+    number of them are kept alive.
+    """
+
+    def __init__(self, path, names, create_image, api_metadata, mtimes=None, sizes=None):
+        """Build a listing.
+
+        :param str path: full path of the folder
+        :param [str] names: image file names, in display order
+        :param method create_image: factory building an image object from its id, path, name and stat
+        :param class api_metadata: API metadata wrapper
+        :param [str] mtimes: modification times of the files if known, None otherwise
+        :param [int] sizes: sizes of the files if known, None otherwise
+
+        :return: None
+        :rtype: NoneType
+        """
+        self.path = path
+        self.names = names
+        self.mtimes = mtimes
+        self.sizes = array(b'l', sizes) if sizes is not None else None
+        self.api_metadata = api_metadata
+        self._create_image = create_image
+        self._materialised = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.names)
+
+    def __getitem__(self, image_id):
+        """Materialise an image object (or reuse the existing one).
+
+        :param int image_id: id of the image in folder
+
+        :return: image object
+        :rtype: browser.lib.image.base_image.BaseImage
+        """
+        image_id = self._check_id(image_id)
+        with self._lock:
+            image = self._materialised.pop(image_id, None)
+            if image is None:
+                stat = (self.mtimes[image_id], self.sizes[image_id]) if self.sizes is not None else None
+                # Processed images stay pinned by the image cache: reusing them, unless the file changed since (ids
+                # may shift too if the folder changed)
+                image = BaseImage.cached(self.api_metadata, self.path, self.names[image_id])
+                if image is not None and stat is not None and image.stat != stat:
+                    image = None
+                if image is not None:
+                    image.id = image_id
+                else:
+                    image = self._create_image(image_id, self.path, self.names[image_id], process=False, stat=stat)
+            self._materialised[image_id] = image
+            self._evict()
+        return image
+
+    def __iter__(self):
+        return self.records()
+
+    def index(self, name):
+        """Find the id of an image from its file name.
+
+        :param str name: image file name
+
+        :return: id of the image in folder
+        :rtype: int
+        """
+        return self.names.index(name)
+
+    def signature(self):
+        """Digest of everything a gallery of the folder shows: image names, file versions when known from the listing,
+        and thumbnails, which are written in the background and replace the default one as they are generated.
+
+        Only thumbnails are stat'ed (one stat per image), nothing is read.
+
+        :return: folder signature
+        :rtype: str
+        """
+        digest = hashlib.sha1(repr((self.api_metadata.name, self.path)))
+        for image_id, name in enumerate(self.names):
+            try:
+                thumbnail_mtime = os.stat(thumbnail_name(self.api_metadata, self.path, name)).st_mtime
+            except OSError:
+                thumbnail_mtime = None
+            version = (self.mtimes[image_id], self.sizes[image_id]) if self.sizes is not None else None
+            digest.update(repr((name, version, thumbnail_mtime)))
+        return digest.hexdigest()
+
+    def record(self, image_id):
+        """Describe an image without materialising it.
+
+        :param int image_id: id of the image in folder
+
+        :return: image record
+        :rtype: ImageRecord
+        """
+        image_id = self._check_id(image_id)
+        return ImageRecord(image_id, self.path, self.names[image_id], self.api_metadata)
+
+    def records(self, start=0, stop=None):
+        """Iterate over image records, e.g. to render the gallery.
+
+        :param int start: first image id
+        :param int stop: image id to stop at (excluded), None for the end of the listing
+
+        :return: image records
+        :rtype: iterator
+        """
+        for image_id in range(start, len(self) if stop is None else min(stop, len(self))):
+            yield ImageRecord(image_id, self.path, self.names[image_id], self.api_metadata)
+
+    def _check_id(self, image_id):
+        """Normalise an image id, supporting negative ids like lists do.
+
+        :param int image_id: id of the image in folder
+
+        :return: positive image id
+        :rtype: int
+        """
+        if image_id < 0:
+            image_id += len(self)
+        if not 0 <= image_id < len(self):
+            raise IndexError('image id out of range')
+        return image_id
+
+    def _evict(self):
+        """Drop the least recently used image objects, keeping the processed ones (they're held by the image cache).
+
+        :return: None
+        :rtype: NoneType
+        """
+        if len(self._materialised) <= MAX_MATERIALISED:
+            return
+        for image_id, image in list(self._materialised.items()):
+            if len(self._materialised) <= MAX_MATERIALISED:
+                break
+            if not image.is_processed():
+                del self._materialised[image_id]
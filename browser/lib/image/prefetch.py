@@ -0,0 +1,205 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import OrderedDict
+
+MEMORY_BUDGET = 2 * 1024 ** 3     # Bytes of decoded images we accept to hold ahead of the user
+CPU_BUDGET = 30.                  # Seconds of decoding work we accept to queue ahead of the user
+MIN_WINDOW = 2                    # Always prefetch at least that many images ahead
+BACKWARD_SHARE = 0.25             # Share of the window kept behind the user (the "wrong" direction)
+SMOOTHING = 0.3                   # Exponential smoothing factor for velocity / cost estimates
+IDLE_RESET = 60.                  # Seconds after which a session's velocity is forgotten
+MAX_SESSIONS = 1000               # Navigation states kept at once, the least recently active ones being forgotten
+
+# Prior decode costs, refined at runtime with measured values: (seconds, bytes) of a decoded image per format
+DEFAULT_COSTS = {
+    '.cr2': (2.5, 3 * 5472 * 3648),
+    '.jpg': (0.4, 3 * 4000 * 3000),
+    '.png': (0.6, 3 * 4000 * 3000),
+}
+FALLBACK_COST = (1., 3 * 4000 * 3000)
+PREVIEW_RATIO = 0.3               # Prior cost of a reduced resolution decoding, relative to a full one
+
+
+class PrefetchPolicy:
+    """
+    Navigation-aware prefetch policy.
+
+    Tracks, per browsing session, the direction and velocity of the navigation in the viewer, and sizes the
+    prefetch window using a memory and CPU budget and the expected decode cost of each image format.
+    Also keeps track of the hit rate of the prefetching (requested image already decoded when shown).
+    """
+    _lock = threading.Lock()
+    _sessions = OrderedDict()                  # Navigation state per session key, least recently active first
+    _costs = dict(DEFAULT_COSTS)               # Expected (seconds, bytes) decode cost per file extension
+    _preview_costs = {}                        # Same, for reduced resolution decodings
+    _stats = {'hits': 0, 'misses': 0}          # Prefetch efficiency counters
+
+    @classmethod
+    def record_navigation(cls, session_key, image_id):
+        """Update the navigation state of a session with the image being shown.
+
+        :param str session_key: browsing session identifier
+        :param int image_id: id of the image requested
+
+        :return: navigation state, with direction (+1 / -1) and velocity (images per second)
+        :rtype: {str: object}
+        """
+        now = time.time()
+        with cls._lock:
+            state = cls._sessions.pop(session_key, None)
+            if state is None or now - state['time'] > IDLE_RESET:
+                state = {'image_id': image_id, 'time': now, 'direction': 1, 'velocity': 0.}
+            else:
+                step = image_id - state['image_id']
+                elapsed = max(now - state['time'], 1e-3)
+                if step != 0:
+                    # Jumps (e.g. wrapping around the folder) count as a single step
+                    state['direction'] = 1 if step > 0 else -1
+                    speed = min(abs(step), 1) / elapsed
+                    state['velocity'] = SMOOTHING * speed + (1 - SMOOTHING) * state['velocity']
+                state['image_id'] = image_id
+                state['time'] = now
+            cls._sessions[session_key] = state
+            # Idle states would be reset anyway, dropping them keeps memory bounded on long running servers
+            while cls._sessions:
+                oldest = next(iter(cls._sessions.values()))
+                if len(cls._sessions) <= MAX_SESSIONS and now - oldest['time'] <= IDLE_RESET:
+                    break
+                cls._sessions.popitem(last=False)
+            return dict(state)
+
+    @classmethod
+    def record_decode(cls, ext, seconds, n_bytes, preview=False):
+        """Refine the expected decode cost of a file format with a measured value.
+
+        :param str ext: file extension (lower case, with leading '.')
+        :param float seconds: measured decoding / encoding time
+        :param int n_bytes: size in memory of the decoded image
+        :param bool preview: True if measured on a reduced resolution decoding
+
+        :return: None
+        :rtype: NoneType
+        """
+        with cls._lock:
+            costs = cls._preview_costs if preview else cls._costs
+            old_seconds, old_bytes = costs.get(ext) or cls._prior_cost(ext, preview)
+            costs[ext] = (
+                SMOOTHING * seconds + (1 - SMOOTHING) * old_seconds,
+                SMOOTHING * n_bytes + (1 - SMOOTHING) * old_bytes,
+            )
+
+    @classmethod
+    def record_hit(cls, hit):
+        """Count a prefetch hit (image already processed when requested) or miss.
+
+        :param bool hit: True if hit
+
+        :return: None
+        :rtype: NoneType
+        """
+        with cls._lock:
+            cls._stats['hits' if hit else 'misses'] += 1
+
+    @classmethod
+    def expected_cost(cls, ext, preview=False):
+        """Expected decode cost of a file format.
+
+        :param str ext: file extension
+        :param bool preview: True for a reduced resolution decoding
+
+        :return: decoding time in seconds and decoded size in bytes
+        :rtype: (float, float)
+        """
+        return (cls._preview_costs if preview else cls._costs).get(ext) or cls._prior_cost(ext, preview)
+
+    @classmethod
+    def _prior_cost(cls, ext, preview):
+        """Decode cost of a file format before anything was measured.
+
+        :param str ext: file extension
+        :param bool preview: True for a reduced resolution decoding
+
+        :return: decoding time in seconds and decoded size in bytes
+        :rtype: (float, float)
+        """
+        seconds, n_bytes = cls._costs.get(ext, FALLBACK_COST)
+        if preview:
+            return PREVIEW_RATIO * seconds, PREVIEW_RATIO * n_bytes
+        return seconds, n_bytes
+
+    @classmethod
+    def offsets(cls, state, images, max_window):
+        """Compute the offsets (relative to the current image) of the images to prefetch, by priority order.
+
+        The window is split between the navigation direction and the opposite one, and capped by the memory and CPU
+        budgets. When the user skims faster than images can be decoded, the window starts further ahead, where the user
+        will be by the time the decoding is done, instead of wasting CPU on images that will be skipped.
+
+        :param {str: object} state: navigation state, as returned by record_navigation
+        :param browser.lib.image.image_listing.ImageListing images: images of the current folder
+        :param int max_window: maximum number of images to prefetch
+
+        :return: offsets to prefetch
+        :rtype: [int]
+        """
+        n_images = len(images)
+        direction = state['direction']
+        window = min(max_window, n_images - 1)
+        if window <= 0:
+            return []
+
+        mean_seconds, mean_bytes = cls._mean_cost(images, state['image_id'], direction, window)
+        budget = min(int(MEMORY_BUDGET / mean_bytes), int(CPU_BUDGET / mean_seconds))
+        window = min(window, max(MIN_WINDOW, budget))
+        backward = int(window * BACKWARD_SHARE) if state['velocity'] == 0 else min(1, window - 1)
+        forward = window - backward
+        # Images the user will have passed by the time they're decoded are not worth prefetching
+        lead = min(int(state['velocity'] * mean_seconds), n_images - 1 - window)
+
+        ahead = [direction * (lead + i) for i in range(1, forward + 1)]
+        behind = [-direction * i for i in range(1, backward + 1)]
+        # Interleave the closest images first, keeping the navigation direction prioritary
+        offsets = []
+        for offset in ahead[:1] + behind[:1] + ahead[1:] + behind[1:]:
+            # Skipping the current image and images reached twice when the window wraps around the folder
+            if offset % n_images != 0 and offset % n_images not in [o % n_images for o in offsets]:
+                offsets.append(offset)
+        return offsets
+
+    @classmethod
+    def _mean_cost(cls, images, image_id, direction, window):
+        """Average expected decode cost of the images in the navigation direction.
+
+        :param browser.lib.image.image_listing.ImageListing images: images of the current folder
+        :param int image_id: id of the current image
+        :param int direction: navigation direction
+        :param int window: number of images to consider
+
+        :return: mean decoding time in seconds and decoded size in bytes
+        :rtype: (float, float)
+        """
+        costs = [
+            cls.expected_cost(images.record((image_id + direction * i) % len(images)).ext) for i in range(1, window + 1)
+        ]
+        return sum(c[0] for c in costs) / float(len(costs)), sum(c[1] for c in costs) / float(len(costs))
+
+    @classmethod
+    def stats(cls):
+        """Describe the prefetch efficiency and current cost estimates, to help tuning the budgets.
+
+        :return: hit rate, counters and expected cost per format
+        :rtype: {str: object}
+        """
+        with cls._lock:
+            total = cls._stats['hits'] + cls._stats['misses']
+            return {
+                'hits': cls._stats['hits'],
+                'misses': cls._stats['misses'],
+                'hit_rate': float(cls._stats['hits']) / total if total else None,
+                'sessions': len(cls._sessions),
+                'costs': {ext: {'seconds': c[0], 'bytes': c[1]} for ext, c in cls._costs.items()},
+                'preview_costs': {ext: {'seconds': c[0], 'bytes': c[1]} for ext, c in cls._preview_costs.items()},
+            }
@@ -1,36 +1,55 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
-import os
-import numpy as np
+import ctypes
 
 from browser.lib.image.base_image import BaseImage
+from browser.lib.image.image_formats import is_raw
+from libraw.errors import raise_if_error
 from PIL import Image
 from rawkit.raw import Raw
 
-RAW_FORMATS = ['.cr2']
-
 
 class RawImage(BaseImage):
 
-    def decode(self):
+    def decode(self, preview=False):
         """Decode raw image from file using rawkit.raw.
-        Size of image from metadata - depends on image orientation, refer to below link for more info.
+        Orientation of image from metadata, refer to below link for more info.
             http://www.impulseadventure.com/photo/exif-orientation.html
 
+        The processed image is handed from libraw memory to PIL without intermediate copies, and the libraw handle is
+        released as soon as PIL owns the pixels.
+
+        :param bool preview: True to demosaic at half size (4 times less pixels, much faster)
+
         :return: decoded image
         :rtype: PIL Image
         """
-        raw = Raw(self.file_stream(self.path + '/' + self.name))
-        if raw.metadata.orientation >= 5:
-            self.size = raw.metadata.height, raw.metadata.width
-            self.orientation = 1
-        else:
-            self.size = raw.metadata.width, raw.metadata.height
-            self.orientation = 0
-        # Raw to bytes - maybe at some point we'll want to keep the Raw object too?
-        image_bytes = np.array(raw.to_buffer())
-        return Image.frombytes('RGB', self.size, image_bytes)
+        with Raw(self.file_stream(self.path + '/' + self.name)) as raw:
+            self.orientation = 1 if raw.metadata.orientation >= 5 else 0
+            # Not exposed by rawkit options, and left untouched by them when processing
+            raw.data.contents.params.half_size = 1 if preview else 0
+            raw.unpack()
+            raw.process()
+
+            status = ctypes.c_int(0)
+            processed = raw.libraw.libraw_dcraw_make_mem_image(raw.data, ctypes.byref(status))
+            raise_if_error(status.value)
+            try:
+                # Dimensions after flip and half size processing
+                size = processed.contents.width, processed.contents.height
+                # ctypes view over libraw memory, read once by PIL when unpacking into its own storage
+                pixels = ctypes.cast(
+                    processed.contents.data, ctypes.POINTER(ctypes.c_byte * processed.contents.data_size)
+                ).contents
+                decoded = Image.frombuffer('RGB', size, pixels, 'raw', 'RGB', 0, 1)
+                decoded.load()
+                # Previews are half size, the viewer reads the full resolution dimensions
+                if not preview:
+                    self.size = size
+            finally:
+                raw.libraw.libraw_dcraw_clear_mem(processed)
+        return decoded
 
     @staticmethod
     def is_raw(name):
@@ -41,4 +60,4 @@ class RawImage(BaseImage):
         :return: True if raw, False otherwise
         :rtype: bool
         """
-        return os.path.splitext(name)[1].lower() in RAW_FORMATS
+        return is_raw(name)
@@ -0,0 +1,233 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import cStringIO
+import hashlib
+import os
+import tempfile
+import threading
+
+CACHE_DIR = os.path.dirname(os.path.realpath(__file__)) + '/.cache/renditions/'
+MAX_SIZE = 2 * 1024 ** 3    # Disk space allowed for the cached renditions, in bytes
+TRIM_RATIO = 0.9            # When over MAX_SIZE, evicting the least recently used renditions down to that ratio
+MIME_TYPES = {
+    'jpeg': 'image/jpeg',
+    'webp': 'image/webp',
+    'png': 'image/png',
+}
+
+
+def rendition_size(rendition):
+    """Dimensions of an encoded rendition, only parsing its header.
+
+    :param bytes rendition: encoded image
+
+    :return: width and height
+    :rtype: (int, int)
+    """
+    from PIL import Image
+    return Image.open(cStringIO.StringIO(rendition)).size
+
+
+class Encoder:
+    """
+    Encoding parameters of the renditions sent to the browser.
+    """
+
+    def __init__(self, format='jpeg', quality=85, progressive=True):
+        """Define an encoder.
+
+        :param str format: output format, one of MIME_TYPES keys
+        :param int quality: compression quality (jpeg and webp), from 1 to 100
+        :param bool progressive: True for progressive jpeg
+
+        :return: None
+        :rtype: NoneType
+        """
+        if format not in MIME_TYPES:
+            raise ValueError('Unsupported rendition format: {}'.format(format))
+        self.format = format
+        self.quality = int(quality)
+        self.progressive = bool(progressive) and format == 'jpeg'
+        self.mime = MIME_TYPES[format]
+
+    def params(self):
+        """Describe the encoding parameters, to be used in rendition cache keys.
+
+        :return: encoding parameters
+        :rtype: str
+        """
+        return '{}-q{}{}'.format(self.format, self.quality, '-p' if self.progressive else '')
+
+    def encode(self, image):
+        """Encode an image.
+
+        :param PIL.Image image: decoded image
+
+        :return: encoded image
+        :rtype: bytes
+        """
+        if self.format == 'jpeg' and image.mode not in ('RGB', 'L'):
+            image = image.convert('RGB')
+        tmp_buffer = cStringIO.StringIO()
+        options = {'quality': self.quality}
+        if self.progressive:
+            options['progressive'] = True
+        image.save(tmp_buffer, format=self.format, **options)
+        return tmp_buffer.getvalue()
+
+
+class RenditionCache:
+    """
+    Disk cache of encoded renditions, so that viewing an image again only costs a file read.
+    Entries are keyed by source file path, modification time, size and rendition parameters, and the least recently
+    used ones are evicted when the cache exceeds MAX_SIZE.
+    """
+    _lock = threading.Lock()
+    _size = None                # Total size of the cache on disk, computed on first use
+
+    @staticmethod
+    def key(source, signature, params):
+        """Build the cache key of a rendition.
+
+        :param str source: unique source name (API name and file path)
+        :param tuple signature: source modification time and size
+        :param str params: rendition parameters
+
+        :return: cache key
+        :rtype: str
+        """
+        raw_key = '|'.join([source] + [str(s) for s in signature] + [params])
+        return hashlib.sha1(raw_key.encode('utf-8')).hexdigest()
+
+    @staticmethod
+    def file_name(key):
+        """Path of a cache entry on disk.
+
+        :param str key: cache key
+
+        :return: file path
+        :rtype: str
+        """
+        return CACHE_DIR + key[:2] + '/' + key
+
+    @classmethod
+    def get(cls, key):
+        """Read a rendition from the cache.
+
+        :param str key: cache key
+
+        :return: encoded rendition, None if not cached
+        :rtype: bytes
+        """
+        name = cls.file_name(key)
+        try:
+            with open(name, 'rb') as cached:
+                data = cached.read()
+            # Marking entry as recently used
+            os.utime(name, None)
+            return data
+        except (IOError, OSError):
+            return None
+
+    @classmethod
+    def exists(cls, key):
+        """Check if a rendition is cached, without reading it.
+
+        :param str key: cache key
+
+        :return: True if cached
+        :rtype: bool
+        """
+        return os.path.isfile(cls.file_name(key))
+
+    @classmethod
+    def put(cls, key, data):
+        """Store a rendition in the cache, evicting old entries if needed.
+
+        :param str key: cache key
+        :param bytes data: encoded rendition
+
+        :return: None
+        :rtype: NoneType
+        """
+        name = cls.file_name(key)
+        if not os.path.isdir(os.path.dirname(name)):
+            try:
+                os.makedirs(os.path.dirname(name))
+            except OSError:
+                pass  # Created concurrently
+        # Writing to a temporary file first, so that readers never see partial renditions
+        fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(name))
+        with os.fdopen(fd, 'wb') as tmp:
+            tmp.write(data)
+        os.rename(tmp_name, name)
+
+        with cls._lock:
+            cls._size = cls.disk_usage() if cls._size is None else cls._size + len(data)
+            if cls._size > MAX_SIZE:
+                cls.trim()
+
+    @classmethod
+    def invalidate(cls, key):
+        """Remove a rendition from the cache.
+
+        :param str key: cache key
+
+        :return: None
+        :rtype: NoneType
+        """
+        try:
+            size = os.path.getsize(cls.file_name(key))
+            os.remove(cls.file_name(key))
+        except OSError:
+            return
+        with cls._lock:
+            if cls._size is not None:
+                cls._size -= size
+
+    @classmethod
+    def entries(cls):
+        """List the cache entries on disk.
+
+        :return: path, last use time and size of each entry
+        :rtype: [(str, float, int)]
+        """
+        entries = []
+        if not os.path.isdir(CACHE_DIR):
+            return entries
+        for shard in os.listdir(CACHE_DIR):
+            for key in os.listdir(CACHE_DIR + shard):
+                try:
+                    stat = os.stat(CACHE_DIR + shard + '/' + key)
+                except OSError:
+                    continue
+                entries.append((CACHE_DIR + shard + '/' + key, stat.st_mtime, stat.st_size))
+        return entries
+
+    @classmethod
+    def disk_usage(cls):
+        """Total size of the cache on disk.
+
+        :return: size in bytes
+        :rtype: int
+        """
+        return sum(e[2] for e in cls.entries())
+
+    @classmethod
+    def trim(cls):
+        """Evict least recently used entries until the cache is under TRIM_RATIO * MAX_SIZE. Expects the lock held.
+
+        :return: None
+        :rtype: NoneType
+        """
+        entries = sorted(cls.entries(), key=lambda e: e[1])
+        cls._size = sum(e[2] for e in entries)
+        for name, _, size in entries:
+            if cls._size <= TRIM_RATIO * MAX_SIZE:
+                break
+            try:
+                os.remove(name)
+                cls._size -= size
+            except OSError:
+                pass
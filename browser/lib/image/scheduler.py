@@ -0,0 +1,186 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import deque
+from collections import OrderedDict
+
+MAX_SESSIONS = 50       # Browsing sessions tracked at once, the least recently active ones being forgotten
+IDLE_TIMEOUT = 600.     # Seconds after which an inactive session loses its pending jobs
+
+
+class DecodeScheduler(object):
+    """
+    Decoding pool shared by all browsing sessions, and fair between them.
+
+    Each session has its own queue of images to decode, in priority order, and its own cursor (folder, current image
+    and navigation direction). Workers serve the sessions with pending jobs in turn, one job at a time, so that a user
+    skimming through a large folder can't starve the others; and a session replacing its prefetch plan only drops its
+    own pending jobs. An image already being decoded (e.g. requested by two sessions) is not decoded twice.
+    """
+
+    def __init__(self, n_workers):
+        """Create the pool, whose workers are started on first use.
+
+        :param int n_workers: number of decoding threads
+
+        :return: None
+        :rtype: NoneType
+        """
+        self.n_workers = n_workers
+        self._sessions = OrderedDict()  # Session key -> state, least recently active first
+        self._turns = deque()           # Sessions with pending jobs, in serving order
+        self._running = set()           # Images being decoded
+        self._cond = threading.Condition()
+        self._workers = []
+
+    @staticmethod
+    def job_key(image):
+        return image.api_metadata.name, image.path, image.name
+
+    def session(self, session_key):
+        """Get the state of a session, creating it if needed, and mark it as active (to be called with the lock).
+
+        :param str session_key: browsing session identifier (None for jobs not tied to a user)
+
+        :return: pending jobs and cursor of the session
+        :rtype: {str: object}
+        """
+        state = self._sessions.pop(session_key, None)
+        if state is None:
+            state = {'queue': deque(), 'folder': None, 'image_id': None, 'direction': 1}
+        state['time'] = time.time()
+        self._sessions[session_key] = state
+        while len(self._sessions) > MAX_SESSIONS:
+            self._sessions.popitem(last=False)
+        return state
+
+    def focus(self, session_key, image, direction=1):
+        """Record the image a session is looking at, which the cache uses to decide what the session still needs.
+
+        :param str session_key: browsing session identifier
+        :param browser.lib.image.base_image.BaseImage image: image shown
+        :param int direction: navigation direction, +1 or -1
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self._cond:
+            state = self.session(session_key)
+            state['folder'] = image.api_metadata.name, image.path
+            state['image_id'] = image.id
+            state['direction'] = direction
+
+    def cursor(self, session_key):
+        """Find where a session is.
+
+        :param str session_key: browsing session identifier
+
+        :return: folder (backend name and path), current image id and navigation direction, None if unknown
+        :rtype: ((str, str), int, int)
+        """
+        with self._cond:
+            state = self._sessions.get(session_key)
+            if state is None or state['folder'] is None:
+                return None
+            return state['folder'], state['image_id'], state['direction']
+
+    def prefetch(self, session_key, images):
+        """Replace the pending jobs of a session, leaving the other sessions' ones untouched.
+
+        :param str session_key: browsing session identifier
+        :param [browser.lib.image.base_image.BaseImage] images: images to decode, by priority order
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self._cond:
+            state = self.session(session_key)
+            state['queue'] = deque(images)
+            self._schedule(session_key, state)
+
+    def submit(self, session_key, image):
+        """Add a job after the pending ones of a session.
+
+        :param str session_key: browsing session identifier
+        :param browser.lib.image.base_image.BaseImage image: image to decode
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self._cond:
+            state = self.session(session_key)
+            state['queue'].append(image)
+            self._schedule(session_key, state)
+
+    def _schedule(self, session_key, state):
+        """Give a session with pending jobs its turn, and wake the workers up (to be called with the lock).
+
+        :param str session_key: browsing session identifier
+        :param dict state: state of the session
+
+        :return: None
+        :rtype: NoneType
+        """
+        if state['queue'] and session_key not in self._turns:
+            self._turns.append(session_key)
+        while len(self._workers) < self.n_workers:
+            worker = threading.Thread(target=self._work)
+            worker.daemon = True
+            worker.start()
+            self._workers.append(worker)
+        self._cond.notify_all()
+
+    def _next_job(self):
+        """Wait for the next job, taking sessions in turn.
+
+        :return: session key and image to decode
+        :rtype: str, browser.lib.image.base_image.BaseImage
+        """
+        with self._cond:
+            while True:
+                now = time.time()
+                while self._turns:
+                    session_key = self._turns.popleft()
+                    state = self._sessions.get(session_key)
+                    if state is None or now - state['time'] > IDLE_TIMEOUT:
+                        continue
+                    image = state['queue'].popleft() if state['queue'] else None
+                    if state['queue']:
+                        self._turns.append(session_key)
+                    if image is None or image.is_processed() or self.job_key(image) in self._running:
+                        continue
+                    self._running.add(self.job_key(image))
+                    return session_key, image
+                self._cond.wait()
+
+    def _work(self):
+        """Decode images, forever.
+
+        :return: None
+        :rtype: NoneType
+        """
+        while True:
+            session_key, image = self._next_job()
+            try:
+                image.decode_encode(session_key)
+            except Exception:
+                # Unreadable files fail again when actually shown, where the error is reported
+                pass
+            finally:
+                with self._cond:
+                    self._running.discard(self.job_key(image))
+
+    def stats(self):
+        """Describe the pool activity.
+
+        :return: number of active sessions, pending jobs per session, and images being decoded
+        :rtype: {str: object}
+        """
+        with self._cond:
+            return {
+                'sessions': len(self._sessions),
+                'pending': sum(len(state['queue']) for state in self._sessions.values()),
+                'running': len(self._running),
+            }
@@ -4,18 +4,21 @@ from __future__ import unicode_literals
 from browser.lib.image.base_image import BaseImage
 from PIL import Image
 
-SIMPLE_FORMATS = ['.png', '.jpg']
-
 
 class SimpleImage(BaseImage):
 
-    def decode(self):
+    def decode(self, preview=False):
         """Decode raw image from file using PIL.
 
+        :param bool preview: True to let the JPEG decoder downscale while decoding (DCT scaling, much faster)
+
         :return: decoded image
         :rtype: PIL Image
         """
         decoded = Image.open(self.file_stream(self.path + '/' + self.name))
+        # Full resolution dimensions, from the header: the viewer reads them whatever the decoding
         self.size = decoded.size
         self.orientation = 0 if self.size[0] > self.size[1] else 1
+        if preview:
+            decoded.draft('RGB', (decoded.size[0] // 2, decoded.size[1] // 2))
         return decoded
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import threading
+import time
+from collections import deque
+from collections import OrderedDict
+
+from browser.lib.image.base_image import BaseImage
+from browser.lib.image.base_image import N_EXECUTORS
+from browser.lib.image.cast import CastStage
+from browser.lib.image.cast import N_CAST_EXECUTORS
+from browser.lib.image.prefetch import PrefetchPolicy
+from browser.lib.image.rendition_cache import RenditionCache
+
+MIN_INTERVAL = 1.       # Shortest time a slide is shown, in seconds
+PLAN_AHEAD = 8          # Slides planned ahead of the current one
+SAFETY_MARGIN = 1.2     # Expected decode costs are inflated by that factor when checking deadlines
+MAX_SHOWS = 50          # Slideshows kept in memory (one per browsing session)
+MAX_MISSES = 20         # Missed deadlines kept for reporting
+
+FULL = 'full'
+PREVIEW = 'preview'
+SKIP = 'skip'
+
+
+class Slideshow(object):
+    """
+    Automatic slideshow of a folder, scheduling decode work against the deadline of each slide.
+
+    Each upcoming slide is due at a known time. Using the measured decode cost of each file format (see
+    PrefetchPolicy), the scheduler simulates the decoding pools and only queues a full resolution decoding if it will
+    be done in time; otherwise it falls back on the reduced resolution preview (the cast rendition, decoded at half
+    size), and if even that would be late, the slide is skipped. The plan is revised at every slide with the latest
+    cost measurements, and deadlines missed anyway are counted and reported.
+    """
+    _shows = OrderedDict()    # Running slideshows, by session key
+    _lock = threading.Lock()
+
+    def __init__(self, images, image_id, interval, session_key=None):
+        """Start a slideshow.
+
+        :param browser.lib.image.image_listing.ImageListing images: images of the folder
+        :param int image_id: id of the first slide
+        :param float interval: time each slide is shown, in seconds
+        :param str session_key: browsing session watching the slideshow, whose decoding jobs are queued
+
+        :return: None
+        :rtype: NoneType
+        """
+        self.images = images
+        self.position = image_id
+        self.interval = max(float(interval), MIN_INTERVAL)
+        self.session_key = session_key
+        self.plan = {}          # Image id -> planned mode, for the upcoming slides
+        self.late = None        # (image id, deadline) of the current slide, if it was not ready in time
+        self.counts = {FULL: 0, PREVIEW: 0, SKIP: 0, 'degraded': 0, 'missed': 0}
+        self.lateness = 0.      # Total delay of the slides shown late, in seconds
+        self.misses = deque(maxlen=MAX_MISSES)
+        self._lock = threading.Lock()
+
+    @classmethod
+    def start(cls, session_key, images, image_id, interval):
+        """Start a slideshow for a browsing session, replacing the previous one.
+
+        :param str session_key: browsing session identifier
+        :param browser.lib.image.image_listing.ImageListing images: images of the folder
+        :param int image_id: id of the first slide
+        :param float interval: time each slide is shown, in seconds
+
+        :return: slideshow
+        :rtype: Slideshow
+        """
+        show = cls(images, image_id, interval, session_key)
+        with cls._lock:
+            cls._shows.pop(session_key, None)
+            cls._shows[session_key] = show
+            while len(cls._shows) > MAX_SHOWS:
+                cls._shows.popitem(last=False)
+        show.schedule()
+        return show
+
+    @classmethod
+    def get(cls, session_key):
+        """Find the slideshow of a browsing session.
+
+        :param str session_key: browsing session identifier
+
+        :return: slideshow, None if not started
+        :rtype: Slideshow
+        """
+        with cls._lock:
+            return cls._shows.get(session_key)
+
+    @staticmethod
+    def ready_mode(image):
+        """Best rendition of an image available right now.
+
+        :param browser.lib.image.base_image.BaseImage image: image
+
+        :return: FULL, PREVIEW or None if nothing is ready
+        :rtype: str
+        """
+        if image.is_processed():
+            return FULL
+        if CastStage.is_rendered(image):
+            return PREVIEW
+        return None
+
+    def schedule(self, now=None):
+        """Plan the decoding of the upcoming slides against their deadlines, and queue the corresponding jobs.
+
+        Slides are considered by deadline order, each decoding pool being simulated as a list of worker availability
+        times: a job starts on the first available worker, and ends after the expected cost of its file format.
+        A slide which can't be ready in time is skipped if the following one can take its time slot, otherwise its
+        preview is prepared anyway, and will be shown late.
+
+        :param float now: current time, defaults to time.time()
+
+        :return: planned mode of the upcoming slides, by image id
+        :rtype: {int: str}
+        """
+        now = time.time() if now is None else now
+        n_images = len(self.images)
+        workers = {FULL: [now] * N_EXECUTORS, PREVIEW: [now] * N_CAST_EXECUTORS}
+        image_ids = [(self.position + offset) % n_images for offset in range(1, min(PLAN_AHEAD, n_images - 1) + 1)]
+        plan = OrderedDict()
+        # The session queue is only filled with this plan's jobs, so that the simulation matches what the pool will
+        # do (other sessions get their turn too, which the safety margin is left to absorb)
+        BaseImage.prefetch(self.session_key, [])
+
+        slot = 1
+        for i, image_id in enumerate(image_ids):
+            image = self.images[image_id]
+            deadline = now + slot * self.interval
+            mode = self.feasible_mode(image, deadline, workers)
+            if mode is None:
+                following = self.images[image_ids[i + 1]] if i + 1 < len(image_ids) else None
+                if following is not None and self.feasible_mode(following, deadline, workers) is not None:
+                    plan[image_id] = SKIP
+                    continue
+                # Late whatever happens: preparing the cheapest rendition
+                mode = PREVIEW
+            self.queue(image, mode, workers)
+            plan[image_id] = mode
+            slot += 1
+
+        with self._lock:
+            self.plan = plan
+        return plan
+
+    def feasible_mode(self, image, deadline, workers):
+        """Best rendition of an image which can be ready by a deadline.
+
+        :param browser.lib.image.base_image.BaseImage image: image
+        :param float deadline: time at which the image is due
+        :param {str: [float]} workers: availability times of the workers of each simulated pool
+
+        :return: FULL, PREVIEW or None if nothing can be ready in time
+        :rtype: str
+        """
+        mode = self.ready_mode(image)
+        if mode is not None:
+            return mode
+        full_seconds, _ = PrefetchPolicy.expected_cost(image.ext)
+        if min(workers[FULL]) + SAFETY_MARGIN * full_seconds <= deadline:
+            return FULL
+        preview_seconds, _ = PrefetchPolicy.expected_cost(image.ext, preview=True)
+        if CastStage.is_pending(image) or min(workers[PREVIEW]) + SAFETY_MARGIN * preview_seconds <= deadline:
+            return PREVIEW
+        return None
+
+    def queue(self, image, mode, workers):
+        """Queue the job preparing a rendition of an image, and assign it to the first available simulated worker.
+
+        :param browser.lib.image.base_image.BaseImage image: image
+        :param str mode: FULL or PREVIEW
+        :param {str: [float]} workers: availability times of the workers of each simulated pool, updated in place
+
+        :return: None
+        :rtype: NoneType
+        """
+        if image.is_processed() or (mode == PREVIEW and (CastStage.is_rendered(image) or CastStage.is_pending(image))):
+            return
+        seconds, _ = PrefetchPolicy.expected_cost(image.ext, preview=mode == PREVIEW)
+        first = workers[mode].index(min(workers[mode]))
+        workers[mode][first] += seconds
+        if mode == FULL:
+            image.decode_encode_async(self.session_key)
+        else:
+            CastStage.submit(image)
+
+    def advance(self):
+        """Move to the next slide, which is due now.
+
+        Slides planned to be skipped are passed, unless their rendition is ready after all. If the next slide has
+        nothing ready, its deadline is missed: it is still shown as soon as its rendition is done.
+
+        :return: id of the slide to show, and rendition to show (FULL or PREVIEW)
+        :rtype: int, str
+        """
+        now = time.time()
+        n_images = len(self.images)
+        with self._lock:
+            plan = dict(self.plan)
+            for _ in range(max(n_images - 1, 1)):
+                self.position = (self.position + 1) % n_images
+                image = self.images[self.position]
+                mode = self.ready_mode(image)
+                if mode is not None or plan.get(self.position) != SKIP:
+                    break
+                self.counts[SKIP] += 1
+            planned = plan.get(self.position, PREVIEW)
+
+            if mode is None:
+                # Nothing ready in time: showing the planned rendition (the preview if skipping was not possible) late
+                mode = PREVIEW if planned == SKIP else planned
+                self.counts['missed'] += 1
+                self.late = (self.position, now)
+            else:
+                self.late = None
+            if planned == FULL and mode == PREVIEW:
+                self.counts['degraded'] += 1
+            self.counts[mode] += 1
+            image_id = self.position
+        BaseImage.focus(self.session_key, self.images[image_id])
+        self.schedule(now)
+        return image_id, mode
+
+    def frame(self, image_id, mode):
+        """Get the rendition of a slide, waiting for it if needed.
+
+        :param int image_id: id of the slide
+        :param str mode: FULL or PREVIEW
+
+        :return: encoded image and its MIME type
+        :rtype: bytes, str
+        """
+        image = self.images[image_id]
+        data, mime = None, CastStage.encoder.mime
+        if mode == FULL:
+            image.decode_encode(self.session_key)
+            data = RenditionCache.get(image.rendition_key(image.encoder.params()))
+            mime = image.encoder.mime
+        if data is None:
+            data = CastStage.rendition(image)
+            mime = CastStage.encoder.mime
+
+        with self._lock:
+            if self.late is not None and self.late[0] == image_id:
+                lateness = time.time() - self.late[1]
+                self.lateness += lateness
+                self.misses.append({'name': image.name, 'mode': mode, 'lateness': lateness})
+                self.late = None
+        return data, mime
+
+    def report(self):
+        """Describe how well the slideshow kept up with its deadlines.
+
+        :return: number of slides shown at full resolution, degraded to preview, skipped and late, with details on
+            the last missed deadlines
+        :rtype: {str: object}
+        """
+        with self._lock:
+            return {
+                'interval': self.interval,
+                'shown_full': self.counts[FULL],
+                'shown_preview': self.counts[PREVIEW],
+                'degraded': self.counts['degraded'],
+                'skipped': self.counts[SKIP],
+                'missed_deadlines': self.counts['missed'],
+                'mean_lateness': self.lateness / self.counts['missed'] if self.counts['missed'] else 0.,
+                'last_misses': list(self.misses),
+                'plan': [{'image_id': image_id, 'mode': mode} for image_id, mode in self.plan.items()],
+            }
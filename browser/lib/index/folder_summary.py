@@ -0,0 +1,165 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import base64
+import cStringIO
+import os
+
+from PIL import Image
+
+from browser.lib.image.base_image import thumbnail_name
+
+COVER_SIZE = (160, 160)     # Folder covers are downscaled thumbnails, small enough to be kept in the index
+COVER_QUALITY = 70
+
+
+def summarize_folders(api, index, root):
+    """Incrementally update the summaries of the folders of a library, and the totals of each sub tree.
+
+    Folders come from the refresh of the index which just ran (see summary_folders), only folders whose version
+    changed since the last run are listed again (with one stat per image for local files), and covers are only made
+    again when their source image or thumbnail changed. Totals are then derived from the summaries, in memory.
+
+    :param class api: API of the library
+    :param browser.lib.index.trigram_index.TrigramIndex index: directory index, holding the summaries
+    :param str root: root directory of the library
+
+    :return: None
+    :rtype: NoneType
+    """
+    seen = set()
+    for folder, version in api.summary_folders(index, root):
+        seen.add(folder)
+        summary = index.summary(folder)
+        if summary is None or summary['version'] != version:
+            summary = summarize(api.image_stats(folder, version), version, summary)
+        index.set_summary(folder, update_cover(api, folder, summary))
+
+    in_scope = lambda folder: is_under(folder, root)
+    summaries = index.retain_summaries(in_scope, seen)
+    index.set_totals(in_scope, aggregate(summaries, root))
+
+
+def summarize(stats, version, previous=None):
+    """Summarise the images of a folder.
+
+    :param [(float, int, str)] stats: timestamp, size (None if unknown) and name of each image
+    :param object version: folder version, changing whenever its content does
+    :param dict previous: previous summary of the folder, to keep its cover if still valid
+
+    :return: image count, total size, date range and cover source of the folder
+    :rtype: {str: object}
+    """
+    cover_source = min(name for _, _, name in stats) if stats else None
+    keep_cover = previous is not None and previous['cover_source'] == cover_source
+    return {
+        'version': version,
+        'count': len(stats),
+        'bytes': sum(size for _, size, _ in stats if size is not None),
+        'first': min(ts for ts, _, _ in stats) if stats else None,
+        'last': max(ts for ts, _, _ in stats) if stats else None,
+        'cover_source': cover_source,
+        'cover_version': previous['cover_version'] if keep_cover else None,
+        'cover': previous['cover'] if keep_cover else None,
+    }
+
+
+def update_cover(api, folder, summary):
+    """Make the cover of a folder from the thumbnail of its first image, if it changed.
+
+    Thumbnails are shared with the gallery, and created here if missing (which downloads remote images).
+
+    :param class api: API of the library
+    :param str folder: folder path
+    :param dict summary: summary of the folder
+
+    :return: summary, with an up to date cover
+    :rtype: {str: object}
+    """
+    if summary['cover_source'] is None:
+        return summary
+    thumb_file = thumbnail_name(api.Meta, folder, summary['cover_source'])
+    try:
+        version = os.path.getmtime(thumb_file)
+    except OSError:
+        version = None
+    if version is not None and version == summary['cover_version']:
+        return summary
+
+    summary = dict(summary)
+    try:
+        if version is None:
+            api.create_image(None, folder, summary['cover_source']).save_thumbnail()
+            version = os.path.getmtime(thumb_file)
+        cover = Image.open(thumb_file)
+        cover.thumbnail(COVER_SIZE)
+        buf = cStringIO.StringIO()
+        cover.convert('RGB').save(buf, format='jpeg', quality=COVER_QUALITY)
+        summary['cover'] = base64.b64encode(buf.getvalue())
+    except Exception:
+        # Unreadable image: no cover until the folder changes, rather than trying again at every refresh
+        summary['cover'] = None
+    summary['cover_version'] = version
+    return summary
+
+
+def aggregate(summaries, root):
+    """Sum up the summaries of each sub tree, deepest folders first.
+
+    Folders without images of their own (missing from remote listings) get a total too, when they have sub folders.
+    The cover of a sub tree is the one of its folder, or else the one of its first sub folder with a cover.
+
+    :param {str: dict} summaries: summary of each folder of the library
+    :param str root: root directory of the library
+
+    :return: image count, total size, date range and cover of all images under each folder
+    :rtype: {str: {str: object}}
+    """
+    totals = {}
+    children = {}
+    levels = {}
+    for folder, summary in summaries.items():
+        totals[folder] = {k: summary[k] for k in ('count', 'bytes', 'first', 'last', 'cover')}
+        levels.setdefault(depth(folder), set()).add(folder)
+
+    level = max(levels) if levels else 0
+    while levels:
+        for folder in sorted(levels.pop(level, [])):
+            total = totals[folder]
+            if total['cover'] is None:
+                covers = [totals[c]['cover'] for c in sorted(children.get(folder, [])) if totals[c]['cover']]
+                total['cover'] = covers[0] if covers else None
+            parent = os.path.dirname(folder.rstrip('/'))
+            if parent == folder or not is_under(parent, root):
+                continue
+            if parent not in totals:
+                totals[parent] = {'count': 0, 'bytes': 0, 'first': None, 'last': None, 'cover': None}
+                levels.setdefault(depth(parent), set()).add(parent)
+            merge(totals[parent], total)
+            children.setdefault(parent, []).append(folder)
+        level -= 1
+    return totals
+
+
+def merge(total, other):
+    """Add the summary of a sub tree to the total of its parent.
+
+    :param dict total: total of the parent, updated in place
+    :param dict other: total of the sub tree
+
+    :return: None
+    :rtype: NoneType
+    """
+    total['count'] += other['count']
+    total['bytes'] += other['bytes']
+    for key, pick in (('first', min), ('last', max)):
+        values = [v for v in (total[key], other[key]) if v is not None]
+        total[key] = pick(values) if values else None
+
+
+def depth(folder):
+    return len([part for part in folder.split('/') if part])
+
+
+def is_under(folder, root):
+    return not root or folder == root or folder.startswith(root.rstrip('/') + '/')
@@ -0,0 +1,470 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import cPickle
+import os
+import tempfile
+import threading
+import time
+import uuid
+
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+from browser.lib.image.base_image import thumbnail_name
+from browser.lib.index.trigram_index import INDEX_DIR
+
+HASH_SIZE = 8                   # dHash computed on a (HASH_SIZE + 1) x HASH_SIZE grid, i.e. 64 bits
+N_BANDS = 4                     # 16 bit bands used to bucket candidate duplicates
+DUPLICATE_DISTANCE = 3          # Hamming distance under which two images are near duplicates, less than N_BANDS
+COMPACT_RATIO = 0.2             # Share of removed entries triggering a rebuild of the hash array
+N_HASHERS = 2                   # Threads creating the missing thumbnails
+SAVE_EVERY = 1000               # Hashes computed between two saves of the index, when hashing a library
+MAX_ERRORS = 20                 # Errors kept for reporting
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+BAND_MASK = np.uint64(2 ** (64 // N_BANDS) - 1)
+
+
+def dhash(image):
+    """Compute the difference hash of an image: one bit per pair of horizontally adjacent pixels of a tiny grayscale
+    version of the image, set if brightness increases. Robust to resizing, compression and small edits.
+
+    :param PIL.Image image: image, typically a thumbnail
+
+    :return: perceptual hash
+    :rtype: numpy.uint64
+    """
+    small = image.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.ANTIALIAS)
+    pixels = np.asarray(small, dtype=np.int16)
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return np.packbits(bits.ravel()).view('>u8').astype(np.uint64)[0]
+
+
+def hamming(hashes, others):
+    """Vectorised Hamming distances between packed hashes.
+
+    :param numpy.ndarray hashes: uint64 hashes
+    :param numpy.ndarray others: uint64 hash, or array of hashes of the same length
+
+    :return: number of differing bits
+    :rtype: numpy.ndarray
+    """
+    xor = np.ascontiguousarray(np.bitwise_xor(hashes, others), dtype=np.uint64)
+    return POPCOUNT[xor.view(np.uint8)].reshape(-1, 8).sum(axis=1)
+
+
+class PerceptualHashIndex(object):
+    """
+    Persistent index of the perceptual hashes of a library, to find duplicate and near duplicate images.
+
+    Hashes are packed in a single uint64 array, so that a query is one vectorised XOR / popcount over the whole
+    library. Finding all duplicates avoids comparing all pairs: two hashes within N_BANDS - 1 bits of each other are
+    equal on at least one of their N_BANDS bands, so only images sharing a band value are compared, in sorted runs.
+    """
+
+    def __init__(self):
+        """Build an empty index.
+
+        :return: None
+        :rtype: NoneType
+        """
+        self.sources = []                           # (directory, name) of each row, None once removed
+        self.versions = []                          # Version of the thumbnail each hash was computed from
+        self.hashes = np.zeros(1024, dtype=np.uint64)
+        self.rows = {}                              # (directory, name) -> row
+        self.n_removed = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.sources) - self.n_removed
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        state['hashes'] = self.hashes[:len(self.sources)]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    def version(self, source):
+        """Version of the thumbnail the hash of an image was computed from.
+
+        :param tuple source: (directory, name) of the image
+
+        :return: thumbnail version, None if not indexed
+        :rtype: object
+        """
+        with self._lock:
+            row = self.rows.get(source)
+            return None if row is None else self.versions[row]
+
+    def add(self, source, version, value):
+        """Index the hash of an image, replacing the previous one.
+
+        :param tuple source: (directory, name) of the image
+        :param object version: version of the thumbnail the hash was computed from
+        :param numpy.uint64 value: perceptual hash
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            row = self.rows.get(source)
+            if row is None:
+                row = len(self.sources)
+                if row == len(self.hashes):
+                    self.hashes = np.concatenate([self.hashes, np.zeros(len(self.hashes), dtype=np.uint64)])
+                self.sources.append(source)
+                self.versions.append(version)
+                self.rows[source] = row
+            self.versions[row] = version
+            self.hashes[row] = value
+
+    def remove(self, source):
+        """Remove an image from the index (no-op if not indexed).
+
+        :param tuple source: (directory, name) of the image
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            row = self.rows.pop(source, None)
+            if row is None:
+                return
+            self.sources[row] = None
+            self.n_removed += 1
+            if self.n_removed > COMPACT_RATIO * len(self.sources):
+                self.compact()
+
+    def compact(self):
+        """Rebuild the index without the removed images.
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            kept = [row for row, source in enumerate(self.sources) if source is not None]
+            self.hashes = self.hashes[kept] if kept else np.zeros(1024, dtype=np.uint64)
+            self.sources = [self.sources[row] for row in kept]
+            self.versions = [self.versions[row] for row in kept]
+            self.rows = {source: row for row, source in enumerate(self.sources)}
+            self.n_removed = 0
+
+    def _snapshot(self):
+        """Consistent copy of the live entries.
+
+        :return: (directory, name) and hash of each indexed image
+        :rtype: [tuple], numpy.ndarray
+        """
+        with self._lock:
+            rows = np.array([row for row, source in enumerate(self.sources) if source is not None], dtype=np.int64)
+            return [self.sources[row] for row in rows], self.hashes[rows]
+
+    def similar(self, value, max_distance=DUPLICATE_DISTANCE):
+        """Find the images whose hash is close to a given one.
+
+        :param numpy.uint64 value: perceptual hash
+        :param int max_distance: maximum Hamming distance
+
+        :return: (directory, name) and distance of the similar images, closest first
+        :rtype: [(tuple, int)]
+        """
+        sources, hashes = self._snapshot()
+        distances = hamming(hashes, np.uint64(value))
+        matches = np.flatnonzero(distances <= max_distance)
+        matches = matches[np.argsort(distances[matches], kind='mergesort')]
+        return [(sources[i], int(distances[i])) for i in matches]
+
+    def duplicates(self, max_distance=DUPLICATE_DISTANCE):
+        """Group the indexed images into sets of near duplicates.
+
+        :param int max_distance: maximum Hamming distance between two duplicates, less than N_BANDS
+
+        :return: groups of (directory, name) of duplicate images, largest groups first
+        :rtype: [[tuple]]
+        """
+        if max_distance >= N_BANDS:
+            raise ValueError('Duplicates search is limited to distances under {}'.format(N_BANDS))
+        sources, hashes = self._snapshot()
+        pairs = self.close_pairs(hashes, max_distance)
+
+        # Merging pairs into groups (union-find, with path halving)
+        parents = {}
+
+        def root(i):
+            while parents.setdefault(i, i) != i:
+                parents[i] = parents[parents[i]]
+                i = parents[i]
+            return i
+
+        for i, j in pairs:
+            parents[root(i)] = root(j)
+        groups = {}
+        for i in parents:
+            groups.setdefault(root(i), []).append(sources[i])
+        return sorted((sorted(g) for g in groups.values()), key=len, reverse=True)
+
+    @staticmethod
+    def close_pairs(hashes, max_distance):
+        """Find all pairs of hashes within a Hamming distance.
+
+        For each band, hashes are sorted by band value, and each hash is compared with the following ones in the same
+        run of equal values: comparing with the hashes 1, 2, 3... positions further is done for all runs at once, the
+        candidate positions shrinking as runs end.
+
+        :param numpy.ndarray hashes: uint64 hashes
+        :param int max_distance: maximum Hamming distance, less than N_BANDS
+
+        :return: pairs of positions in the hash array
+        :rtype: [(int, int)]
+        """
+        n_hashes = len(hashes)
+        found = [np.zeros(0, dtype=np.int64)]
+        for band in range(N_BANDS):
+            values = (hashes >> np.uint64(band * 64 // N_BANDS)) & BAND_MASK
+            order = np.argsort(values, kind='mergesort')
+            sorted_values = values[order]
+            active = np.arange(n_hashes, dtype=np.int64)
+            shift = 1
+            while len(active):
+                active = active[active + shift < n_hashes]
+                active = active[sorted_values[active] == sorted_values[active + shift]]
+                left, right = order[active], order[active + shift]
+                close = hamming(hashes[left], hashes[right]) <= max_distance
+                # Encoding pairs as single integers, to deduplicate pairs found in several bands
+                low, high = np.minimum(left[close], right[close]), np.maximum(left[close], right[close])
+                found.append(low.astype(np.int64) * n_hashes + high)
+                shift += 1
+        codes = np.unique(np.concatenate(found))
+        return [(int(code // n_hashes), int(code % n_hashes)) for code in codes]
+
+    @staticmethod
+    def file_name(key):
+        """Path of a persisted index.
+
+        :param str key: index identifier (e.g. API name and root)
+
+        :return: file path
+        :rtype: str
+        """
+        return INDEX_DIR + key + '.phash'
+
+    def save(self, key):
+        """Persist the index on disk.
+
+        :param str key: index identifier
+
+        :return: None
+        :rtype: NoneType
+        """
+        if not os.path.isdir(INDEX_DIR):
+            os.makedirs(INDEX_DIR)
+        fd, tmp_name = tempfile.mkstemp(dir=INDEX_DIR)
+        with self._lock, os.fdopen(fd, 'wb') as tmp:
+            cPickle.dump(self, tmp, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_name, self.file_name(key))
+
+    @classmethod
+    def load(cls, key):
+        """Load a persisted index, or create an empty one.
+
+        :param str key: index identifier
+
+        :return: index
+        :rtype: PerceptualHashIndex
+        """
+        try:
+            with open(cls.file_name(key), 'rb') as stream:
+                index = cPickle.load(stream)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return cls()
+        # Leaving room for new hashes
+        index.hashes = np.concatenate([index.hashes, np.zeros(max(len(index.hashes), 1024), dtype=np.uint64)])
+        return index
+
+
+class HashingJob(object):
+    """
+    Background computation of the perceptual hashes of a library.
+
+    Hashes are computed from the image thumbnails: missing or outdated thumbnails are created first (this is the
+    costly part, done in parallel), and only images whose thumbnail changed since the last run are hashed again.
+    The images of the library are read from its file name index when the job runs, not to wait for the index in
+    the request starting the job.
+    """
+
+    def __init__(self, api, index, key, root, n_workers=N_HASHERS):
+        """Prepare a hashing job.
+
+        :param class api: API of the library
+        :param PerceptualHashIndex index: index to update
+        :param str key: index identifier, to persist it
+        :param str root: root directory of the library
+        :param int n_workers: threads creating thumbnails
+
+        :return: None
+        :rtype: NoneType
+        """
+        self.id = uuid.uuid4().hex
+        self.api = api
+        self.index = index
+        self.key = key
+        self.root = root
+        self.files = []
+        self.n_workers = n_workers
+
+        self.state = 'pending'
+        self.total = 0
+        self.hashed = 0
+        self.unchanged = 0
+        self.removed = 0
+        self.failed = 0
+        self.errors = []
+        self.start_time = None
+        self.end_time = None
+        self._lock = threading.Lock()
+        self._progress = None
+
+    def start(self):
+        """Run the job in a background thread.
+
+        :return: job id
+        :rtype: str
+        """
+        thread = threading.Thread(target=self.run)
+        thread.daemon = True
+        thread.start()
+        return self.id
+
+    def run(self, progress=None):
+        """Run the job, blocking until all images are hashed.
+
+        Errors on single images are counted and the job goes on; any other error ends the job in the 'failed' state,
+        so that hashing can be started again.
+
+        :param method progress: optional callback, called with the job status after each image
+
+        :return: job status
+        :rtype: {str: object}
+        """
+        self.state = 'running'
+        self.start_time = time.time()
+        self._progress = progress
+        try:
+            self.hash_library()
+        except Exception as e:
+            with self._lock:
+                self.errors.append('Hashing stopped: {}'.format(e))
+            self.state = 'failed'
+        else:
+            self.state = 'finished'
+        finally:
+            self.end_time = time.time()
+        return self.status()
+
+    def hash_library(self):
+        """Hash the images of the library, and forget the ones removed from it.
+
+        :return: None
+        :rtype: NoneType
+        """
+        self.files = sorted(self.api.library_index(self.root, wait=True).all_files())
+        self.total = len(self.files)
+
+        # Forgetting images removed from the library
+        current = set(self.files)
+        for source in [s for s in self.index.sources if s is not None and s not in current]:
+            self.index.remove(source)
+            self.removed += 1
+
+        executor = ThreadPoolExecutor(self.n_workers)
+        try:
+            for future in [executor.submit(self.hash_file, directory, name) for directory, name in self.files]:
+                future.result()
+        finally:
+            executor.shutdown()
+        self.index.save(self.key)
+
+    def hash_file(self, directory, name):
+        """Hash an image, creating its thumbnail if needed.
+
+        :param str directory: directory of the image
+        :param str name: image file name
+
+        :return: None
+        :rtype: NoneType
+        """
+        source = (directory, name)
+        try:
+            thumb_file = thumbnail_name(self.api.Meta, directory, name)
+            if not self.is_fresh(thumb_file, directory, name):
+                # Reusing the thumbnails of the gallery, created the same way
+                self.api.create_image(None, directory, name).save_thumbnail()
+            version = os.path.getmtime(thumb_file)
+            if self.index.version(source) == version:
+                self.count('unchanged')
+                return
+            thumbnail = Image.open(thumb_file)
+            self.index.add(source, version, dhash(thumbnail))
+        except Exception as e:
+            with self._lock:
+                if len(self.errors) < MAX_ERRORS:
+                    self.errors.append('{}/{}: {}'.format(directory, name, e))
+            self.count('failed')
+            return
+        self.count('hashed')
+        if self.hashed % SAVE_EVERY == 0:
+            self.index.save(self.key)
+
+    def is_fresh(self, thumb_file, directory, name):
+        """Check if a thumbnail exists, and is more recent than its image (local files only).
+
+        :param str thumb_file: thumbnail file name
+        :param str directory: directory of the image
+        :param str name: image file name
+
+        :return: True if up to date
+        :rtype: bool
+        """
+        if not os.path.isfile(thumb_file):
+            return False
+        if self.api.Meta.remote:
+            return True
+        return os.path.getmtime(thumb_file) >= os.path.getmtime(os.path.join(directory, name))
+
+    def count(self, counter):
+        """Increment a progress counter, and report progress.
+
+        :param str counter: 'hashed', 'unchanged' or 'failed'
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            setattr(self, counter, getattr(self, counter) + 1)
+        if self._progress is not None:
+            self._progress(self.status())
+
+    def status(self):
+        """Describe the progress of the job.
+
+        :return: job status
+        :rtype: {str: object}
+        """
+        elapsed = ((self.end_time or time.time()) - self.start_time) if self.start_time else 0.
+        return {
+            'id': self.id,
+            'state': self.state,
+            'total': self.total,
+            'hashed': self.hashed,
+            'unchanged': self.unchanged,
+            'removed': self.removed,
+            'failed': self.failed,
+            'errors': list(self.errors),
+            'elapsed': elapsed,
+            'indexed': len(self.index),
+        }
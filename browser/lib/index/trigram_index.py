@@ -0,0 +1,326 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import cPickle
+import os
+import tempfile
+import threading
+from array import array
+
+INDEX_DIR = os.path.dirname(os.path.realpath(__file__)) + '/.cache/'
+N = 3                       # Size of the n-grams
+COMPACT_RATIO = 0.2         # Share of removed files triggering a rebuild of the posting lists
+
+
+class TrigramIndex(object):
+    """
+    Persistent n-gram index of file names, answering substring queries over millions of files in milliseconds.
+
+    Each file gets an integer id; every (lower case) trigram of its name points to the array of ids containing it.
+    A query only scans the shortest posting list among its trigrams, and checks the candidates' names.
+    Files are added and removed incrementally; removed ids are skipped until the posting lists get compacted.
+    The index is refreshed, updated by the watcher and saved from different threads: its data is only read and changed
+    through its methods, under its lock.
+    """
+
+    def __init__(self):
+        """Build an empty index.
+
+        :return: None
+        :rtype: NoneType
+        """
+        self.dirs = []              # Directory of each file id
+        self.names = []             # Name of each file id, None once removed
+        self.postings = {}          # Trigram -> array of file ids
+        self.files = {}             # Directory -> {name: file id}
+        self.folders = {}           # Directory -> (modification time, sub directories), for incremental refreshes
+        self.summaries = {}         # Directory -> summary of its own images (see folder_summary), by folder version
+        self.totals = {}            # Directory -> summary of all images under it, derived from the summaries
+        self.n_removed = 0
+        self._lock = threading.RLock()
+
+    def __len__(self):
+        return len(self.names) - self.n_removed
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_lock']
+        return state
+
+    def __setstate__(self, state):
+        # Indexes persisted before folder summaries existed
+        state.setdefault('summaries', {})
+        state.setdefault('totals', {})
+        self.__dict__.update(state)
+        self._lock = threading.RLock()
+
+    @staticmethod
+    def ngrams(text):
+        """List the distinct n-grams of a text, case insensitive.
+
+        :param str text: text to split
+
+        :return: n-grams
+        :rtype: set
+        """
+        text = text.lower()
+        return set(text[i:i + N] for i in range(len(text) - N + 1))
+
+    def add(self, directory, name):
+        """Index a file (no-op if already indexed).
+
+        :param str directory: directory of the file
+        :param str name: file name
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            dir_files = self.files.setdefault(directory, {})
+            if name in dir_files:
+                return
+            file_id = len(self.names)
+            self.dirs.append(directory)
+            self.names.append(name)
+            dir_files[name] = file_id
+            for gram in self.ngrams(name):
+                self.postings.setdefault(gram, array(b'i')).append(file_id)
+
+    def remove(self, directory, name):
+        """Remove a file from the index (no-op if not indexed).
+
+        :param str directory: directory of the file
+        :param str name: file name
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            file_id = self.files.get(directory, {}).pop(name, None)
+            if file_id is None:
+                return
+            self.names[file_id] = None
+            self.n_removed += 1
+            self._compact_if_needed()
+
+    def remove_directory(self, directory):
+        """Remove a directory and all its files, recursively.
+
+        :param str directory: directory to remove
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            prefix = directory.rstrip('/') + '/'
+            for d in [d for d in set(self.files) | set(self.folders) if d == directory or d.startswith(prefix)]:
+                for file_id in self.files.pop(d, {}).values():
+                    self.names[file_id] = None
+                    self.n_removed += 1
+                self.folders.pop(d, None)
+                self.summaries.pop(d, None)
+            self._compact_if_needed()
+
+    def files_in(self, directory):
+        """List the indexed files of a directory.
+
+        :param str directory: directory
+
+        :return: file names
+        :rtype: set
+        """
+        with self._lock:
+            return set(self.files.get(directory, {}))
+
+    def all_files(self):
+        """List all indexed files.
+
+        :return: (directory, name) of each file
+        :rtype: set
+        """
+        with self._lock:
+            return set((d, name) for d, names in self.files.items() for name in names)
+
+    def folder(self, directory):
+        """Get what the last refresh found in a directory.
+
+        :param str directory: directory
+
+        :return: modification time and sub directories, None if not listed yet
+        :rtype: (float, [str])
+        """
+        with self._lock:
+            return self.folders.get(directory)
+
+    def folder_times(self):
+        """List the directories found by the last refresh, with their modification time.
+
+        :return: (directory, modification time) tuples
+        :rtype: [(str, float)]
+        """
+        with self._lock:
+            return [(directory, known[0]) for directory, known in self.folders.items()]
+
+    def set_folder(self, directory, mtime, sub_dirs):
+        """Record the listing of a directory, for incremental refreshes.
+
+        :param str directory: directory
+        :param float mtime: modification time of the directory when listed
+        :param [str] sub_dirs: sub directories
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            self.folders[directory] = (mtime, sub_dirs)
+
+    def summary(self, folder):
+        """Get the summary of the images of a folder.
+
+        :param str folder: folder
+
+        :return: summary, None if not summarised yet
+        :rtype: {str: object}
+        """
+        with self._lock:
+            return self.summaries.get(folder)
+
+    def set_summary(self, folder, summary):
+        """Record the summary of the images of a folder.
+
+        :param str folder: folder
+        :param dict summary: summary
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            self.summaries[folder] = summary
+
+    def outdate_summary(self, folder):
+        """Mark the summary of a folder as outdated, to summarise it again on the next refresh.
+
+        :param str folder: folder
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            if folder in self.summaries:
+                self.summaries[folder] = dict(self.summaries[folder], version=None)
+
+    def retain_summaries(self, in_scope, folders):
+        """Drop the summaries of the folders of part of the library which no longer exist, and list the others.
+
+        :param method in_scope: tells if a folder belongs to the refreshed part of the library
+        :param set folders: existing folders of that part
+
+        :return: summary of each existing folder of that part
+        :rtype: {str: dict}
+        """
+        with self._lock:
+            for folder in [f for f in self.summaries if in_scope(f) and f not in folders]:
+                del self.summaries[folder]
+            return dict((f, s) for f, s in self.summaries.items() if in_scope(f))
+
+    def set_totals(self, in_scope, totals):
+        """Replace the sub tree totals of part of the library.
+
+        :param method in_scope: tells if a folder belongs to the refreshed part of the library
+        :param {str: dict} totals: new totals of that part
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            self.totals = dict([(f, t) for f, t in self.totals.items() if not in_scope(f)] + list(totals.items()))
+
+    def _compact_if_needed(self):
+        """Compact the index if too many files were removed.
+
+        :return: None
+        :rtype: NoneType
+        """
+        if self.n_removed > COMPACT_RATIO * len(self.names):
+            self.compact()
+
+    def compact(self):
+        """Rebuild the index without the removed files.
+
+        :return: None
+        :rtype: NoneType
+        """
+        with self._lock:
+            entries = [(d, n) for d, n in zip(self.dirs, self.names) if n is not None]
+            self.dirs, self.names, self.postings, self.files, self.n_removed = [], [], {}, {}, 0
+            for directory, name in entries:
+                self.add(directory, name)
+
+    def search(self, query, limit=50):
+        """Find the files whose name contains a text, case insensitive.
+
+        :param str query: text to look for
+        :param int limit: maximum number of results
+
+        :return: directory and name of matching files
+        :rtype: [(str, str)]
+        """
+        query = query.lower()
+        with self._lock:
+            if len(query) < N:
+                # Not selective enough for the index, scanning names
+                candidates = range(len(self.names))
+            else:
+                postings = [self.postings.get(gram) for gram in self.ngrams(query)]
+                if any(p is None for p in postings):
+                    return []
+                candidates = min(postings, key=len)
+            results = []
+            for file_id in candidates:
+                name = self.names[file_id]
+                if name is not None and query in name.lower():
+                    results.append((self.dirs[file_id], name))
+                    if len(results) >= limit:
+                        break
+            return results
+
+    @staticmethod
+    def file_name(key):
+        """Path of a persisted index.
+
+        :param str key: index identifier (e.g. API name and root)
+
+        :return: file path
+        :rtype: str
+        """
+        return INDEX_DIR + key + '.idx'
+
+    def save(self, key):
+        """Persist the index on disk.
+
+        :param str key: index identifier
+
+        :return: None
+        :rtype: NoneType
+        """
+        if not os.path.isdir(INDEX_DIR):
+            os.makedirs(INDEX_DIR)
+        fd, tmp_name = tempfile.mkstemp(dir=INDEX_DIR)
+        with self._lock, os.fdopen(fd, 'wb') as tmp:
+            cPickle.dump(self, tmp, cPickle.HIGHEST_PROTOCOL)
+        os.rename(tmp_name, self.file_name(key))
+
+    @classmethod
+    def load(cls, key):
+        """Load a persisted index, or create an empty one.
+
+        :param str key: index identifier
+
+        :return: index
+        :rtype: TrigramIndex
+        """
+        try:
+            with open(cls.file_name(key), 'rb') as stream:
+                return cPickle.load(stream)
+        except (IOError, EOFError, cPickle.UnpicklingError):
+            return cls()
@@ -0,0 +1,289 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import random
+import resource
+import threading
+import time
+import traceback
+
+import requests
+
+SHOW_STEPS = 10         # Images viewed in a row by the sequential navigation scenario
+SWITCH_STEPS = 6        # Back and forth moves of the folder switching scenario
+MEMORY_PERIOD = 0.5     # Seconds between two memory samples
+MAX_ERRORS = 20         # Error messages kept for reporting
+
+GALLERY = 'gallery'
+SHOW = 'show'
+SWITCH = 'switch'
+SCENARIOS = (GALLERY, SHOW, SWITCH)
+
+
+class HttpClient(object):
+    """
+    Client of a running server, with the same get method as the Django test client.
+    """
+
+    def __init__(self, base_url):
+        """Create a client, keeping its own cookies (i.e. browsing session).
+
+        :param str base_url: URL of the server, e.g. http://127.0.0.1:8000
+
+        :return: None
+        :rtype: NoneType
+        """
+        self.base_url = base_url.rstrip('/')
+        self.session = requests.Session()
+
+    def get(self, url):
+        return self.session.get(self.base_url + url)
+
+
+class Target(object):
+    """
+    Folders of a storage backend to browse, and how to build their URLs.
+    """
+
+    def __init__(self, api, folders, folder_url, image_url):
+        """Describe what a backend can be browsed with.
+
+        :param str api: backend name
+        :param [(str, int)] folders: path and number of images of the folders to browse
+        :param method folder_url: builds the URL of a folder from its path
+        :param method image_url: builds the URL of an image from its folder path and id
+
+        :return: None
+        :rtype: NoneType
+        """
+        self.api = api
+        self.folders = folders
+        self.folder_url = folder_url
+        self.image_url = image_url
+
+
+class LoadTest(object):
+    """
+    Drives the app with concurrent simulated browsing sessions, and measures how it copes.
+
+    Each session has its own client (hence its own cookies and server side session) and loops over the scenarios:
+    loading a gallery, viewing the images of a folder in a row, or switching back and forth between two folders.
+    Every request is timed; the report gives the throughput, latency percentiles per backend and request kind, errors,
+    and the memory of the serving process over the run.
+    """
+
+    def __init__(self, make_client, targets, n_sessions=8, duration=30., think_time=0., pid=None, seed=None):
+        """Prepare a load test.
+
+        :param method make_client: creates the client of a new session
+        :param [Target] targets: backends to browse, sessions being spread over them
+        :param int n_sessions: number of concurrent sessions
+        :param float duration: run time, in seconds
+        :param float think_time: pause between two requests of a session, in seconds
+        :param int pid: process serving the requests, to sample its memory (None not to)
+        :param int seed: random seed, for repeatable runs
+
+        :return: None
+        :rtype: NoneType
+        """
+        self.make_client = make_client
+        self.targets = [t for t in targets if t.folders]
+        if not self.targets:
+            raise ValueError('No folder with images to browse')
+        self.n_sessions = n_sessions
+        self.duration = duration
+        self.think_time = think_time
+        self.pid = pid
+        self.seed = seed
+        self.samples = []           # (api, kind, latency, ok) of each request
+        self.errors = []
+        self.n_errors = 0
+        self.memory = []            # (time, resident memory in bytes)
+        self._lock = threading.Lock()
+        self._done = threading.Event()
+
+    def run(self):
+        """Run the sessions until the duration is elapsed, and wait for them.
+
+        :return: report
+        :rtype: {str: object}
+        """
+        monitor = threading.Thread(target=self.sample_memory)
+        monitor.daemon = True
+        monitor.start()
+        start = time.time()
+        deadline = start + self.duration
+        sessions = [
+            threading.Thread(target=self.session, args=(i, deadline)) for i in range(self.n_sessions)
+        ]
+        for thread in sessions:
+            thread.daemon = True
+            thread.start()
+        for thread in sessions:
+            thread.join()
+        elapsed = time.time() - start
+        self._done.set()
+        monitor.join()
+        return self.report(elapsed)
+
+    def session(self, number, deadline):
+        """Simulate a browsing session until the deadline.
+
+        :param int number: session number, which decides its backend and first scenario
+        :param float deadline: time at which to stop
+
+        :return: None
+        :rtype: NoneType
+        """
+        rng = random.Random(None if self.seed is None else self.seed + number)
+        target = self.targets[number % len(self.targets)]
+        client = self.make_client()
+        step = number
+        while time.time() < deadline:
+            scenario = SCENARIOS[step % len(SCENARIOS)]
+            for kind, url in self.scenario_requests(scenario, target, rng):
+                if time.time() >= deadline:
+                    return
+                self.fetch(client, target.api, kind, url)
+                if self.think_time:
+                    time.sleep(self.think_time)
+            step += 1
+
+    def scenario_requests(self, scenario, target, rng):
+        """List the requests of a scenario.
+
+        :param str scenario: GALLERY, SHOW or SWITCH
+        :param Target target: backend to browse
+        :param random.Random rng: random generator of the session
+
+        :return: (kind, url) of the requests, in order
+        :rtype: [(str, str)]
+        """
+        path, n_images = rng.choice(target.folders)
+        if scenario == GALLERY:
+            return [(GALLERY, target.folder_url(path))]
+        if scenario == SHOW:
+            start = rng.randrange(n_images)
+            return [(GALLERY, target.folder_url(path))] + [
+                (SHOW, target.image_url(path, (start + i) % n_images)) for i in range(min(SHOW_STEPS, n_images))
+            ]
+        other, n_other = rng.choice(target.folders)
+        urls = []
+        for i in range(SWITCH_STEPS):
+            urls.append((SWITCH, target.image_url(path, i % n_images)))
+            urls.append((SWITCH, target.image_url(other, i % n_other)))
+        return urls
+
+    def fetch(self, client, api, kind, url):
+        """Send a request and record how it went.
+
+        :param object client: client of the session
+        :param str api: backend name
+        :param str kind: request kind, for the report
+        :param str url: URL to get
+
+        :return: None
+        :rtype: NoneType
+        """
+        start = time.time()
+        try:
+            response = client.get(url)
+            ok = response.status_code < 400
+            error = None if ok else '{} {}: HTTP {}'.format(kind, url, response.status_code)
+        except Exception:
+            ok = False
+            error = '{} {}: {}'.format(kind, url, traceback.format_exc().strip().splitlines()[-1])
+        latency = time.time() - start
+        with self._lock:
+            self.samples.append((api, kind, latency, ok))
+            if error is not None:
+                self.n_errors += 1
+                if len(self.errors) < MAX_ERRORS:
+                    self.errors.append(error)
+
+    def sample_memory(self):
+        """Sample the resident memory of the serving process until the test is done.
+
+        :return: None
+        :rtype: NoneType
+        """
+        if self.pid is None:
+            return
+        while True:
+            rss = resident_memory(self.pid)
+            if rss is not None:
+                self.memory.append((time.time(), rss))
+            if self._done.wait(MEMORY_PERIOD):
+                break
+        rss = resident_memory(self.pid)
+        if rss is not None:
+            self.memory.append((time.time(), rss))
+
+    def report(self, elapsed):
+        """Summarise the run.
+
+        :param float elapsed: run time, in seconds
+
+        :return: throughput, latency percentiles by backend and request kind, errors and memory usage
+        :rtype: {str: object}
+        """
+        with self._lock:
+            samples = list(self.samples)
+        groups = {}
+        for api, kind, latency, ok in samples:
+            groups.setdefault('{}/{}'.format(api, kind), []).append(latency)
+            groups.setdefault('all', []).append(latency)
+        report = {
+            'sessions': self.n_sessions,
+            'duration': elapsed,
+            'requests': len(samples),
+            'throughput': len(samples) / elapsed if elapsed else 0.,
+            'errors': self.n_errors,
+            'error_samples': list(self.errors),
+            'latency': {
+                name: {
+                    'count': len(latencies),
+                    'p50': percentile(latencies, 50),
+                    'p99': percentile(latencies, 99),
+                    'max': max(latencies),
+                }
+                for name, latencies in groups.items()
+            },
+            'memory': None,
+        }
+        if self.memory:
+            rss = [m for _, m in self.memory]
+            report['memory'] = {'start': rss[0], 'end': rss[-1], 'peak': max(rss), 'growth': rss[-1] - rss[0]}
+        return report
+
+
+def percentile(values, p):
+    """Percentile of a list of values, by the nearest rank.
+
+    :param [float] values: values
+    :param float p: percentile, from 0 to 100
+
+    :return: percentile
+    :rtype: float
+    """
+    values = sorted(values)
+    return values[int(round(p / 100. * (len(values) - 1)))]
+
+
+def resident_memory(pid):
+    """Resident memory of a process (Linux only, or the peak memory of the current process elsewhere).
+
+    :param int pid: process id
+
+    :return: resident memory in bytes, None if unknown
+    :rtype: int
+    """
+    try:
+        with open('/proc/{}/statm'.format(pid)) as statm:
+            return int(statm.read().split()[1]) * resource.getpagesize()
+    except (IOError, IndexError, ValueError):
+        if pid == os.getpid():
+            # ru_maxrss is in kilobytes on Linux
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        return None
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import sys
+
+from django.core.management.base import BaseCommand
+
+from browser.lib.api.registry import get_backend
+from browser.lib.image.export import EXPORT_FORMATS
+from browser.lib.image.export import ExportJob
+from browser.lib.image.export import N_DECODERS
+from browser.lib.image.export import N_ENCODERS
+from browser.lib.image.image_formats import is_raw
+
+
+class Command(BaseCommand):
+    help = 'Export the images of a local folder (e.g. CR2 files) to JPEG / PNG files, resuming interrupted exports.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='folder containing the images to export')
+        parser.add_argument('output', help='directory to write the exported images to')
+        parser.add_argument('--names', nargs='+', help='export only these images of the folder')
+        parser.add_argument('--raw-only', action='store_true', help='export only raw images')
+        parser.add_argument('--format', default='jpeg', choices=sorted(EXPORT_FORMATS))
+        parser.add_argument('--size', type=int, default=None, help='maximum width / height, full size by default')
+        parser.add_argument('--quality', type=int, default=90)
+        parser.add_argument('--decoders', type=int, default=N_DECODERS, help='decoding threads')
+        parser.add_argument('--encoders', type=int, default=N_ENCODERS, help='encoding threads')
+
+    def handle(self, *args, **options):
+        path = os.path.abspath(options['path'])
+        local_api = get_backend('local')
+        names = [n for n in local_api.list_content(path) if local_api.should_display_image(n)]
+        if options['names']:
+            names = [n for n in names if n in options['names']]
+        if options['raw_only']:
+            names = [n for n in names if is_raw(n)]
+
+        job = ExportJob(
+            path,
+            names,
+            local_api.create_image,
+            options['output'],
+            format=options['format'],
+            max_size=options['size'],
+            quality=options['quality'],
+            n_decoders=options['decoders'],
+            n_encoders=options['encoders'],
+        )
+        status = job.run(progress=self.report)
+        self.stdout.write('')
+        self.stdout.write(
+            '{done} exported, {skipped} already done, {failed} failed in {elapsed:.1f}s '
+            '({megabytes_written:.1f} MB)'.format(**status)
+        )
+        if status['images_per_second']:
+            self.stdout.write('Throughput: {:.2f} images/s'.format(status['images_per_second']))
+        self.stdout.write('Time per stage: ' + ', '.join(
+            '{} {:.1f}s'.format(stage, seconds) for stage, seconds in sorted(status['stage_seconds'].items())
+        ))
+        for error in status['errors']:
+            self.stderr.write(error)
+
+    def report(self, status):
+        sys.stdout.write('\r{} / {} ({} skipped, {} failed)'.format(
+            status['done'] + status['skipped'] + status['failed'], status['total'], status['skipped'], status['failed'],
+        ))
+        sys.stdout.flush()
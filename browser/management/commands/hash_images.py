@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import os
+import sys
+import time
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from browser.lib.api.registry import BackendUnavailable
+from browser.lib.api.registry import backend_names
+from browser.lib.api.registry import get_backend
+from browser.lib.index.phash_index import DUPLICATE_DISTANCE
+from browser.lib.index.phash_index import N_BANDS
+from browser.models import Setting
+
+
+class Command(BaseCommand):
+    help = 'Compute the perceptual hashes of a library (from the image thumbnails), and list near duplicate images.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--api', default='local', choices=backend_names())
+        parser.add_argument('--root', help='root of the library, home directory by default for local files')
+        parser.add_argument('--skip-hashing', action='store_true', help='only search the hashes already computed')
+        parser.add_argument('--duplicates', action='store_true', help='list groups of near duplicate images')
+        parser.add_argument(
+            '--distance', type=int, default=DUPLICATE_DISTANCE, choices=range(N_BANDS),
+            help='maximum number of differing bits (out of 64) between near duplicates',
+        )
+
+    def handle(self, *args, **options):
+        try:
+            api = get_backend(options['api'])
+        except BackendUnavailable as e:
+            raise CommandError(e)
+        if options['api'] == 'local':
+            root = os.path.abspath(options['root'] or Setting.get('home_path'))
+        else:
+            root = options['root'] or ''
+
+        if not options['skip_hashing']:
+            status = api.hash_library(root, background=False, progress=self.report).status()
+            self.stdout.write('')
+            self.stdout.write(
+                '{hashed} hashed, {unchanged} unchanged, {removed} removed, {failed} failed in {elapsed:.1f}s '
+                '({indexed} images indexed)'.format(**status)
+            )
+            for error in status['errors']:
+                self.stderr.write(error)
+            if status['state'] == 'failed':
+                raise CommandError('Hashing failed')
+
+        if options['duplicates']:
+            index = api.perceptual_index(root)
+            start = time.time()
+            groups = index.duplicates(options['distance'])
+            for group in groups:
+                self.stdout.write('')
+                for directory, name in group:
+                    self.stdout.write(os.path.join(directory, name))
+            self.stdout.write('')
+            self.stdout.write('{} groups of near duplicates among {} images, found in {:.2f}s'.format(
+                len(groups), len(index), time.time() - start
+            ))
+
+    def report(self, status):
+        sys.stdout.write('\r{} / {} ({} unchanged, {} failed)'.format(
+            status['hashed'] + status['unchanged'] + status['failed'], status['total'], status['unchanged'],
+            status['failed'],
+        ))
+        sys.stdout.flush()
@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import os
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.core.urlresolvers import NoReverseMatch
+from django.core.urlresolvers import reverse
+from django.test import Client
+
+from browser.lib.api import registry
+from browser.lib.api.stand_in_store import StandInStore
+from browser.lib.load_test import HttpClient
+from browser.lib.load_test import LoadTest
+from browser.lib.load_test import Target
+from browser.models import Setting
+
+
+class Command(BaseCommand):
+    help = (
+        'Load test the app with concurrent browsing sessions (gallery loads, sequential image views, folder '
+        'switching), on local files and on a stand-in Hubic server, and report throughput, latency, memory and errors.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=8, help='concurrent browsing sessions')
+        parser.add_argument('--duration', type=float, default=30., help='run time, in seconds')
+        parser.add_argument('--think-time', type=float, default=0., help='pause between two requests of a session')
+        parser.add_argument('--folders', type=int, default=10, help='maximum number of folders browsed per backend')
+        parser.add_argument('--local-root', help='local folders to browse, home directory by default')
+        parser.add_argument('--no-local', action='store_true', help='do not browse local files')
+        parser.add_argument('--hubic-root', help='directory served by a stand-in Hubic server, to browse it as well')
+        parser.add_argument('--latency', type=float, default=0.02, help='latency of the stand-in Hubic, in seconds')
+        parser.add_argument('--url', help='test a running server (e.g. http://127.0.0.1:8000) instead of in process')
+        parser.add_argument('--pid', type=int, help='process of the running server, to report its memory')
+        parser.add_argument('--seed', type=int, help='random seed, for repeatable runs')
+        parser.add_argument('--json', help='also write the report to this file')
+
+    def handle(self, *args, **options):
+        if options['url'] and options['hubic_root']:
+            raise CommandError('The stand-in Hubic can only be used in process, without --url')
+        targets = []
+        if not options['no_local']:
+            root = os.path.abspath(options['local_root'] or Setting.get('home_path'))
+            targets.append(self.target('local', root, root, options['folders']))
+        if options['hubic_root']:
+            server = StandInStore(options['hubic_root'], port=0, latency=options['latency'], directory_markers=True)
+            server.start()
+            registry.override('hubic', {
+                'class': 'browser.lib.api.hubic_api.HubicAPI',
+                'api_url': server.api_url,
+                'client_id': 'stand-in',
+                'secret': 'stand-in',
+                'refresh_token': 'stand-in',
+            })
+            self.stdout.write('Stand-in Hubic serving {} on {}'.format(server.root, server.api_url))
+            targets.append(self.target('hubic', server.root, '', options['folders']))
+
+        if options['url']:
+            make_client, pid = lambda: HttpClient(options['url']), options['pid']
+        else:
+            make_client, pid = lambda: Client(HTTP_HOST='localhost'), os.getpid()
+        try:
+            test = LoadTest(
+                make_client,
+                targets,
+                n_sessions=options['sessions'],
+                duration=options['duration'],
+                think_time=options['think_time'],
+                pid=pid,
+                seed=options['seed'],
+            )
+        except ValueError as e:
+            raise CommandError(e)
+        self.stdout.write('Running {} sessions for {:.0f}s on {}...'.format(
+            options['sessions'], options['duration'], ', '.join(t.api for t in test.targets),
+        ))
+        report = test.run()
+        self.print_report(report)
+        if options['json']:
+            with open(options['json'], 'w') as output:
+                json.dump(report, output, indent=2)
+
+    def target(self, api, directory, root, max_folders):
+        """Find folders with images to browse, and how to reach them.
+
+        :param str api: backend name
+        :param str directory: local directory holding the files of the backend
+        :param str root: path of that directory in the backend ('' for the root of a container)
+        :param int max_folders: maximum number of folders
+
+        :return: target
+        :rtype: browser.lib.load_test.Target
+        """
+        local_api = registry.get_backend('local')
+        folders = []
+        for path, dirs, files in os.walk(directory):
+            dirs[:] = sorted(d for d in dirs if local_api.should_display_folder(path, d))
+            n_images = len([f for f in files if local_api.should_display_image(f)])
+            folder = os.path.join(root, os.path.relpath(path, directory)) if root else os.path.relpath(path, directory)
+            folder = os.path.normpath(folder)
+            if not n_images or folder == '.':
+                continue
+            try:
+                # Folders whose name can't be routed are not browsable anyway
+                reverse('browse', kwargs={'api': api, 'path': folder})
+            except NoReverseMatch:
+                continue
+            folders.append((folder, n_images))
+            if len(folders) >= max_folders:
+                break
+        return Target(
+            api,
+            folders,
+            lambda path: reverse('browse', kwargs={'api': api, 'path': path}),
+            lambda path, image_id: reverse('show', kwargs={'api': api, 'path': path, 'image_id': image_id}),
+        )
+
+    def print_report(self, report):
+        self.stdout.write('')
+        self.stdout.write('{requests} requests in {duration:.1f}s: {throughput:.1f} requests/s, {errors} errors'.format(
+            **report
+        ))
+        self.stdout.write('{:<20} {:>8} {:>10} {:>10} {:>10}'.format('', 'count', 'p50 (ms)', 'p99 (ms)', 'max (ms)'))
+        for name, latency in sorted(report['latency'].items(), key=lambda item: (item[0] == 'all', item[0])):
+            self.stdout.write('{:<20} {:>8} {:>10.1f} {:>10.1f} {:>10.1f}'.format(
+                name, latency['count'], 1000 * latency['p50'], 1000 * latency['p99'], 1000 * latency['max'],
+            ))
+        memory = report['memory']
+        if memory is not None:
+            self.stdout.write('Memory: {:.1f} MB at start, {:.1f} MB at end ({:+.1f} MB), {:.1f} MB peak'.format(
+                *[value / 1024. ** 2 for value in (memory['start'], memory['end'], memory['growth'], memory['peak'])]
+            ))
+        for error in report['error_samples']:
+            self.stderr.write(error)
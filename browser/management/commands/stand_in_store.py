@@ -0,0 +1,49 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+import json
+import os
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from browser.lib.api.stand_in_store import StandInStore
+
+
+class Command(BaseCommand):
+    help = 'Serve a local directory as a Swift and S3 compatible container, to try out object store backends.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('root', help='directory served as the container')
+        parser.add_argument('--port', type=int, default=8900)
+        parser.add_argument('--prefix', default='/v1/AUTH_test', help='path of the account (swift) or service (s3)')
+        parser.add_argument('--container', default='photos', help='container (swift) or bucket (s3) name')
+        parser.add_argument('--token', help='token required in the X-Auth-Token header')
+        parser.add_argument('--latency', type=float, default=0., help='delay added to each request, in seconds')
+
+    def handle(self, *args, **options):
+        if not os.path.isdir(options['root']):
+            raise CommandError('Not a directory: {}'.format(options['root']))
+        server = StandInStore(
+            options['root'],
+            port=options['port'],
+            prefix=options['prefix'],
+            container=options['container'],
+            token=options['token'],
+            latency=options['latency'],
+        )
+        backend = {
+            'class': 'browser.lib.api.object_store_api.ObjectStoreAPI',
+            'protocol': 'swift',
+            'endpoint': server.endpoint,
+            'container': server.container,
+        }
+        if options['token']:
+            backend['token'] = options['token']
+        self.stdout.write('Serving {} on {}/{}'.format(server.root, server.endpoint, server.container))
+        self.stdout.write('Backend to add to BROWSER_BACKENDS (protocol may also be s3):')
+        self.stdout.write(json.dumps({options['container']: backend}, indent=4))
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            server.server_close()
@@ -1,11 +1,44 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import threading
+
 from django.core.exceptions import ObjectDoesNotExist
 from django.db import models
 
 from os.path import expanduser
 
+from browser.lib.image.rendition_cache import MIME_TYPES
+
+
+def rendition_format(value):
+    if value not in MIME_TYPES:
+        raise ValueError('Unsupported rendition format: {}'.format(value))
+    return value
+
+
+def rendition_quality(value):
+    quality = int(value)
+    if not 1 <= quality <= 100:
+        raise ValueError('Rendition quality must be between 1 and 100: {}'.format(value))
+    return quality
+
+
+def positive_float(value):
+    number = float(value)
+    if not 0 < number < float('inf'):
+        raise ValueError('Expected a positive number: {}'.format(value))
+    return number
+
+
+# Conversion and validation of the settings which are not free strings
+PARSERS = {
+    'rendition_format': rendition_format,
+    'rendition_quality': rendition_quality,
+    'rendition_progressive': lambda value: value == '1',
+    'slideshow_interval': positive_float,
+}
+
 
 # Browser settings
 class Setting(models.Model):
@@ -13,11 +46,20 @@ class Setting(models.Model):
     name = models.CharField(max_length=50)
     value = models.CharField(max_length=500)
 
+    # In-process cache of all setting values, loaded in one query and dropped whenever a setting is saved or deleted
+    # (see BrowserConfig.ready). Bulk updates bypass the signals, and other processes only see changes on restart.
+    _values = None
+    _values_lock = threading.Lock()
+
     # Class methods
     @classmethod
     def defaults(cls):
         return {
             'home_path': expanduser("~"),
+            'rendition_format': 'jpeg',
+            'rendition_quality': '85',
+            'rendition_progressive': '1',
+            'slideshow_interval': '5',
         }
 
     @classmethod
@@ -29,6 +71,62 @@ class Setting(models.Model):
 
     @classmethod
     def all(cls):
-        stored = cls.objects.all()
-        default = cls.defaults()
-        return { key: stored.filter(name=key).first() or val for key, val in default.iteritems() }
+        return {key: Setting(name=key, value=val) for key, val in cls.values().iteritems()}
+
+    @classmethod
+    def values(cls):
+        """Raw value of every setting, stored or default, without querying the database once cached.
+
+        :return: value of each setting
+        :rtype: {str: str}
+        """
+        values = cls._values
+        if values is None:
+            with cls._values_lock:
+                if cls._values is None:
+                    values = cls.defaults()
+                    values.update(cls.objects.filter(name__in=list(values)).order_by('id').values_list('name', 'value'))
+                    cls._values = values
+                values = cls._values
+        return dict(values)
+
+    @classmethod
+    def validate(cls, name, value):
+        """Check a new value of a setting, before saving it.
+
+        :param str name: setting name
+        :param str value: raw value
+
+        :return: value converted to its type
+        :rtype: object
+        :raise: ValueError if the value is invalid
+        """
+        parse = PARSERS.get(name)
+        return value if parse is None else parse(value)
+
+    @classmethod
+    def get(cls, name):
+        """Value of a setting, converted to its type (int, float, bool or str).
+
+        :param str name: setting name
+
+        :return: value, or the default one if the stored value is invalid
+        :rtype: object
+        """
+        parse = PARSERS.get(name)
+        if parse is None:
+            return cls.values()[name]
+        try:
+            return parse(cls.values()[name])
+        except ValueError:
+            return parse(cls.defaults()[name])
+
+    @classmethod
+    def invalidate(cls, **kwargs):
+        """Drop the cached values, connected to the save and delete signals of the model.
+
+        :return: None
+        :rtype: NoneType
+        """
+        with cls._values_lock:
+            cls._values = None
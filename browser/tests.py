@@ -1,6 +1,714 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+import os
+import shutil
+import tempfile
+import threading
+import time
+
+from django.core.urlresolvers import reverse
+from django.http import Http404
+from django.test import RequestFactory
+from django.test import SimpleTestCase
 from django.test import TestCase
 
-# Create your tests here.
+from browser import views
+
+from browser.lib.api import registry
+from browser.lib.api.stand_in_store import StandInStore
+from browser.lib.api.timeline import Timeline
+from browser.lib.api import watcher
+from browser.lib.image.base_image import BaseImage
+from browser.lib.image.export import ExportJob
+from browser.lib.image.image_listing import ImageListing
+from browser.lib.image.image_listing import MAX_MATERIALISED
+from browser.lib.image import rendition_cache
+from browser.lib.image.rendition_cache import RenditionCache
+from browser.lib.image import scheduler
+from browser.lib.image.scheduler import DecodeScheduler
+from browser.lib.index.trigram_index import TrigramIndex
+from browser.models import Setting
+
+
+class Meta:
+    name = 'test'
+    remote = True
+
+
+class ImageListingTest(SimpleTestCase):
+
+    def setUp(self):
+        self.created = []
+        self.cache = list(BaseImage._cache)
+        del BaseImage._cache[:]
+
+    def tearDown(self):
+        BaseImage._cache[:] = self.cache
+
+    def create_image(self, image_id, path, name, process=False, stat=None):
+        image = BaseImage(image_id, path, name, None, Meta, process=process, stat=stat)
+        self.created.append(image)
+        return image
+
+    def listing(self, n_images, sizes=True):
+        names = ['img_{:05d}.jpg'.format(i) for i in range(n_images)]
+        if not sizes:
+            return ImageListing('folder', names, self.create_image, Meta)
+        return ImageListing('folder', names, self.create_image, Meta, mtimes=['2017'] * n_images, sizes=[1] * n_images)
+
+    def test_records_do_not_materialise(self):
+        listing = self.listing(1000)
+        records = list(listing.records(10, 20))
+        self.assertEqual([r.id for r in records], list(range(10, 20)))
+        self.assertEqual(records[0].name, 'img_00010.jpg')
+        self.assertEqual(len(list(listing)), 1000)
+        self.assertEqual(self.created, [])
+
+    def test_images_are_materialised_once(self):
+        listing = self.listing(10)
+        image = listing[3]
+        self.assertIs(listing[3], image)
+        self.assertIs(listing[-7], image)
+        self.assertEqual(len(self.created), 1)
+        self.assertEqual((image.id, image.name, image.stat), (3, 'img_00003.jpg', ('2017', 1)))
+
+    def test_out_of_range(self):
+        listing = self.listing(10)
+        self.assertRaises(IndexError, lambda: listing[10])
+        self.assertRaises(IndexError, lambda: listing[-11])
+
+    def test_index(self):
+        listing = self.listing(10, sizes=False)
+        self.assertEqual(listing.index('img_00004.jpg'), 4)
+        self.assertRaises(ValueError, listing.index, 'missing.jpg')
+
+    def test_eviction_keeps_processed_images(self):
+        listing = self.listing(3 * MAX_MATERIALISED)
+        processed = listing[0]
+        BaseImage._cache.append(processed)
+        for image_id in range(1, 2 * MAX_MATERIALISED):
+            listing[image_id]
+        self.assertEqual(len(listing._materialised), MAX_MATERIALISED)
+        self.assertIn(0, listing._materialised)
+        self.assertNotIn(1, listing._materialised)
+        self.assertIs(listing[0], processed)
+
+    def test_processed_images_are_reused_by_new_listings(self):
+        processed = self.listing(10)[5]
+        BaseImage._cache.append(processed)
+        # Listing the folder again, a file being inserted before the processed one
+        listing = ImageListing(
+            'folder', ['img_00000.jpg', 'new.jpg'] + ['img_{:05d}.jpg'.format(i) for i in range(1, 10)],
+            self.create_image, Meta, mtimes=['2017'] * 11, sizes=[1] * 11,
+        )
+        self.assertIs(listing[6], processed)
+        self.assertEqual(processed.id, 6)
+        self.assertTrue(listing[6].is_processed())
+
+    def test_changed_files_are_not_reused(self):
+        processed = self.listing(10)[5]
+        BaseImage._cache.append(processed)
+        listing = ImageListing('folder', ['img_00005.jpg'], self.create_image, Meta, mtimes=['2018'], sizes=[2])
+        self.assertIsNot(listing[0], processed)
+        self.assertFalse(listing[0].is_processed())
+
+    def test_processed_twin_is_adopted(self):
+        processed = self.listing(10)[5]
+        processed.encoded, processed.mime = 'data', 'image/jpeg'
+        BaseImage._cache.append(processed)
+        twin = self.create_image(5, 'folder', 'img_00005.jpg')
+        twin.decode_encode()
+        self.assertEqual((twin.encoded, twin.mime), ('data', 'image/jpeg'))
+        self.assertEqual(BaseImage._cache, [twin])
+
+
+class TrigramIndexTest(SimpleTestCase):
+
+    def setUp(self):
+        self.index = TrigramIndex()
+        for directory, name in [('a', 'IMG_0001.jpg'), ('a', 'IMG_0002.cr2'), ('a/b', 'beach.jpg'), ('c', 'img_9.png')]:
+            self.index.add(directory, name)
+
+    def test_search(self):
+        self.assertEqual(self.index.search('img_000'), [('a', 'IMG_0001.jpg'), ('a', 'IMG_0002.cr2')])
+        all_images = [('a', 'IMG_0001.jpg'), ('a', 'IMG_0002.cr2'), ('c', 'img_9.png')]
+        self.assertEqual(sorted(self.index.search('img')), all_images)
+        # Queries shorter than a trigram scan the names
+        self.assertEqual(self.index.search('g_'), all_images)
+        self.assertEqual(self.index.search('img', limit=1), [('a', 'IMG_0001.jpg')])
+        self.assertEqual(self.index.search('nothing'), [])
+
+    def test_add_is_idempotent(self):
+        self.index.add('a', 'IMG_0001.jpg')
+        self.assertEqual(len(self.index), 4)
+
+    def test_remove(self):
+        self.index.remove('a', 'IMG_0001.jpg')
+        self.index.remove('a', 'missing.jpg')
+        self.assertEqual(len(self.index), 3)
+        self.assertEqual(self.index.search('img_000'), [('a', 'IMG_0002.cr2')])
+        self.index.add('a', 'IMG_0001.jpg')
+        self.assertEqual(sorted(self.index.search('img_000')), [('a', 'IMG_0001.jpg'), ('a', 'IMG_0002.cr2')])
+
+    def test_remove_directory(self):
+        self.index.remove_directory('a')
+        self.assertEqual(self.index.search('jpg'), [])
+        self.assertEqual(self.index.search('img'), [('c', 'img_9.png')])
+        self.assertEqual(self.index.files_in('a/b'), set())
+
+    def test_folders_and_summaries(self):
+        self.index.set_folder('a', 1., ['a/b'])
+        self.index.set_folder('a/b', 2., [])
+        for folder in ('a', 'a/b', 'c'):
+            self.index.set_summary(folder, {'count': 1})
+        self.assertEqual(self.index.folder('a'), (1., ['a/b']))
+        in_a = lambda folder: folder == 'a' or folder.startswith('a/')
+        self.assertEqual(self.index.retain_summaries(in_a, {'a'}), {'a': {'count': 1}})
+        self.assertIsNone(self.index.summary('a/b'))
+        self.assertEqual(self.index.summary('c'), {'count': 1})
+        self.index.set_totals(in_a, {'a': {'count': 1}})
+        self.index.remove_directory('a')
+        self.assertIsNone(self.index.folder('a/b'))
+        self.assertIsNone(self.index.summary('a'))
+        self.assertEqual(self.index.all_files(), {('c', 'img_9.png')})
+
+
+class HubicSearchTest(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        for folder, name in [('', 'top.jpg'), ('trip', 'beach.jpg'), ('a.b', 'dot.jpg'), ("it's", 'quote.jpg')]:
+            if folder and not os.path.isdir(os.path.join(self.root, folder)):
+                os.makedirs(os.path.join(self.root, folder))
+            open(os.path.join(self.root, folder, name), 'wb').close()
+        self.server = StandInStore(self.root, port=0, directory_markers=True)
+        self.server.start()
+        registry.override('hubic', {
+            'class': 'browser.lib.api.hubic_api.HubicAPI',
+            'api_url': self.server.api_url,
+            'client_id': 'test',
+            'secret': 'test',
+            'refresh_token': 'test',
+        })
+        self.api = registry.get_backend('hubic')
+        # Indexing in place of the background refresh, which would also download covers
+        index = TrigramIndex()
+        self.api.refresh_file_index(index, self.api.root)
+        self.api.file_index, self.api.file_index_key = index, self.api.library_key(self.api.root)
+        self.api.file_index_root, self.api.file_index_refreshed = self.api.root, time.time()
+
+    def tearDown(self):
+        registry._overrides.pop('hubic', None)
+        registry._loaded.pop('hubic', None)
+        self.server.shutdown()
+        self.server.server_close()
+        shutil.rmtree(self.root)
+
+    def test_unroutable_results_are_skipped(self):
+        self.assertEqual(len(self.api.search_files(self.api.root, '.jpg')), 4)
+        response = self.client.get(reverse('search', kwargs={'api': 'hubic'}), {'term': '.jpg'})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([result['label'] for result in response.json()], ['trip/beach.jpg'])
+
+    def test_stale_result_is_not_found(self):
+        request = RequestFactory().get('/')
+        self.assertRaises(Http404, views.show_name, request, api='hubic', path='trip', name='gone.jpg')
+
+    def test_timeline_from_listing(self):
+        folders = dict(self.api.timeline_folders(self.api.root))
+        self.assertEqual(sorted(name for _, name in self.api.dated_images('trip', folders['trip'])), ['beach.jpg'])
+        self.assertEqual([(size, name) for _, size, name in self.api.image_stats('', folders[''])], [(0, 'top.jpg')])
+
+
+class TimelineTest(SimpleTestCase):
+
+    def setUp(self):
+        self.images = {
+            'a': [(5., 'a5.jpg'), (1., 'a1.jpg'), (3., 'a3.jpg')],
+            'b': [(4., 'b4.jpg'), (3., 'b3.jpg')],
+            'c': [],
+        }
+        self.walks = 0
+        self.timeline = Timeline(self.list_folders, lambda folder, version: self.images[folder])
+
+    def list_folders(self):
+        self.walks += 1
+        return [(folder, len(images)) for folder, images in sorted(self.images.items())]
+
+    def read_all(self, limit):
+        entries, cursor = self.timeline.page(limit=limit)
+        pages = [entries]
+        while cursor is not None:
+            entries, cursor = self.timeline.page(cursor, limit=limit)
+            pages.append(entries)
+        return pages
+
+    def test_pages_are_merged_newest_first(self):
+        pages = self.read_all(2)
+        self.assertEqual([[name for _, _, name in page] for page in pages], [
+            ['a5.jpg', 'b4.jpg'], ['a3.jpg', 'b3.jpg'], ['a1.jpg'],
+        ])
+        self.assertEqual(pages[1][0], (3., 'a', 'a3.jpg'))
+
+    def test_last_full_page_has_no_cursor(self):
+        entries, cursor = self.timeline.page(limit=5)
+        self.assertEqual(len(entries), 5)
+        self.assertIsNone(cursor)
+
+    def test_folders_are_listed_once_for_all_pages(self):
+        self.read_all(1)
+        self.assertEqual(self.walks, 1)
+
+    def test_invalidate(self):
+        entries, cursor = self.timeline.page(limit=2)
+        self.images['c'] = [(2., 'c2.jpg')]
+        self.timeline.invalidate()
+        entries, _ = self.timeline.page(cursor, limit=10)
+        self.assertEqual([name for _, _, name in entries], ['a3.jpg', 'b3.jpg', 'c2.jpg', 'a1.jpg'])
+        self.assertEqual(self.walks, 2)
+
+
+class TimelineViewTest(SimpleTestCase):
+
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_malformed_cursor(self):
+        for cursor in ['nope', '5', '[1, "a"]', '["x", "a", "b.jpg"]']:
+            request = RequestFactory().get('/', {'cursor': cursor})
+            self.assertEqual(views.timeline(request, api='local', path=self.root).status_code, 400)
+
+
+class ExportJobTest(SimpleTestCase):
+
+    class Image(object):
+
+        def __init__(self, image_id, path, name):
+            self.name = name
+
+        def decode(self):
+            from PIL import Image
+            return Image.new('RGB', (40, 20))
+
+    def setUp(self):
+        self.output = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.output)
+
+    def export(self, names, **kwargs):
+        return ExportJob('folder', names, self.Image, self.output, **kwargs).run()
+
+    def test_same_base_names_do_not_collide(self):
+        status = self.export(['IMG.cr2', 'IMG.jpg', 'other.cr2'])
+        self.assertEqual(status['done'], 3)
+        self.assertEqual(
+            sorted(os.listdir(self.output)), ['.export_manifest', 'IMG_cr2.jpg', 'IMG_jpg.jpg', 'other.jpg'],
+        )
+
+    def test_resume_with_same_settings_only(self):
+        self.export(['a.cr2'], max_size=10)
+        self.assertEqual(self.export(['a.cr2', 'b.cr2'], max_size=10)['skipped'], 1)
+        self.assertEqual(self.export(['a.cr2', 'b.cr2'], max_size=20)['skipped'], 0)
+        self.assertEqual(self.export(['a.cr2'], format='png', max_size=20)['skipped'], 0)
+
+
+class ExportViewTest(TestCase):
+
+    def setUp(self):
+        self.home = tempfile.mkdtemp()
+        Setting.objects.create(name='home_path', value=self.home)
+
+    def tearDown(self):
+        # The rollback of the test bypasses the signals dropping the cached settings
+        Setting.invalidate()
+        shutil.rmtree(self.home)
+
+    def post(self, data):
+        return views.local_export(RequestFactory().post('/', data), path=self.home)
+
+    def test_bad_parameters(self):
+        self.assertEqual(self.post({'size': 'big'}).status_code, 400)
+        self.assertEqual(self.post({'size': '0'}).status_code, 400)
+        self.assertEqual(self.post({'format': 'gif'}).status_code, 400)
+
+    def test_output_outside_of_the_library(self):
+        self.assertEqual(self.post({'output': os.path.join(self.home, '..', 'elsewhere')}).status_code, 400)
+        self.assertEqual(self.post({'output': os.path.join(self.home, 'export'), 'size': '100'}).status_code, 302)
+
+
+class CastTest(TestCase):
+
+    def setUp(self):
+        from PIL import Image
+        self.folder = tempfile.mkdtemp()
+        Image.new('RGB', (40, 20)).save(os.path.join(self.folder, 'a.jpg'))
+        self.cache_dir, self.cache_size = rendition_cache.CACHE_DIR, RenditionCache._size
+        rendition_cache.CACHE_DIR, RenditionCache._size = os.path.join(self.folder, '.renditions/'), None
+
+    def tearDown(self):
+        rendition_cache.CACHE_DIR, RenditionCache._size = self.cache_dir, self.cache_size
+        registry.get_backend('local').forget_listings()
+        shutil.rmtree(self.folder)
+
+    def test_cast_image_is_revalidated(self):
+        response = views.cast_image(RequestFactory().get('/'), api='local', path=self.folder, image_id='0')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Cache-Control'], 'no-cache')
+        request = RequestFactory().get('/', HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(views.cast_image(request, api='local', path=self.folder, image_id='0').status_code, 304)
+        # Another file at the same position
+        os.utime(os.path.join(self.folder, 'a.jpg'), (0, 0))
+        registry.get_backend('local').forget_listings()
+        self.assertEqual(views.cast_image(request, api='local', path=self.folder, image_id='0').status_code, 200)
+
+    def test_slide_interval(self):
+        self.assertEqual(views.slide_interval(RequestFactory().get('/', {'interval': '2.5'})), 2.5)
+        for interval in ('', 'fast', '-1', 'nan'):
+            self.assertEqual(views.slide_interval(RequestFactory().get('/', {'interval': interval})), 5.)
+        self.assertEqual(views.slide_interval(RequestFactory().get('/')), 5.)
+
+
+class PerceptualHashTest(SimpleTestCase):
+
+    def test_dhash(self):
+        from PIL import Image
+        from browser.lib.index.phash_index import dhash
+        gradient = Image.new('L', (90, 80))
+        gradient.putdata([x for y in range(80) for x in range(90)])
+        self.assertEqual(dhash(gradient), 2 ** 64 - 1)
+        self.assertEqual(dhash(gradient.transpose(Image.FLIP_LEFT_RIGHT)), 0)
+        # Robust to resizing
+        self.assertEqual(dhash(gradient.resize((900, 800))), dhash(gradient))
+
+    def test_close_pairs_match_brute_force(self):
+        import numpy as np
+        from browser.lib.index.phash_index import PerceptualHashIndex
+        from browser.lib.index.phash_index import hamming
+        random = np.random.RandomState(0)
+        hashes = random.randint(0, 2 ** 62, size=300).astype(np.uint64)
+        # Planting near duplicates, a few bits away from random hashes
+        for i in range(100):
+            bits = random.choice(64, size=random.randint(0, 4), replace=False)
+            hashes[200 + i] = hashes[random.randint(200)] ^ np.uint64(sum(2 ** int(b) for b in bits))
+        for max_distance in range(4):
+            expected = [
+                (i, j) for i in range(len(hashes)) for j in range(i + 1, len(hashes))
+                if hamming(hashes[i:i + 1], hashes[j:j + 1])[0] <= max_distance
+            ]
+            self.assertEqual(PerceptualHashIndex.close_pairs(hashes, max_distance), expected)
+
+    def test_duplicates(self):
+        from browser.lib.index.phash_index import PerceptualHashIndex
+        index = PerceptualHashIndex()
+        for name, value in [('a', 0b1111), ('b', 0b0111), ('c', 0b0011), ('d', 0xffff << 40), ('e', 0xffff << 16)]:
+            index.add(('folder', name), None, value)
+        self.assertEqual(index.duplicates(1), [[('folder', 'a'), ('folder', 'b'), ('folder', 'c')]])
+        self.assertEqual(index.duplicates(0), [])
+        self.assertRaises(ValueError, index.duplicates, 4)
+        index.remove(('folder', 'b'))
+        self.assertEqual(index.duplicates(2), [[('folder', 'a'), ('folder', 'c')]])
+        self.assertEqual(index.similar(0b1011, 1), [(('folder', 'a'), 1), (('folder', 'c'), 1)])
+
+
+class HashingJobTest(SimpleTestCase):
+
+    def setUp(self):
+        self.listed = threading.Event()
+        self.release = threading.Event()
+        test = self
+
+        class UnlistedAPI(registry.get_backend('local')):
+            hashing_job = None
+
+            @classmethod
+            def library_index(cls, root, wait=False):
+                test.listed.set()
+                test.release.wait(5)
+                raise IOError('Library unavailable')
+
+        self.api = UnlistedAPI
+
+    def test_library_is_listed_by_the_job(self):
+        self.release.set()
+        job = self.api.hash_library('/pics', background=False)
+        self.assertEqual(job.state, 'failed')
+        self.assertEqual(job.status()['errors'], ['Hashing stopped: Library unavailable'])
+        self.assertIsNotNone(job.end_time)
+        # A failed job doesn't prevent hashing again
+        self.assertIsNot(self.api.hash_library('/pics', background=False), job)
+
+    def test_request_does_not_wait_for_the_index(self):
+        job = self.api.hash_library('/pics')
+        self.assertTrue(self.listed.wait(5))
+        self.assertEqual(job.state, 'running')
+        self.release.set()
+        for _ in range(100):
+            if job.state == 'failed':
+                break
+            time.sleep(0.01)
+        self.assertEqual(job.state, 'failed')
+
+
+class DuplicatesViewTest(TestCase):
+
+    def test_bad_distance(self):
+        for distance in ('far', '-1', '4', '65'):
+            request = RequestFactory().get('/', {'distance': distance})
+            self.assertEqual(views.duplicates(request, api='local').status_code, 400)
+        request = RequestFactory().get('/', {'distance': 'far'})
+        self.assertEqual(views.similar(request, api='local', path='/', image_id='0').status_code, 400)
+
+
+class AggregateTest(SimpleTestCase):
+
+    @staticmethod
+    def summary(count, size, first, last, cover=None):
+        return {'count': count, 'bytes': size, 'first': first, 'last': last, 'cover': cover}
+
+    def test_remote_library(self):
+        from browser.lib.index.folder_summary import aggregate
+        totals = aggregate({
+            '2017/trip': self.summary(2, 10, 5., 8., cover='trip'),
+            '2017/trip/day1': self.summary(1, 3, 1., 1.),
+            '2017/empty': self.summary(0, 0, None, None),
+            '2018': self.summary(4, 20, 9., 12.),
+        }, '')
+        # The root of the container sums up the whole library
+        self.assertEqual(sorted(totals), ['', '2017', '2017/empty', '2017/trip', '2017/trip/day1', '2018'])
+        self.assertEqual(totals[''], self.summary(7, 33, 1., 12., cover='trip'))
+        self.assertEqual(totals['2017'], self.summary(3, 13, 1., 8., cover='trip'))
+        self.assertEqual(totals['2017/trip'], self.summary(3, 13, 1., 8., cover='trip'))
+        self.assertEqual(totals['2018'], self.summary(4, 20, 9., 12.))
+
+    def test_covers_come_from_first_sub_folder(self):
+        from browser.lib.index.folder_summary import aggregate
+        totals = aggregate({
+            '/pics': self.summary(1, 1, 1., 1.),
+            '/pics/b': self.summary(1, 1, 1., 1., cover='b'),
+            '/pics/a': self.summary(1, 1, 1., 1., cover='a'),
+        }, '/pics')
+        self.assertEqual(totals['/pics']['cover'], 'a')
+        self.assertEqual(totals['/pics']['count'], 3)
+        # Nothing is summed up above the root of the library
+        self.assertEqual(sorted(totals), ['/pics', '/pics/a', '/pics/b'])
+
+    def test_summaries_are_not_modified(self):
+        from browser.lib.index.folder_summary import aggregate
+        summaries = {'a': self.summary(1, 1, 1., 1.), 'a/b': self.summary(1, 1, 2., 2., cover='b')}
+        aggregate(summaries, '')
+        self.assertEqual(summaries['a'], self.summary(1, 1, 1., 1.))
+
+
+class DecodeSchedulerTest(SimpleTestCase):
+
+    class Image(object):
+        api_metadata = Meta
+        path = 'folder'
+
+        def __init__(self, name, processed=False):
+            self.name = name
+            self.processed = processed
+            self.decoded = threading.Event()
+
+        def is_processed(self):
+            return self.processed
+
+        def decode_encode(self, session_key=None):
+            self.decoded.set()
+
+    def setUp(self):
+        # Without workers, jobs are only taken by the test
+        self.scheduler = DecodeScheduler(0)
+
+    def jobs(self, n_jobs):
+        return [(session, image.name) for session, image in (self.scheduler._next_job() for _ in range(n_jobs))]
+
+    def test_sessions_are_served_in_turn(self):
+        self.scheduler.prefetch('a', [self.Image(n) for n in ('a1', 'a2', 'a3', 'a4')])
+        self.scheduler.prefetch('b', [self.Image('b1')])
+        self.scheduler.submit('c', self.Image('c1'))
+        self.scheduler.submit('c', self.Image('c2'))
+        self.assertEqual(self.jobs(7), [
+            ('a', 'a1'), ('b', 'b1'), ('c', 'c1'), ('a', 'a2'), ('c', 'c2'), ('a', 'a3'), ('a', 'a4'),
+        ])
+        self.assertEqual(self.scheduler.stats(), {'sessions': 3, 'pending': 0, 'running': 7})
+
+    def test_prefetch_only_replaces_own_jobs(self):
+        self.scheduler.prefetch('a', [self.Image('a1'), self.Image('a2')])
+        self.scheduler.prefetch('b', [self.Image('b1')])
+        self.scheduler.prefetch('a', [self.Image('a3')])
+        self.assertEqual(self.jobs(2), [('a', 'a3'), ('b', 'b1')])
+
+    def test_images_are_decoded_once(self):
+        self.scheduler.prefetch('a', [self.Image('shared'), self.Image('done', processed=True), self.Image('a1')])
+        self.scheduler.prefetch('b', [self.Image('shared'), self.Image('b1')])
+        self.assertEqual(self.jobs(3), [('a', 'shared'), ('b', 'b1'), ('a', 'a1')])
+
+    def test_idle_sessions_are_skipped(self):
+        self.scheduler.prefetch('a', [self.Image('a1')])
+        self.scheduler.prefetch('b', [self.Image('b1')])
+        self.scheduler._sessions['a']['time'] -= scheduler.IDLE_TIMEOUT + 1
+        self.assertEqual(self.jobs(1), [('b', 'b1')])
+
+    def test_cursor(self):
+        self.assertIsNone(self.scheduler.cursor('a'))
+        image = self.Image('a1')
+        image.id = 3
+        self.scheduler.focus('a', image, -1)
+        self.assertEqual(self.scheduler.cursor('a'), (('test', 'folder'), 3, -1))
+
+    def test_workers(self):
+        pool = DecodeScheduler(2)
+        images = [self.Image('a{}'.format(i)) for i in range(5)]
+        pool.prefetch('a', images)
+        for image in images:
+            self.assertTrue(image.decoded.wait(5))
+
+
+class SettingTest(TestCase):
+
+    def setUp(self):
+        Setting.invalidate()
+
+    def tearDown(self):
+        # The rollback of the test bypasses the signals dropping the cached settings
+        Setting.invalidate()
+
+    def test_defaults(self):
+        self.assertEqual(Setting.get('rendition_format'), 'jpeg')
+        self.assertEqual(Setting.get('rendition_quality'), 85)
+        self.assertIs(Setting.get('rendition_progressive'), True)
+        self.assertEqual(Setting.get('slideshow_interval'), 5.)
+
+    def test_values_are_read_in_one_query(self):
+        Setting.objects.create(name='rendition_quality', value='70')
+        with self.assertNumQueries(1):
+            self.assertEqual(Setting.get('rendition_quality'), 70)
+            self.assertEqual(Setting.get('rendition_format'), 'jpeg')
+            Setting.values()
+
+    def test_saves_and_deletes_invalidate_the_cache(self):
+        self.assertEqual(Setting.get('slideshow_interval'), 5.)
+        setting = Setting.by_name('slideshow_interval')
+        setting.value = '2.5'
+        setting.save()
+        self.assertEqual(Setting.get('slideshow_interval'), 2.5)
+        setting.delete()
+        self.assertEqual(Setting.get('slideshow_interval'), 5.)
+
+    def test_invalid_values_fall_back_on_defaults(self):
+        Setting.objects.create(name='rendition_format', value='gif')
+        Setting.objects.create(name='rendition_quality', value='high')
+        self.assertEqual(Setting.get('rendition_format'), 'jpeg')
+        self.assertEqual(Setting.get('rendition_quality'), 85)
+        self.assertRaises(ValueError, Setting.validate, 'rendition_quality', '0')
+        self.assertEqual(Setting.validate('home_path', '/anywhere'), '/anywhere')
+
+
+class WatcherTest(SimpleTestCase):
+
+    def setUp(self):
+        self.events = []
+        self.watcher = watcher.InotifyWatcher('/pics', lambda *event: self.events.append(event), lambda p, n: True)
+        self.watcher.watches = {1: '/pics'}
+
+    def tearDown(self):
+        os.close(self.watcher.fd)
+
+    @staticmethod
+    def event(wd, mask, name):
+        name = name.ljust(16, b'\0')
+        return watcher.EVENT_HEADER.pack(wd, mask, 0, len(name)) + name
+
+    def test_bad_events_are_skipped(self):
+        def fail(*event):
+            raise ValueError('callback failure')
+        self.watcher.dispatch(
+            self.event(1, watcher.IN_CREATE, b'bad\xff.jpg') + self.event(1, watcher.IN_CLOSE_WRITE, b'a.jpg')
+        )
+        self.assertEqual(self.events, [('modified', '/pics', 'a.jpg', False)])
+        self.watcher.callback = fail
+        self.watcher.dispatch(self.event(1, watcher.IN_DELETE, b'a.jpg'))
+
+    def test_moved_out_directory_is_unwatched(self):
+        self.watcher.watches = {1: '/pics', 2: '/pics/gone', 3: '/pics/gone/sub', 4: '/pics/gone2'}
+        self.watcher.dispatch(self.event(2, watcher.IN_MOVE_SELF, b''))
+        self.assertEqual(self.watcher.watches, {1: '/pics', 4: '/pics/gone2'})
+
+
+class LocalChangesTest(SimpleTestCase):
+
+    def setUp(self):
+        self.api = registry.get_backend('local')
+        self.saved = self.api.file_index, self.api.file_index_root
+        self.api.file_index, self.api.file_index_root = TrigramIndex(), '/pics'
+
+    def tearDown(self):
+        self.api.file_index, self.api.file_index_root = self.saved
+
+    def test_changes_outside_of_the_library_are_ignored(self):
+        self.api.apply_change('created', '/pics2', 'x.jpg', False)
+        self.api.apply_change('created', '/pics/trip', 'y.jpg', False)
+        self.assertEqual(self.api.file_index.all_files(), {('/pics/trip', 'y.jpg')})
+
+    def test_modified_files_outdate_their_summary(self):
+        self.api.file_index.set_summary('/pics/trip', {'version': 1.})
+        self.api.apply_change('modified', '/pics/trip', 'y.jpg', False)
+        self.assertIsNone(self.api.file_index.summary('/pics/trip')['version'])
+
+
+class LocalSummaryTest(SimpleTestCase):
+
+    def setUp(self):
+        from PIL import Image
+        self.root = tempfile.mkdtemp()
+        os.makedirs(os.path.join(self.root, 'trip', 'day1'))
+        for folder, name in [('', 'a.jpg'), ('trip/day1', 'b.jpg'), ('trip/day1', 'c.jpg')]:
+            Image.new('RGB', (40, 20)).save(os.path.join(self.root, folder, name))
+        self.api = registry.get_backend('local')
+
+    def tearDown(self):
+        shutil.rmtree(self.root)
+
+    def test_summaries_reuse_the_index_refresh(self):
+        from browser.lib.index.folder_summary import summarize_folders
+        index = TrigramIndex()
+        self.api.refresh_file_index(index, self.root)
+
+        class NoWalkAPI(self.api):
+            @classmethod
+            def timeline_folders(cls, root):
+                raise AssertionError('The library is walked again')
+
+        summarize_folders(NoWalkAPI, index, self.root)
+        self.assertEqual(index.totals[self.root]['count'], 3)
+        self.assertEqual(index.totals[os.path.join(self.root, 'trip')]['count'], 2)
+
+    def test_images_deleted_while_listed_are_skipped(self):
+        # Stands for a file deleted between the directory listing and its stat
+        os.symlink(os.path.join(self.root, 'gone.jpg'), os.path.join(self.root, 'dangling.jpg'))
+        self.assertEqual([name for _, _, name in self.api.image_stats(self.root)], ['a.jpg'])
+        self.assertEqual([name for _, name in self.api.dated_images(self.root)], ['a.jpg'])
+
+
+class PreviewDecodeTest(SimpleTestCase):
+
+    def setUp(self):
+        from PIL import Image
+        self.folder = tempfile.mkdtemp()
+        Image.new('RGB', (400, 200)).save(os.path.join(self.folder, 'a.jpg'))
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def test_previews_keep_full_dimensions(self):
+        image = registry.get_backend('local').create_image(0, self.folder, 'a.jpg')
+        decoded = image.decode(preview=True)
+        decoded.load()
+        self.assertEqual(decoded.size, (200, 100))
+        self.assertEqual((image.size, image.orientation), ((400, 200), 0))
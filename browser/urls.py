@@ -2,15 +2,40 @@
 from django.conf.urls import url
 
 from . import views
+from .lib.api.registry import backend_names
+
+# Storage backend prefix, shared by all backends: adding a backend in the settings is enough to browse it
+API = r'^(?P<api>' + '|'.join(backend_names()) + r')/'
+PATH = r'(?P<path>[\/\w\-\s]+)'
+IMAGE = PATH + r'/image_id/(?P<image_id>[0-9]+)'
 
 
 urlpatterns = [
-    url(r'^$', views.local, name='index'),
+    url(r'^$', views.browse, {'api': 'local'}, name='index'),
     url(r'^settings/$', views.settings, name='settings'),
-    url(r'^local/$', views.local, name='local_default'),
-    url(r'^local/(?P<path>[\/\w\-\s]+)/$', views.local, name='local'),
-    url(r'^local/show/(?P<path>[\/\w\-\s]+)/image_id/(?P<image_id>[0-9]+)[\/]*$', views.local_show, name='local_show'),
-    url(r'^hubic/$', views.hubic, name='hubic_default'),
-    url(r'^hubic/(?P<path>[\/\w\-\s]+)/$', views.hubic, name='hubic'),
-    url(r'^hubic/show/(?P<path>[\/\w\-\s]+)/image_id/(?P<image_id>[0-9]+)[\/]*$', views.hubic_show, name='hubic_show'),
-]
\ No newline at end of file
+    url(r'^prefetch/stats/$', views.prefetch_stats, name='prefetch_stats'),
+    url(r'^export/(?P<job_id>[0-9a-f]+)/$', views.export_status, name='export_status'),
+    url(r'^slideshow/report/$', views.slideshow_report, name='slideshow_report'),
+    url(r'^local/export/' + PATH + r'/$', views.local_export, name='local_export'),
+    url(API + r'$', views.browse, name='browse_default'),
+    url(API + r'search/$', views.search, name='search'),
+    url(API + r'duplicates/$', views.duplicates, name='duplicates'),
+    url(API + r'similar/' + IMAGE + r'/$', views.similar, name='similar'),
+    url(API + r'listing/' + PATH + r'/$', views.listing, name='listing'),
+    url(API + r'timeline/(?P<path>[\/\w\-\s]*)/$', views.timeline, name='timeline'),
+    url(API + r'show/' + PATH + r'/name/(?P<name>[^\/]+)$', views.show_name, name='show_name'),
+    url(API + r'cast/' + IMAGE + r'/$', views.cast, name='cast'),
+    url(API + r'cast/' + IMAGE + r'\.jpg$', views.cast_image, name='cast_image'),
+    url(API + r'slideshow/' + IMAGE + r'/$', views.slideshow, name='slideshow'),
+    url(API + r'slideshow/' + PATH + r'/next/$', views.slideshow_next, name='slideshow_next'),
+    url(API + r'slideshow/' + IMAGE + r'/(?P<mode>full|preview)/$', views.slideshow_frame, name='slideshow_frame'),
+    url(API + r'zoom/' + IMAGE + r'/$', views.zoom, name='zoom'),
+    url(API + r'zoom/' + IMAGE + r'/image\.dzi$', views.zoom_dzi, name='zoom_dzi'),
+    url(
+        API + r'zoom/' + IMAGE + r'/image_files/(?P<level>[0-9]+)/(?P<col>[0-9]+)_(?P<row>[0-9]+)\.jpeg$',
+        views.zoom_tile,
+        name='zoom_tile',
+    ),
+    url(API + PATH + r'/$', views.browse, name='browse'),
+    url(API + r'show/' + IMAGE + r'[\/]*$', views.show, name='show'),
+]
@@ -1,68 +1,240 @@
 # -*- coding: utf-8 -*-
 from __future__ import unicode_literals
 
+from django.core.urlresolvers import NoReverseMatch
+from django.core.urlresolvers import reverse
+from django.middleware.csrf import get_token
+from django.shortcuts import redirect
 from django.shortcuts import render
+from django.template.loader import render_to_string
+from django.utils.cache import patch_vary_headers
+from django.utils.http import parse_etags
+from django.utils.http import quote_etag
+from django.views.decorators.http import require_POST
+from django.http import Http404
 from django.http import HttpResponse
+from django.http import HttpResponseBadRequest
+from django.http import HttpResponseNotModified
+from django.http import JsonResponse
 
 import json
+import os
+from datetime import datetime
+from functools import wraps
 
-from browser.lib.api.local_api import LocalAPI
-from browser.lib.api.hubic_api import HubicAPI
+from browser.lib.api.registry import BackendUnavailable
+from browser.lib.api.registry import get_backend
+from browser.lib.image.base_image import BaseImage
 from browser.lib.image.base_image import MAX_CACHE
+from browser.lib.image.cast import CastStage
+from browser.lib.image.deep_zoom import DeepZoom
+from browser.lib.image.export import ExportJob
+from browser.lib.image.gallery_cache import GalleryCache
+from browser.lib.image.image_listing import ImageRecord
+from browser.lib.image.prefetch import PrefetchPolicy
+from browser.lib.image.rendition_cache import Encoder
+from browser.lib.image.slideshow import Slideshow
 
 from browser.models import Setting
+from browser.models import positive_float
 
 # '/media/thomas/external/Pictures'
 GALLERY_NCOL = 6
 
 
+def backend(name):
+    # Storage backends are loaded on first use, a misconfigured one only failing its own pages
+    try:
+        return get_backend(name)
+    except BackendUnavailable as e:
+        raise Http404(str(e))
+
+
+def backend_view(view):
+    # Views are shared by all storage backends, the URL naming the one to use
+    @wraps(view)
+    def wrapper(request, api, *args, **kwargs):
+        return view(request, backend(api), *args, **kwargs)
+    return wrapper
+
+
+def library_root(api):
+    # The local library is rooted in the home directory, remote ones in their container
+    return api.root if api.Meta.remote else Setting.get('home_path')
+
+
 def index(request):
-    return render_content(request, LocalAPI, Setting.by_name('home_path').value)
+    return render_content(request, backend('local'), Setting.get('home_path'))
 
 def settings(request):
-    _, _, autocomplete_source = LocalAPI.folder_content(Setting.by_name('home_path').value)
+    local_api = backend('local')
+    _, _, autocomplete_source = local_api.folder_content(Setting.get('home_path'))
 
-    # Storing data if POST
+    # Storing data if POST, only writing the settings which changed, and nothing if any value is invalid
+    errors = {}
     if request.method == 'POST':
-        s = Setting.by_name('home_path')
-        s.value = request.POST['home_path']
-        s.save()
+        values = Setting.values()
+        changes = {}
+        for name in Setting.defaults():
+            if name in request.POST and request.POST[name] != values[name]:
+                try:
+                    Setting.validate(name, request.POST[name])
+                    changes[name] = request.POST[name]
+                except ValueError as e:
+                    errors[name] = str(e)
+        if not errors:
+            for name, value in changes.items():
+                s = Setting.by_name(name)
+                s.value = value
+                s.save()
+            configure_encoder()
 
     context = {
-        'api': LocalAPI.Meta.name,
+        'api': local_api.Meta.name,
         'autocomplete_source': json.dumps(autocomplete_source),
         'settings': Setting.all(),
+        'errors': sorted(errors.values()),
     }
-    return render(request, 'browser/settings.html', context)
+    return render(request, 'browser/settings.html', context, status=400 if errors else 200)
+
+@backend_view
+def browse(request, api, path=None):
+    root = library_root(api)
+    api.watch(root)
+    return render_content(request, api, path or root)
+
+
+@require_POST
+def local_export(request, path):
+    local_api = backend('local')
+    _, images, _ = local_api.folder_content(path)
+    names = set(request.POST.getlist('names'))
+    # Exports are only written inside the library
+    root = os.path.realpath(library_root(local_api))
+    output = os.path.realpath(request.POST.get('output') or os.path.join(path, 'export'))
+    if output != root and not output.startswith(root.rstrip('/') + '/'):
+        return HttpResponseBadRequest('Exports must be written under {}'.format(root))
+    try:
+        max_size = int(request.POST['size']) if request.POST.get('size') else None
+        if max_size is not None and max_size < 1:
+            raise ValueError('Export size must be positive: {}'.format(max_size))
+        job = ExportJob(
+            path,
+            [name for name in images.names if not names or name in names],
+            local_api.create_image,
+            output,
+            format=request.POST.get('format', 'jpeg'),
+            max_size=max_size,
+        )
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    return redirect('export_status', job_id=job.start())
+
 
-def local(request, path=None):
-    return render_content(request, LocalAPI, path or Setting.by_name('home_path').value)
+def export_status(request, job_id):
+    job = ExportJob.get(job_id)
+    if job is None:
+        raise Http404('No such export job')
+    return JsonResponse(job.status())
 
 
-def hubic(request, path=''):
-    return render_content(request, HubicAPI, path)
+@backend_view
+def show_name(request, api, path, name):
+    _, images, _ = api.folder_content(path)
+    try:
+        image_id = images.index(name)
+    except ValueError:
+        # The file name index lags behind the library until its next refresh
+        raise Http404('No image {} in {}'.format(name, path))
+    return redirect('show', api=api.Meta.name, path=path, image_id=image_id)
+
+
+@backend_view
+def search(request, api):
+    results = []
+    for directory, name in api.search_files(library_root(api), request.GET.get('term', '')):
+        try:
+            url = reverse('show_name', kwargs={'api': api.Meta.name, 'path': directory, 'name': name})
+        except NoReverseMatch:
+            # Folders whose path can't be routed (e.g. the root of a container, or dots in names) can't be browsed
+            continue
+        results.append({'label': '/'.join([directory, name]), 'value': url})
+    return JsonResponse(results, safe=False)
+
+
+def duplicate_entry(api, directory, name, distance=None):
+    entry = {
+        'directory': directory,
+        'name': name,
+        'url': reverse('show_name', kwargs={'api': api.Meta.name, 'path': directory, 'name': name}),
+    }
+    if distance is not None:
+        entry['distance'] = distance
+    return entry
+
 
+def hash_distance(request):
+    # Hamming distance between perceptual hashes (64 bits), None for the default one
+    distance = request.GET.get('distance')
+    if not distance:
+        return None
+    distance = int(distance)
+    if not 0 <= distance <= 64:
+        raise ValueError('Distance must be between 0 and 64: {}'.format(distance))
+    return distance
 
-def local_show(request, path, image_id):
-    return show(request, LocalAPI, path, image_id)
 
+@backend_view
+def duplicates(request, api):
+    # Hashing runs in the background: groups are computed from the hashes available so far
+    root = library_root(api)
+    index = api.perceptual_index(root)
+    try:
+        distance = hash_distance(request)
+        groups = index.duplicates() if distance is None else index.duplicates(distance)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    job = api.hashing_job
+    if job is None or request.GET.get('refresh'):
+        job = api.hash_library(root)
+    return JsonResponse({
+        'job': job.status(),
+        'groups': [[duplicate_entry(api, directory, name) for directory, name in group] for group in groups],
+    })
 
-def hubic_show(request, path, image_id):
-    return show(request, HubicAPI, path, image_id)
 
+@backend_view
+def similar(request, api, path, image_id):
+    try:
+        distance = hash_distance(request)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    _, images, _ = api.folder_content(path)
+    results = api.similar_images(library_root(api), images[int(image_id)], distance)
+    return JsonResponse(
+        [duplicate_entry(api, directory, name, distance) for (directory, name), distance in results], safe=False
+    )
 
+
+@backend_view
 def show(request, api, path, image_id):
     # Practically path has not changed and we could directly use current_content, this is just safer
     _, images, _ = api.folder_content(path)
-    # Fetching requested image and clearing background queue, since we're going to replenish it with prioritary jobs
     image = images[int(image_id)]
-    image.clear_queue()
-    # Asynchronously processing MAX_CACHE images (previous and few next ones)
-    for offset in range(1, MAX_CACHE) + [-1]:
-        images[(int(image_id) + offset) % len(images)].decode_encode_async()
+    configure_encoder()
+    PrefetchPolicy.record_hit(image.is_processed())
+    if request.session.session_key is None:
+        request.session.save()
+    session_key = request.session.session_key
+    state = PrefetchPolicy.record_navigation(session_key, int(image_id))
+    # Asynchronously processing up to MAX_CACHE images around the current one, depending on the navigation: these jobs
+    # replace the pending ones of this session only, other sessions keep their own prefetch window
+    BaseImage.focus(session_key, image, state['direction'])
+    offsets = PrefetchPolicy.offsets(state, images, MAX_CACHE - 1)
+    BaseImage.prefetch(session_key, [images[(int(image_id) + offset) % len(images)] for offset in offsets])
 
     # Processing current image (will skip automatically if previously processed)
-    image.decode_encode()
+    image.decode_encode(session_key)
     context = {
         'api': api.Meta.name,
         'image': image,
@@ -73,17 +245,248 @@ def show(request, api, path, image_id):
     return render(request, 'browser/show.html', context)
 
 
-def render_content(request, api, path, ncol=GALLERY_NCOL):
-    folders, images, autocomplete_source = api.folder_content(path)
-    images =  [images[x:min(x + ncol, len(images))] for x in range(0, len(images), ncol)]
+@backend_view
+def timeline(request, api, path=None):
+    path = path or library_root(api)
+    cursor = request.GET.get('cursor')
+    try:
+        entries, next_cursor = api.timeline(path).page(cursor)
+    except (ValueError, TypeError):
+        return HttpResponseBadRequest('Invalid timeline cursor')
     context = {
         'api': api.Meta.name,
         'path': path,
-        'folders': folders,
-        'autocomplete_source': json.dumps(autocomplete_source),
-        'images': {
-            'array': images,
-            'ncols': ncol,
+        'entries': [
+            {
+                'date': datetime.fromtimestamp(timestamp).strftime('%Y-%m-%d'),
+                'image': ImageRecord(None, folder, name, api.Meta),
+            }
+            for timestamp, folder, name in entries
+        ],
+        'next_cursor': next_cursor,
+    }
+    # Following pages are only fragments, appended by the page while scrolling
+    if cursor:
+        return render(request, 'browser/_timeline_page.html', context)
+    _, _, autocomplete_source = api.folder_content(path)
+    context['autocomplete_source'] = json.dumps(autocomplete_source)
+    return render(request, 'browser/timeline.html', context)
+
+
+def slide_interval(request):
+    # Seconds between two slides, the setting being used when the requested interval is missing or invalid
+    try:
+        return positive_float(request.GET['interval'])
+    except (KeyError, ValueError):
+        return Setting.get('slideshow_interval')
+
+
+@backend_view
+def cast(request, api, path, image_id):
+    _, images, _ = api.folder_content(path)
+    CastStage.stage(images, int(image_id))
+    context = {
+        'api': api.Meta.name,
+        'image': images[int(image_id)],
+        'n_images': len(images),
+        'interval': slide_interval(request),
+    }
+    return render(request, 'browser/cast.html', context)
+
+
+@backend_view
+def cast_image(request, api, path, image_id):
+    _, images, _ = api.folder_content(path)
+    # Keeping the queue of cast-ready slides ahead of the one being fetched
+    CastStage.stage(images, int(image_id))
+    # The URL names a position in the folder, not a file: receivers revalidate against the file version
+    image = images[int(image_id)]
+    etag = quote_etag(CastStage.key(image))
+    if etag in parse_etags(request.META.get('HTTP_IF_NONE_MATCH', '')):
+        response = HttpResponseNotModified()
+    else:
+        rendition = CastStage.rendition(image)
+        response = HttpResponse(rendition, content_type='image/jpeg')
+        response['Content-Length'] = len(rendition)
+    response['ETag'] = etag
+    response['Cache-Control'] = 'no-cache'
+    response['Access-Control-Allow-Origin'] = '*'
+    return response
+
+
+@backend_view
+def slideshow(request, api, path, image_id):
+    _, images, _ = api.folder_content(path)
+    configure_encoder()
+    if request.session.session_key is None:
+        request.session.save()
+    show = Slideshow.start(request.session.session_key, images, int(image_id), slide_interval(request))
+    image = images[int(image_id)]
+    context = {
+        'api': api.Meta.name,
+        'image': image,
+        'mode': show.ready_mode(image) or 'full',
+        'n_images': len(images),
+        'interval': show.interval,
+    }
+    return render(request, 'browser/slideshow.html', context)
+
+
+def running_slideshow(request, path):
+    show = Slideshow.get(request.session.session_key)
+    if show is None or show.images.path != path:
+        raise Http404('No slideshow running on this folder')
+    return show
+
+
+@backend_view
+def slideshow_next(request, api, path):
+    show = running_slideshow(request, path)
+    image_id, mode = show.advance()
+    return JsonResponse({
+        'image_id': image_id,
+        'mode': mode,
+        'src': reverse(
+            'slideshow_frame', kwargs={'api': api.Meta.name, 'path': path, 'image_id': image_id, 'mode': mode}
+        ),
+        'report': show.report(),
+    })
+
+
+@backend_view
+def slideshow_frame(request, api, path, image_id, mode):
+    data, mime = running_slideshow(request, path).frame(int(image_id), mode)
+    response = HttpResponse(data, content_type=mime)
+    response['Content-Length'] = len(data)
+    return response
+
+
+def slideshow_report(request):
+    show = Slideshow.get(request.session.session_key)
+    if show is None:
+        raise Http404('No slideshow running')
+    return JsonResponse(show.report())
+
+
+@backend_view
+def zoom(request, api, path, image_id):
+    _, images, _ = api.folder_content(path)
+    context = {
+        'api': api.Meta.name,
+        'image': images[int(image_id)],
+    }
+    return render(request, 'browser/zoom.html', context)
+
+
+@backend_view
+def zoom_dzi(request, api, path, image_id):
+    _, images, _ = api.folder_content(path)
+    configure_encoder()
+    return HttpResponse(DeepZoom.of(images[int(image_id)]).descriptor(), content_type='application/xml')
+
+
+@backend_view
+def zoom_tile(request, api, path, image_id, level, col, row):
+    _, images, _ = api.folder_content(path)
+    tile = DeepZoom.of(images[int(image_id)]).tile(int(level), int(col), int(row))
+    if tile is None:
+        raise Http404('No such tile')
+    return HttpResponse(tile, content_type='image/jpeg')
+
+
+def configure_encoder():
+    # Settings are cached in process, so this is called on every image view without querying the database
+    encoder = Encoder(
+        format=Setting.get('rendition_format'),
+        quality=Setting.get('rendition_quality'),
+        progressive=Setting.get('rendition_progressive'),
+    )
+    if encoder.params() != BaseImage.encoder.params():
+        BaseImage.encoder = encoder
+
+
+def prefetch_stats(request):
+    return JsonResponse(PrefetchPolicy.stats())
+
+
+def render_content(request, api, path, ncol=GALLERY_NCOL):
+    folders, images, autocomplete_source = api.folder_content(path)
+    summaries = api.folder_summaries(library_root(api), [folder['value'] for folder in folders])
+    folders = [dict(folder, summary=folder_card(summary)) for folder, summary in zip(folders, summaries)]
+    autocomplete_source = json.dumps(autocomplete_source)
+    key = GalleryCache.key('page', path, ncol, images.signature(), folders, autocomplete_source)
+    entry = GalleryCache.get(key)
+    if entry is None:
+        images = [list(images.records(x, x + ncol)) for x in range(0, len(images), ncol)]
+        context = {
+            'api': api.Meta.name,
+            'path': path,
+            'folders': folders,
+            'autocomplete_source': autocomplete_source,
+            'images': {
+                'array': images,
+                'ncols': ncol,
+            }
         }
+        html = render_to_string('browser/index.html', context, request=request)
+        entry = GalleryCache.put(key, html.encode('utf-8'), 'text/html; charset=utf-8')
+    # The page is shared by all users: the export form reads the CSRF token from its cookie, set here
+    get_token(request)
+    return cached_response(request, entry)
+
+
+def folder_card(summary):
+    # Folder summaries are computed in the background, cards only show what is known so far
+    if summary is None or not summary['count']:
+        return None
+    dates = [datetime.fromtimestamp(summary[k]).strftime('%Y-%m-%d') for k in ('first', 'last')]
+    return {
+        'count': summary['count'],
+        'bytes': summary['bytes'],
+        'dates': dates[0] if dates[0] == dates[1] else ' - '.join(dates),
+        'cover': summary['cover'],
     }
-    return render(request, 'browser/index.html', context)
+
+
+@backend_view
+def listing(request, api, path):
+    folders, images, _ = api.folder_content(path)
+    summaries = api.folder_summaries(library_root(api), [folder['value'] for folder in folders])
+    folders = [dict(folder, summary=folder_card(summary)) for folder, summary in zip(folders, summaries)]
+    for folder in folders:
+        if folder['summary'] is not None:
+            # Covers are only inlined in the HTML gallery
+            folder['summary'] = {k: v for k, v in folder['summary'].items() if k != 'cover'}
+    key = GalleryCache.key('json', path, images.signature(), folders)
+    entry = GalleryCache.get(key)
+    if entry is None:
+        records = []
+        for record in images.records():
+            records.append({
+                'id': record.id,
+                'name': record.name,
+                'url': reverse('show', kwargs={'api': api.Meta.name, 'path': record.path, 'image_id': record.id}),
+            })
+            if images.sizes is not None:
+                records[-1].update({'last_modified': images.mtimes[record.id], 'bytes': images.sizes[record.id]})
+        content = {'api': api.Meta.name, 'path': path, 'folders': folders, 'images': records}
+        entry = GalleryCache.put(key, json.dumps(content), 'application/json')
+    return cached_response(request, entry)
+
+
+def cached_response(request, entry):
+    # Galleries are sent compressed when the browser supports it, and not sent again while their ETag still matches
+    compressed = 'gzip' in request.META.get('HTTP_ACCEPT_ENCODING', '')
+    etag = quote_etag(entry['etag'] + ('-gzip' if compressed else ''))
+    known = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+    if '*' in known or etag in known:
+        response = HttpResponseNotModified()
+    else:
+        response = HttpResponse(entry['gzip'] if compressed else entry['body'], content_type=entry['content_type'])
+        if compressed:
+            response['Content-Encoding'] = 'gzip'
+    response['ETag'] = etag
+    # Cached by the browser, but always revalidated: a changed folder must show up right away
+    response['Cache-Control'] = 'no-cache'
+    patch_vary_headers(response, ('Accept-Encoding',))
+    return response
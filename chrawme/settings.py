@@ -64,6 +64,7 @@ TEMPLATES = [
                 'django.template.context_processors.request',
                 'django.contrib.auth.context_processors.auth',
                 'django.contrib.messages.context_processors.messages',
+                'browser.context_processors.backends',
             ],
         },
     },
@@ -166,3 +167,17 @@ BOOTSTRAP3 = {
     },
 }
 
+
+# Storage backends, browsed under /browser/<name>/. Each one is described by the dotted path of its API class, and
+# driver specific options
+BROWSER_BACKENDS = {
+    'local': {'class': 'browser.lib.api.local_api.LocalAPI'},
+    'hubic': {'class': 'browser.lib.api.hubic_api.HubicAPI'},
+    # Swift or S3 compatible object store, e.g. served by `python manage.py stand_in_store <directory>`
+    # 'photos': {
+    #     'class': 'browser.lib.api.object_store_api.ObjectStoreAPI',
+    #     'protocol': 'swift',
+    #     'endpoint': 'http://127.0.0.1:8900/v1/AUTH_test',
+    #     'container': 'photos',
+    # },
+}